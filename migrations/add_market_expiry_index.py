@@ -0,0 +1,41 @@
+"""
+Database migration script to add the expiry indexes to the MarketItem and MarketBid tables
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+def run_migration():
+    """Run the migration to index active market orders by expiry date"""
+    print("Starting migration to add market expiry indexes...")
+    
+    with app.app_context():
+        try:
+            # Serve the hourly sweep of expired listings and buy orders
+            db.session.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS ix_market_item_expiry
+            ON market_item (is_active, expires_at)
+            """))
+            if inspect(db.engine).has_table('market_bid'):
+                db.session.execute(sql_text("""
+                CREATE INDEX IF NOT EXISTS ix_market_bid_expiry
+                ON market_bid (is_active, expires_at)
+                """))
+            
+            db.session.commit()
+            print("Successfully added market expiry indexes.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,35 @@
+"""
+Database migration script to add the order book index to MarketItem table
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from sqlalchemy.sql import text as sql_text
+
+def run_migration():
+    """Run the migration to index active listings in price-time priority"""
+    print("Starting migration to add order book index to MarketItem table...")
+    
+    with app.app_context():
+        try:
+            # Serves the per-resource best-price reads and the paginated market listings
+            db.session.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS ix_market_item_book
+            ON market_item (resource_type, is_active, price_per_unit, created_at)
+            """))
+            
+            db.session.commit()
+            print("Successfully added order book index to MarketItem table.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
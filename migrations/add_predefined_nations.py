@@ -21,6 +21,7 @@ def run_migration():
     with app.app_context():
         # Check if we already have nations in the database
         from models import Nation, User, Resource, Military, Technology
+        from utils.tech_state import new_technology_state
         
         # Force migration regardless of existing nations (comment this out to restore the check)
         existing_nations = []
@@ -157,6 +158,9 @@ def run_migration():
                 last_updated=datetime.utcnow()
             )
             db.session.add(military)
+            
+            # Create technology state for nation
+            db.session.add(new_technology_state(nation.id))
         
         # Commit all changes
         db.session.commit()
@@ -0,0 +1,35 @@
+"""
+Database migration script to add the (researching, estimated_completion) index to Technology table
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from sqlalchemy.sql import text as sql_text
+
+def run_migration():
+    """Run the migration to index research in progress by completion time"""
+    print("Starting migration to add research completion index to Technology table...")
+    
+    with app.app_context():
+        try:
+            # Used to find due research without scanning the whole technology table
+            db.session.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS ix_technology_researching_completion
+            ON technology (researching, estimated_completion)
+            """))
+            
+            db.session.commit()
+            print("Successfully added research completion index to Technology table.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
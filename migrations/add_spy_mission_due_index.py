@@ -0,0 +1,35 @@
+"""
+Database migration script to add the (is_completed, completion_date) index to SpyMission table
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from sqlalchemy.sql import text as sql_text
+
+def run_migration():
+    """Run the migration to index open spy missions by completion time"""
+    print("Starting migration to add due mission index to SpyMission table...")
+    
+    with app.app_context():
+        try:
+            # Used by the mission check job to find due missions without scanning every mission
+            db.session.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS ix_spy_mission_due
+            ON spy_mission (is_completed, completion_date)
+            """))
+            
+            db.session.commit()
+            print("Successfully added due mission index to SpyMission table.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
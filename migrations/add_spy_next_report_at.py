@@ -0,0 +1,66 @@
+"""
+Database migration script to add next_report_at to DeployedSpy table
+Periodic reports from long-term spies are now scheduled by this column instead of
+being derived from the deployment time on every run of the spy update job.
+Run this script directly to perform the migration
+"""
+import sys
+import os
+from datetime import datetime
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.sql import text as sql_text
+from utils.advanced_espionage import PERIODIC_REPORT_INTERVAL
+
+def run_migration():
+    """Run the migration to schedule periodic spy reports"""
+    print("Starting migration to add next_report_at to DeployedSpy table...")
+    
+    with app.app_context():
+        try:
+            columns = [column['name'] for column in inspect(db.engine).get_columns('deployed_spy')]
+            if 'next_report_at' not in columns:
+                db.session.execute(sql_text("ALTER TABLE deployed_spy ADD COLUMN next_report_at TIMESTAMP"))
+                print("Added next_report_at column to deployed_spy table.")
+            
+            # Next 14-day mark of every active deployment
+            now = datetime.utcnow()
+            schedule = []
+            for spy_id, deployment_date in db.session.execute(sql_text(
+                "SELECT id, deployment_date FROM deployed_spy WHERE is_active = :active AND next_report_at IS NULL"
+            ), {"active": True}).all():
+                if isinstance(deployment_date, str):
+                    deployment_date = datetime.fromisoformat(deployment_date)
+                next_report_at = (deployment_date or now) + PERIODIC_REPORT_INTERVAL
+                while next_report_at <= now:
+                    next_report_at += PERIODIC_REPORT_INTERVAL
+                schedule.append({"b_id": spy_id, "b_next": next_report_at})
+            
+            if schedule:
+                db.session.execute(
+                    sql_text("UPDATE deployed_spy SET next_report_at = :b_next WHERE id = :b_id")
+                    .bindparams(bindparam("b_next", type_=db.DateTime)),
+                    schedule
+                )
+            print(f"Scheduled periodic reports for {len(schedule)} spies.")
+            
+            # Used by the spy update job to find spies due for a report
+            db.session.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS ix_deployed_spy_next_report
+            ON deployed_spy (is_active, next_report_at)
+            """))
+            
+            db.session.commit()
+            print("Successfully added next_report_at to DeployedSpy table.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
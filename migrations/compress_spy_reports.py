@@ -0,0 +1,90 @@
+"""
+Database migration script to compress SpyReport content
+Adds the report_payload column, moves the JSON text of existing reports into it
+as zlib-compressed JSON, creates the report lookup and listing indexes and applies
+the report retention limit.
+Run this script directly to perform the migration
+"""
+import sys
+import os
+import json
+import zlib
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.sql import text as sql_text
+from utils.spy_reports import SPY_REPORT_RETENTION, prune_spy_reports
+
+BATCH_SIZE = 1000
+
+def run_migration():
+    """Run the migration to compress spy report content"""
+    print("Starting migration to compress SpyReport content...")
+    
+    with app.app_context():
+        try:
+            columns = [column['name'] for column in inspect(db.engine).get_columns('spy_report')]
+            if 'report_payload' not in columns:
+                payload_type = db.LargeBinary().compile(dialect=db.engine.dialect)
+                db.session.execute(sql_text(f"ALTER TABLE spy_report ADD COLUMN report_payload {payload_type}"))
+                print("Added report_payload column to spy_report table.")
+            
+            # Drop reports past the retention limit first so they are not compressed
+            deleted = prune_spy_reports()
+            print(f"Deleted {deleted} reports beyond the latest {SPY_REPORT_RETENTION} per target and type.")
+            
+            converted = 0
+            last_id = 0
+            while True:
+                rows = db.session.execute(sql_text(
+                    "SELECT id, report_content FROM spy_report "
+                    "WHERE id > :last_id AND report_payload IS NULL AND report_content IS NOT NULL "
+                    "ORDER BY id LIMIT :batch"
+                ), {"last_id": last_id, "batch": BATCH_SIZE}).all()
+                if not rows:
+                    break
+                
+                batch = []
+                for report_id, report_content in rows:
+                    try:
+                        content = json.loads(report_content)
+                    except ValueError:
+                        content = {"text": report_content}
+                    batch.append({
+                        "b_id": report_id,
+                        "b_payload": zlib.compress(json.dumps(content, separators=(',', ':')).encode('utf-8'))
+                    })
+                db.session.execute(
+                    sql_text("UPDATE spy_report SET report_payload = :b_payload, report_content = NULL WHERE id = :b_id")
+                    .bindparams(bindparam("b_payload", type_=db.LargeBinary)),
+                    batch
+                )
+                converted += len(batch)
+                last_id = rows[-1][0]
+            print(f"Compressed {converted} reports.")
+            
+            # Used by the report retention job and the per-target report lookups
+            db.session.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS ix_spy_report_lookup
+            ON spy_report (nation_id, target_nation_id, report_type, report_date)
+            """))
+            
+            # Used by the cursor-paginated report listing
+            db.session.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS ix_spy_report_listing
+            ON spy_report (nation_id, report_date, id)
+            """))
+            
+            db.session.commit()
+            print("Successfully compressed SpyReport content.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
@@ -20,6 +20,7 @@ def run_migration():
         try:
             # Import models
             from models import User, Nation, Resource, Military, Technology
+            from utils.tech_state import new_technology_state
             
             # Delete all existing users (dangerous! use with caution)
             # User.query.delete()
@@ -102,6 +103,9 @@ def run_migration():
             )
             db.session.add(australia_military)
             
+            # Technology state of a nation without technologies
+            db.session.add(new_technology_state(australia_nation.id))
+            
             # Commit all changes
             db.session.commit()
             print("Successfully created admin user Francis with Australia as nation.")
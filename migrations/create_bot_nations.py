@@ -12,6 +12,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import db, app
 from models import User, Nation, Resource, Military, Technology
+from utils.tech_state import new_technology_state
 
 # Lista di nomi per i bot
 FIRST_NAMES = ["Alexander", "Victor", "Sophia", "Isabella", "William", "James", "Emma", "Olivia", "Leonardo", "Marcus"]
@@ -122,6 +123,9 @@ def create_bot_nation(bot_index):
     )
     db.session.add(bot_military)
     
+    # Technology state of a nation without technologies
+    db.session.add(new_technology_state(bot_nation.id))
+    
     print(f"Created bot nation: {country['name']} ruled by {first_name} {last_name}")
     return bot_user, bot_nation
 
@@ -0,0 +1,42 @@
+"""
+Database migration script to create the market_bid table (standing buy orders)
+and add market_bid_id to the Trade table
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from models import MarketBid
+from sqlalchemy import inspect
+from sqlalchemy.sql import text as sql_text
+
+def run_migration():
+    """Run the migration to add standing buy orders to the market"""
+    print("Starting migration to create market_bid table...")
+    
+    with app.app_context():
+        try:
+            # Create the table (and its bid book index) if it doesn't exist
+            MarketBid.__table__.create(db.engine, checkfirst=True)
+            
+            columns = [column['name'] for column in inspect(db.engine).get_columns('trade')]
+            if 'market_bid_id' not in columns:
+                db.session.execute(sql_text(
+                    "ALTER TABLE trade ADD COLUMN market_bid_id INTEGER REFERENCES market_bid (id)"
+                ))
+                print("Added market_bid_id column to trade table.")
+            
+            db.session.commit()
+            print("Successfully created market_bid table.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
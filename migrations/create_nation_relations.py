@@ -0,0 +1,32 @@
+"""
+Database migration script to create the sparse diplomatic relation tables
+(nation_relation, relation_modifier, relation_action)
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from models import NationRelation, RelationModifier, RelationAction
+
+def run_migration():
+    """Run the migration to create the diplomatic relation tables"""
+    print("Starting migration to create diplomatic relation tables...")
+    
+    with app.app_context():
+        try:
+            # Create the tables (and their indexes) if they don't exist
+            for model in (NationRelation, RelationModifier, RelationAction):
+                model.__table__.create(db.engine, checkfirst=True)
+            
+            print("Successfully created diplomatic relation tables.")
+            
+        except Exception as e:
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,66 @@
+"""
+Database migration script to create the price_candle and market_price tables
+and fill them from the existing Trade history
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from models import PriceCandle, MarketPrice, Trade
+from utils.price_history import record_trades
+
+# Trades replayed per batch while backfilling
+BACKFILL_BATCH_SIZE = 5000
+
+def run_migration():
+    """Run the migration to precompute market price series"""
+    print("Starting migration to create price candle tables...")
+
+    with app.app_context():
+        try:
+            # Create the tables if they don't exist
+            PriceCandle.__table__.create(db.engine, checkfirst=True)
+            MarketPrice.__table__.create(db.engine, checkfirst=True)
+
+            # Replay the trade history oldest first, unless it was already replayed
+            if db.session.query(MarketPrice.resource_type).first() is None:
+                query = db.session.query(
+                    Trade.id, Trade.resource_type, Trade.quantity, Trade.price_per_unit, Trade.trade_date
+                ).filter(Trade.trade_date.isnot(None)).order_by(Trade.trade_date, Trade.id)
+
+                replayed = 0
+                last_position = None
+                while True:
+                    batch_query = query
+                    if last_position is not None:
+                        last_date, last_id = last_position
+                        batch_query = batch_query.filter(
+                            (Trade.trade_date > last_date) |
+                            ((Trade.trade_date == last_date) & (Trade.id > last_id))
+                        )
+                    rows = batch_query.limit(BACKFILL_BATCH_SIZE).all()
+                    if not rows:
+                        break
+                    record_trades([
+                        {"resource_type": resource_type, "quantity": quantity,
+                         "price_per_unit": price_per_unit, "trade_date": trade_date}
+                        for _, resource_type, quantity, price_per_unit, trade_date in rows
+                    ])
+                    replayed += len(rows)
+                    last_position = (rows[-1].trade_date, rows[-1].id)
+                print(f"Replayed {replayed} trades into the price series.")
+
+            db.session.commit()
+            print("Successfully created price candle tables.")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
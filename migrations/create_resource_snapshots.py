@@ -0,0 +1,36 @@
+"""
+Database migration script to create the resource_snapshot table (resource history time series)
+and record a first snapshot of every nation
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from models import ResourceSnapshot
+from utils.resource_history import record_resource_snapshots
+
+def run_migration():
+    """Run the migration to create and seed the resource_snapshot table"""
+    print("Starting migration to create resource_snapshot table...")
+    
+    with app.app_context():
+        try:
+            # Create the table if it doesn't exist
+            ResourceSnapshot.__table__.create(db.engine, checkfirst=True)
+            
+            snapshot_count = record_resource_snapshots()
+            db.session.commit()
+            
+            print(f"Successfully recorded resource snapshots for {snapshot_count} nations.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,40 @@
+"""
+Database migration script to create the technology_state table and build the state of every nation
+Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db, app
+from models import Nation, TechnologyState
+from utils.tech_state import rebuild_technology_states
+
+BATCH_SIZE = 500
+
+def run_migration():
+    """Run the migration to create and populate the technology_state table"""
+    print("Starting migration to create technology_state table...")
+    
+    with app.app_context():
+        try:
+            # Create the table if it doesn't exist
+            TechnologyState.__table__.create(db.engine, checkfirst=True)
+            
+            # Build the state of every nation from its Technology rows
+            nation_ids = [nation_id for nation_id, in db.session.query(Nation.id).all()]
+            for start in range(0, len(nation_ids), BATCH_SIZE):
+                rebuild_technology_states(nation_ids[start:start + BATCH_SIZE])
+                db.session.commit()
+            
+            print(f"Successfully built technology state for {len(nation_ids)} nations.")
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
@@ -20,6 +20,7 @@ def run_migration():
         try:
             # Import models
             from models import User, Nation, Resource, Military, Technology
+            from utils.tech_state import new_technology_state
             
             print("Creating user Fede...")
             # Create user
@@ -98,6 +99,9 @@ def run_migration():
             )
             db.session.add(italy_military)
             
+            # Technology state of a nation without technologies
+            db.session.add(new_technology_state(italy_nation.id))
+            
             # Commit all changes
             db.session.commit()
             print("Successfully created user Fede with Italy as nation.")
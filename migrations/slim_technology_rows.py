@@ -0,0 +1,123 @@
+"""
+Database migration script to move technology metadata out of the per-nation rows
+Technology rows now hold only (nation_id, tech_id, level, research state); names,
+descriptions, categories and prerequisites come from data/technologies.py.
+
+The script adds and backfills tech_id (matched by name), drops the metadata columns,
+deletes the rows still at the catalog default (level 0, not researching) and rebuilds
+every nation's technology state. Run this script directly to perform the migration
+"""
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import bindparam, inspect, text
+from app import db, app
+from models import Nation, TechnologyState
+from data.technologies import TECHNOLOGIES
+from utils.tech_state import rebuild_technology_states
+
+BATCH_SIZE = 500
+
+METADATA_COLUMNS = [
+    'name',
+    'description',
+    'category',
+    'max_level',
+    'production_multiplier',
+    'consumption_efficiency',
+    'military_bonus',
+    'research_bonus',
+    'espionage_bonus',
+    'prerequisites'
+]
+
+def delete_technology_rows(row_ids):
+    """Delete technology rows, detaching any news article that points at them"""
+    for start in range(0, len(row_ids), BATCH_SIZE):
+        batch = {"ids": row_ids[start:start + BATCH_SIZE]}
+        db.session.execute(
+            text("UPDATE news_article SET related_technology_id = NULL WHERE related_technology_id IN :ids")
+            .bindparams(bindparam("ids", expanding=True)),
+            batch
+        )
+        db.session.execute(
+            text("DELETE FROM technology WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            batch
+        )
+
+def run_migration():
+    """Run the migration to store only per-nation technology deltas"""
+    print("Starting migration to slim down technology rows...")
+
+    with app.app_context():
+        try:
+            columns = [column['name'] for column in inspect(db.engine).get_columns('technology')]
+
+            # Add the catalog id column and fill it in from the technology names
+            if 'tech_id' not in columns:
+                db.session.execute(text("ALTER TABLE technology ADD COLUMN tech_id INTEGER"))
+                print("Added tech_id column to technology table.")
+            if 'name' in columns:
+                for tech in TECHNOLOGIES:
+                    db.session.execute(
+                        text("UPDATE technology SET tech_id = :tech_id WHERE name = :name AND tech_id IS NULL"),
+                        {"tech_id": tech["id"], "name": tech["name"]}
+                    )
+
+            rows = db.session.execute(text(
+                "SELECT id, nation_id, tech_id, level, researching FROM technology ORDER BY id"
+            )).all()
+
+            # Rows that are not in the catalog, duplicates of the same technology
+            # (the highest level, researching row is kept) and rows at the catalog default
+            kept = {}
+            obsolete = []
+            for row_id, nation_id, tech_id, level, researching in rows:
+                if tech_id is None:
+                    obsolete.append(row_id)
+                    continue
+                key = (nation_id, tech_id)
+                rank = (level or 0, bool(researching))
+                if key in kept:
+                    if rank > kept[key][1]:
+                        obsolete.append(kept[key][0])
+                        kept[key] = (row_id, rank)
+                    else:
+                        obsolete.append(row_id)
+                else:
+                    kept[key] = (row_id, rank)
+            obsolete.extend(row_id for row_id, rank in kept.values() if rank == (0, False))
+            delete_technology_rows(obsolete)
+            print(f"Deleted {len(obsolete)} of {len(rows)} technology rows.")
+
+            for column in METADATA_COLUMNS:
+                if column in columns:
+                    db.session.execute(text(f"ALTER TABLE technology DROP COLUMN {column}"))
+            print("Dropped technology metadata columns.")
+
+            if db.engine.dialect.name == 'postgresql':
+                db.session.execute(text("ALTER TABLE technology ALTER COLUMN tech_id SET NOT NULL"))
+            db.session.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_technology_nation_tech ON technology (nation_id, tech_id)"
+            ))
+            db.session.commit()
+
+            # Rebuild the state of every nation from its remaining rows
+            TechnologyState.__table__.create(db.engine, checkfirst=True)
+            nation_ids = [nation_id for nation_id, in db.session.query(Nation.id).all()]
+            for start in range(0, len(nation_ids), BATCH_SIZE):
+                rebuild_technology_states(nation_ids[start:start + BATCH_SIZE])
+                db.session.commit()
+
+            print(f"Successfully rebuilt technology state for {len(nation_ids)} nations.")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"Migration failed: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    run_migration()
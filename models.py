@@ -1,9 +1,13 @@
 from app import db
 from flask_login import UserMixin
 from datetime import datetime, timedelta
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Table
+import json
+import zlib
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Table, case, event, func, inspect, literal
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
+from utils.tech_graph import TECH_BY_ID
 
 # Association table for alliances between nations
 alliances = Table(
@@ -101,23 +105,9 @@ class Nation(db.Model):
     
     def calculate_resource_production(self):
         """Calculate resource production based on population distribution and technology"""
-        from utils.game_logic import get_production_rate, get_consumption_rate
+        from utils.game_logic import refresh_resource_rates
         
-        resources = Resource.query.filter_by(nation_id=self.id).first()
-        if not resources:
-            return
-            
-        # Calculate production rates
-        resources.raw_materials_production = get_production_rate(self, 'raw_materials')
-        resources.food_production = get_production_rate(self, 'food')
-        resources.energy_production = get_production_rate(self, 'energy')
-        resources.technology_production = get_production_rate(self, 'technology')
-        resources.currency_production = get_production_rate(self, 'currency')
-        
-        # Calculate consumption rates
-        resources.raw_materials_consumption = get_consumption_rate(self, 'raw_materials')
-        resources.food_consumption = get_consumption_rate(self, 'food')
-        resources.energy_consumption = get_consumption_rate(self, 'energy')
+        refresh_resource_rates(self)
         
         # Save changes
         db.session.commit()
@@ -152,24 +142,134 @@ class Resource(db.Model):
     energy_consumption = db.Column(db.Float, default=50.0)
     
     # Last update timestamp
+    # Amounts are stored as of this time and accrue lazily at the stored rates,
+    # so rows are only written when an amount or a rate actually changes
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def current_amounts(self, now=None):
+        """Amounts accrued up to `now` from the stored snapshot and rates"""
+        if now is None:
+            now = datetime.utcnow()
+        
+        elapsed_hours = 0
+        if self.last_updated:
+            elapsed_hours = max(0, (now - self.last_updated).total_seconds() / 3600)
+        
+        return accrue_amounts({column: getattr(self, column) for column in RESOURCE_SNAPSHOT_COLUMNS}, elapsed_hours)
+    
+    def current_amount(self, resource_type, now=None):
+        """Current amount of a single resource"""
+        return self.current_amounts(now)[resource_type]
+    
+    def settle(self, now=None):
+        """Move the snapshot to `now` without marking the row as changed"""
+        if now is None:
+            now = datetime.utcnow()
+        for resource_type, amount in self.current_amounts(now).items():
+            set_committed_value(self, resource_type, amount)
+        set_committed_value(self, 'last_updated', now)
+
+# Accruing resource -> (production column, consumption column, clamped at zero)
+ACCRUING_RESOURCES = {
+    'raw_materials': ('raw_materials_production', 'raw_materials_consumption', True),
+    'food': ('food_production', 'food_consumption', True),
+    'energy': ('energy_production', 'energy_consumption', True),
+    'technology_points': ('technology_production', None, False),
+    'currency': ('currency_production', None, False),
+}
+
+RESOURCE_RATE_COLUMNS = [
+    column for production_column, consumption_column, _ in ACCRUING_RESOURCES.values()
+    for column in (production_column, consumption_column) if column
+]
+
+RESOURCE_SNAPSHOT_COLUMNS = list(ACCRUING_RESOURCES) + RESOURCE_RATE_COLUMNS
+
+def accrue_amounts(values, elapsed_hours):
+    """Closed-form accrual of the stored amounts in `values` (column name -> value)
+    over `elapsed_hours` at the stored rates"""
+    amounts = {}
+    for resource_type, (production_column, consumption_column, clamped) in ACCRUING_RESOURCES.items():
+        net_rate = values[production_column] or 0
+        if consumption_column:
+            net_rate -= values[consumption_column] or 0
+        amount = values[resource_type] + net_rate * elapsed_hours
+        # With a constant rate the amount crosses zero at most once, so
+        # clamping the end value is the piecewise (stops at zero) result
+        amounts[resource_type] = max(0, amount) if clamped else amount
+    return amounts
+
+def elapsed_hours_sql(now):
+    """SQL expression: hours from a Resource row's last_updated to `now`"""
+    if db.engine.dialect.name == 'sqlite':
+        hours = (func.julianday(literal(now, DateTime)) - func.julianday(Resource.last_updated)) * 24
+    else:
+        hours = func.extract('epoch', literal(now, DateTime) - Resource.last_updated) / 3600
+    return func.coalesce(hours, 0)
+
+def accrued_amount_sql(resource_type, now):
+    """SQL expression: stored amount of a resource accrued up to `now`, before
+    clamping (the same closed form as accrue_amounts)"""
+    production_column, consumption_column, _ = ACCRUING_RESOURCES[resource_type]
+    net_rate = func.coalesce(getattr(Resource, production_column), 0)
+    if consumption_column:
+        net_rate = net_rate - func.coalesce(getattr(Resource, consumption_column), 0)
+    return getattr(Resource, resource_type) + net_rate * elapsed_hours_sql(now)
+
+def credited_amount_sql(resource_type, amount, now):
+    """SQL expression: stored value that adds `amount` to a resource's current
+    amount without moving last_updated. For clamped resources that already ran out,
+    the stored value is first raised to the point where the accrued amount is zero."""
+    column = getattr(Resource, resource_type)
+    if not ACCRUING_RESOURCES[resource_type][2]:
+        return column + amount
+    accrued = accrued_amount_sql(resource_type, now)
+    return case((accrued < 0, column - accrued), else_=column) + amount
+
+@event.listens_for(Resource, 'load')
+def _settle_loaded_resource(resources, context):
+    """Every loaded Resource row exposes amounts that are current at load time"""
+    resources.settle()
+
+@event.listens_for(Resource, 'refresh')
+def _settle_refreshed_resource(resources, context, attrs):
+    """Same as on load when an expired row is reloaded (e.g. after a commit)"""
+    if attrs is None or ('last_updated' in attrs and all(r in attrs for r in ACCRUING_RESOURCES)):
+        resources.settle()
+
+@event.listens_for(Resource, 'before_update')
+def _write_resource_snapshot(mapper, connection, resources):
+    """Amounts in memory are relative to the settled last_updated, so a change
+    to any amount or rate writes the whole snapshot together"""
+    state = inspect(resources)
+    if any(state.attrs[column].history.has_changes() for column in RESOURCE_SNAPSHOT_COLUMNS):
+        for column in list(ACCRUING_RESOURCES) + ['last_updated']:
+            flag_modified(resources, column)
+
+class ResourceSnapshot(db.Model):
+    """Resource amounts of a nation at one point of its resource history.
+    Every tier ('hour', 'day', 'week') lives in this table; coarser tiers are
+    averages of the finer one (see utils/resource_history.py)"""
+    __tablename__ = 'resource_snapshot'
+    # The primary key doubles as the (nation, tier, time) range index
+    nation_id = db.Column(db.Integer, db.ForeignKey('nation.id'), primary_key=True)
+    tier = db.Column(db.String(8), primary_key=True)
+    ts = db.Column(db.DateTime, primary_key=True)
+    raw_materials = db.Column(db.Float)
+    food = db.Column(db.Float)
+    energy = db.Column(db.Float)
+    technology_points = db.Column(db.Float)
+    currency = db.Column(db.Float)
 
 class Technology(db.Model):
-    """Technology model for research and development"""
+    """Per-nation technology progress.
+    Static metadata (name, category, prerequisites...) lives once in the catalog
+    (data/technologies.py) and is looked up by tech_id. A nation only has rows for
+    technologies whose level or research state differs from the catalog default."""
     id = db.Column(db.Integer, primary_key=True)
     nation_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.String(500))
-    category = db.Column(db.String(50), nullable=False)  # e.g., 'Military', 'Production', 'Research', 'Espionage'
+    tech_id = db.Column(db.Integer, nullable=False)  # Catalog id in data/technologies.py
     level = db.Column(db.Integer, default=0)
-    max_level = db.Column(db.Integer, default=10)
-    
-    # Technology effects on production/consumption
-    production_multiplier = db.Column(db.Float, default=1.0)
-    consumption_efficiency = db.Column(db.Float, default=1.0)
-    military_bonus = db.Column(db.Float, default=0.0)
-    research_bonus = db.Column(db.Float, default=0.0)
-    espionage_bonus = db.Column(db.Float, default=0.0)
     
     # Research progress
     research_points_required = db.Column(db.Float, nullable=False)
@@ -178,8 +278,99 @@ class Technology(db.Model):
     research_started = db.Column(db.DateTime)
     estimated_completion = db.Column(db.DateTime)
     
-    # Prereq technologies
-    prerequisites = db.Column(db.String(500))  # Comma-separated list of tech IDs
+    # Due research is found by completion time
+    __table_args__ = (
+        db.Index('ix_technology_researching_completion', 'researching', 'estimated_completion'),
+        db.UniqueConstraint('nation_id', 'tech_id', name='uq_technology_nation_tech'),
+    )
+
+    @property
+    def catalog(self):
+        """Catalog entry of this technology"""
+        return TECH_BY_ID.get(self.tech_id, {})
+
+    @property
+    def name(self):
+        return self.catalog.get("name", f"Unknown Tech (ID: {self.tech_id})")
+
+    @property
+    def description(self):
+        return self.catalog.get("description", "")
+
+    @property
+    def category(self):
+        return self.catalog.get("category", "")
+
+    @property
+    def max_level(self):
+        return self.catalog.get("max_level", 10)
+
+    @property
+    def prerequisites(self):
+        """Comma-separated catalog ids of the prerequisites"""
+        return ",".join(str(x) for x in self.catalog.get("prerequisites", []))
+
+    # Technology effects on production/consumption (catalog overrides, neutral by default)
+    @property
+    def production_multiplier(self):
+        return self.catalog.get("production_multiplier", 1.0)
+
+    @property
+    def consumption_efficiency(self):
+        return self.catalog.get("consumption_efficiency", 1.0)
+
+    @property
+    def military_bonus(self):
+        return self.catalog.get("military_bonus", 0.0)
+
+    @property
+    def research_bonus(self):
+        return self.catalog.get("research_bonus", 0.0)
+
+    @property
+    def espionage_bonus(self):
+        return self.catalog.get("espionage_bonus", 0.0)
+
+    def research_progress(self, now=None):
+        """Fraction (0-1) of the current research, derived from the research timestamps"""
+        if self.researching and self.research_started and self.estimated_completion:
+            if now is None:
+                now = datetime.utcnow()
+            total_seconds = (self.estimated_completion - self.research_started).total_seconds()
+            if total_seconds <= 0:
+                return 1.0
+            elapsed_seconds = (now - self.research_started).total_seconds()
+            return min(1.0, max(0.0, elapsed_seconds / total_seconds))
+
+        # Not researching: completed research keeps its points at the required amount
+        if not self.research_points_required:
+            return 0.0
+        return min(1.0, (self.research_points_current or 0) / self.research_points_required)
+
+    @property
+    def research_percent(self):
+        return self.research_progress() * 100
+
+    @property
+    def research_points_progress(self):
+        """Research points accumulated so far, for display"""
+        return self.research_points_required * self.research_progress()
+
+class TechnologyState(db.Model):
+    """Compact per-nation technology state, kept in sync with the nation's Technology rows
+    (see utils/tech_state.py) so tech-dependent code does not load every Technology row"""
+    nation_id = db.Column(db.Integer, db.ForeignKey('nation.id'), primary_key=True)
+
+    # One byte per technology, in data/technologies.py catalog order
+    levels = db.Column(db.LargeBinary, nullable=False, default=b'')
+
+    # Aggregates over all technologies of the nation
+    level_sum = db.Column(db.Integer, default=0)
+    production_multiplier = db.Column(db.Float, default=1.2)   # Product over researched Production techs
+    consumption_efficiency = db.Column(db.Float, default=1.0)  # Product over researched Efficiency techs
+    espionage_bonus = db.Column(db.Float, default=0.0)         # Sum of espionage_bonus * level * 0.1
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Military(db.Model):
     """Military model for defense and offense"""
@@ -225,12 +416,40 @@ class MarketItem(db.Model):
     expires_at = db.Column(db.DateTime, default=lambda: datetime.utcnow() + timedelta(days=1))
     is_active = db.Column(db.Boolean, default=True)
 
+    # Order book lookups: active listings of a resource in price-time priority
+    __table_args__ = (
+        db.Index('ix_market_item_book', 'resource_type', 'is_active', 'price_per_unit', 'created_at'),
+        # Expiry sweeps: active listings past their expiry date
+        db.Index('ix_market_item_expiry', 'is_active', 'expires_at'),
+    )
+
+class MarketBid(db.Model):
+    """Standing buy order. The currency for the remaining quantity is held from
+    the bidder until the bid is filled, cancelled or expires."""
+    id = db.Column(db.Integer, primary_key=True)
+    bidder_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
+    resource_type = db.Column(db.String(50), nullable=False)  # 'raw_materials', 'food', 'energy'
+    quantity = db.Column(db.Float, nullable=False)  # Remaining quantity
+    price_per_unit = db.Column(db.Float, nullable=False)  # Highest price the bidder pays
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, default=lambda: datetime.utcnow() + timedelta(days=1))
+    is_active = db.Column(db.Boolean, default=True)
+    
+    bidder = db.relationship('Nation', foreign_keys=[bidder_id])
+    
+    # Bid book lookups: active bids of a resource in price-time priority
+    __table_args__ = (
+        db.Index('ix_market_bid_book', 'resource_type', 'is_active', 'price_per_unit', 'created_at'),
+        db.Index('ix_market_bid_expiry', 'is_active', 'expires_at'),
+    )
+
 class Trade(db.Model):
     """Trade record between nations"""
     id = db.Column(db.Integer, primary_key=True)
     seller_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
     buyer_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
     market_item_id = db.Column(db.Integer, db.ForeignKey('market_item.id'), nullable=False)
+    market_bid_id = db.Column(db.Integer, db.ForeignKey('market_bid.id'))  # Set when a standing bid was filled
     resource_type = db.Column(db.String(50), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
     price_per_unit = db.Column(db.Float, nullable=False)
@@ -242,6 +461,33 @@ class Trade(db.Model):
     buyer = db.relationship('Nation', foreign_keys=[buyer_id])
     market_item = db.relationship('MarketItem')
 
+class PriceCandle(db.Model):
+    """OHLCV summary of the trades of one resource type in one time bucket.
+    Candles of every interval ('1m', '1h', '1d') live in this table and are
+    updated on every trade insert (see utils/price_history.py)"""
+    __tablename__ = 'price_candle'
+    # The primary key doubles as the (resource, interval, time) range index
+    resource_type = db.Column(db.String(50), primary_key=True)
+    interval = db.Column(db.String(4), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=False)  # Quantity traded
+    turnover = db.Column(db.Float, nullable=False)  # Currency traded, for the average price
+    trade_count = db.Column(db.Integer, nullable=False)
+
+class MarketPrice(db.Model):
+    """Latest and exponentially weighted average trade prices of a resource type"""
+    __tablename__ = 'market_price'
+    resource_type = db.Column(db.String(50), primary_key=True)
+    last_price = db.Column(db.Float, nullable=False)
+    reference_price = db.Column(db.Float, nullable=False)  # Fast EWMA (about the last 10 trades)
+    trend_price = db.Column(db.Float, nullable=False)  # Slow EWMA (about the last 20 trades)
+    trade_count = db.Column(db.Integer, nullable=False)
+    last_trade_at = db.Column(db.DateTime)
+
 class War(db.Model):
     """War record between nations"""
     id = db.Column(db.Integer, primary_key=True)
@@ -316,6 +562,44 @@ class TransitRights(db.Model):
     receiver = db.relationship('Nation', foreign_keys=[receiver_id])
 
 
+class NationRelation(db.Model):
+    """Stored relation between two nations, keyed by (nation_low_id, nation_high_id)
+    with nation_low_id < nation_high_id. Only pairs that differ from the default
+    relation get a row (see utils/relation_store.py)"""
+    __tablename__ = 'nation_relation'
+    nation_low_id = db.Column(db.Integer, db.ForeignKey('nation.id'), primary_key=True)
+    nation_high_id = db.Column(db.Integer, db.ForeignKey('nation.id'), primary_key=True, index=True)
+    drift = db.Column(db.Float, default=0.0)  # Accumulated daily fluctuation
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RelationModifier(db.Model):
+    """Temporary change to the relation between two nations"""
+    id = db.Column(db.Integer, primary_key=True)
+    nation_low_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
+    nation_high_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
+    source = db.Column(db.String(100))
+    value = db.Column(db.Float, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index('ix_relation_modifier_pair', 'nation_low_id', 'nation_high_id'),
+    )
+
+class RelationAction(db.Model):
+    """Diplomatic action with a duration that is in progress between two nations"""
+    id = db.Column(db.Integer, primary_key=True)
+    nation_low_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
+    nation_high_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
+    action_id = db.Column(db.Integer, nullable=False)
+    initiator_id = db.Column(db.Integer, db.ForeignKey('nation.id'), nullable=False)
+    start_date = db.Column(db.DateTime, default=datetime.utcnow)
+    end_date = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index('ix_relation_action_pair', 'nation_low_id', 'nation_high_id'),
+    )
+
+
 class DeployedSpy(db.Model):
     """Deployed spy in a foreign nation"""
     id = db.Column(db.Integer, primary_key=True)
@@ -330,6 +614,7 @@ class DeployedSpy(db.Model):
     intel_level = db.Column(db.Integer, default=0)  # Increases over time, determines intel quality
     is_active = db.Column(db.Boolean, default=True)
     is_discovered = db.Column(db.Boolean, default=False)
+    next_report_at = db.Column(db.DateTime)  # Next periodic report of a long-term deployment
     
     # Spy capabilities
     specialization = db.Column(db.String(50), default='general')  # 'general', 'military', 'economic', 'technological', 'diplomatic'
@@ -339,6 +624,11 @@ class DeployedSpy(db.Model):
     owner_nation = db.relationship('Nation', foreign_keys=[owner_nation_id], backref=db.backref('deployed_spies', lazy='dynamic'))
     target_nation = db.relationship('Nation', foreign_keys=[target_nation_id], backref=db.backref('foreign_spies', lazy='dynamic'))
     
+    # Spies due for a periodic report are found by report time
+    __table_args__ = (
+        db.Index('ix_deployed_spy_next_report', 'is_active', 'next_report_at'),
+    )
+    
     def __repr__(self):
         return f'<Spy {self.id} from {self.owner_nation_id} in {self.target_nation_id}>'
 
@@ -366,6 +656,11 @@ class SpyMission(db.Model):
     # Relationship
     spy = db.relationship('DeployedSpy', backref=db.backref('missions', lazy='dynamic'))
     
+    # Due missions are found by completion time
+    __table_args__ = (
+        db.Index('ix_spy_mission_due', 'is_completed', 'completion_date'),
+    )
+    
     def __repr__(self):
         return f'<SpyMission {self.id} by spy {self.spy_id}>'
 
@@ -385,7 +680,9 @@ class SpyReport(db.Model):
     report_type = db.Column(db.String(50), nullable=False)  # 'military', 'economic', 'technological', 'diplomatic'
     intel_quality = db.Column(db.Integer, default=1)  # 1-5 scale, determines accuracy
     
-    # Report content (JSON serialized)
+    # Report content: zlib-compressed JSON payload; reports written before the
+    # payload column existed keep their plain JSON text in report_content
+    report_payload = db.Column(db.LargeBinary)
     report_content = db.Column(db.Text)
     
     # Relationships
@@ -394,6 +691,24 @@ class SpyReport(db.Model):
     spy = db.relationship('DeployedSpy', backref=db.backref('reports', lazy='dynamic'))
     mission = db.relationship('SpyMission', backref=db.backref('reports', lazy='dynamic'))
     
+    # Reports are read per (owner, target, type) and listed per owner, newest first
+    __table_args__ = (
+        db.Index('ix_spy_report_lookup', 'nation_id', 'target_nation_id', 'report_type', 'report_date'),
+        db.Index('ix_spy_report_listing', 'nation_id', 'report_date', 'id'),
+    )
+    
+    @property
+    def content(self):
+        """Decoded report content"""
+        if self.report_payload is not None:
+            return json.loads(zlib.decompress(self.report_payload))
+        return json.loads(self.report_content) if self.report_content else {}
+    
+    @content.setter
+    def content(self, value):
+        self.report_payload = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        self.report_content = None
+    
     def __repr__(self):
         return f'<SpyReport {self.id} for nation {self.nation_id}>'
 
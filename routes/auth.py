@@ -4,6 +4,8 @@ from app import db
 from models import User, Nation, Resource, Military
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from utils.geography import geography
+from utils.tech_state import new_technology_state
 
 auth = Blueprint('auth', __name__)
 
@@ -51,6 +53,7 @@ def login():
                 )
                 db.session.add(new_nation)
                 db.session.commit()
+                geography.update_nation(new_nation)
                 
                 # Create initial resources for the nation
                 initial_resources = Resource(nation_id=new_nation.id)
@@ -60,6 +63,9 @@ def login():
                 initial_military = Military(nation_id=new_nation.id)
                 db.session.add(initial_military)
                 
+                # Technology state of a nation without technologies
+                db.session.add(new_technology_state(new_nation.id))
+                
                 db.session.commit()
                 flash('Default nation created successfully.', 'success')
                 
@@ -195,6 +201,7 @@ def register():
             # Add nation to database
             db.session.add(new_nation)
             db.session.commit()
+            geography.update_nation(new_nation)
             flash('Nation created successfully.', 'success')
             
             # Create initial resources for the nation
@@ -205,6 +212,9 @@ def register():
             initial_military = Military(nation_id=new_nation.id)
             db.session.add(initial_military)
             
+            # Technology state of a nation without technologies
+            db.session.add(new_technology_state(new_nation.id))
+            
             db.session.commit()
             flash('Nation resources and military initialized.', 'success')
             
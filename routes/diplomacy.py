@@ -1,19 +1,23 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app
 from flask_login import current_user
 from app import db
 from models import Nation, Alliance, War
 from datetime import datetime
+import hashlib
 from utils.auth import easy_login_required
 from utils.diplomacy_handler import (
     get_available_actions,
     perform_diplomatic_action,
     get_diplomatic_stance,
+    get_diplomatic_stances,
     calculate_diplomatic_influence,
     get_transit_rights,
     check_transit_rights,
     grant_transit_rights,
     revoke_transit_rights
 )
+from utils.alliance_graph import alliance_graph
+from utils.listings import get_war_listing, get_alliance_listing
 from data.diplomacy import DIPLOMATIC_ACTIONS, RELATION_STATES
 
 diplomacy = Blueprint('diplomacy', __name__)
@@ -54,10 +58,26 @@ def diplomacy_view():
         Alliance.is_active == True
     ).all()
     
+    nations_by_id = {other_nation.id: other_nation for other_nation in other_nations}
+    for alliance in alliances:
+        ally = nations_by_id.get(alliance.nation2_id if alliance.nation1_id == nation.id else alliance.nation1_id)
+        if ally:
+            diplomatic_data["alliances"].append({
+                "name": ally.name,
+                "formed_date": alliance.formed_date.strftime("%Y-%m-%d")
+            })
+    
+    # Alliance bloc: every nation linked to this one by a chain of alliances
+    diplomatic_data["bloc"] = {
+        "size": len(alliance_graph.bloc(nation.id)),
+        "military_power": alliance_graph.bloc_military_power(nation.id)
+    }
+    
     # Format relation data for each nation
+    stances, _ = get_diplomatic_stances(nation, other_nations)
     relations = []
     for other_nation in other_nations:
-        relation = get_diplomatic_stance(nation.id, other_nation.id)
+        relation = stances[other_nation.id]
         
         # Add nation info to relation data including map coordinates
         relation["nation"] = {
@@ -73,9 +93,6 @@ def diplomacy_view():
             "continent": other_nation.continent
         }
         
-        # Debug print to see the coordinates
-        print(f"DEBUG: Nation {other_nation.name}: x={other_nation.map_x}, y={other_nation.map_y}")
-        
         relations.append(relation)
     
     return render_template('diplomacy.html',
@@ -171,12 +188,27 @@ def api_relations():
     nation = Nation.query.filter_by(user_id=current_user.id).first()
     
     # Get all other nations
-    other_nations = Nation.query.filter(Nation.id != nation.id).all()
+    other_nations = Nation.query.filter(Nation.id != nation.id).order_by(Nation.id).all()
+    
+    # All stances come from a fixed number of queries; the ETag only changes when
+    # a relation involving this nation or the listed nation data changes
+    stances, version = get_diplomatic_stances(nation, other_nations)
+    etag = hashlib.sha1(repr((
+        version,
+        [(n.id, n.name, n.continent, n.economic_rank, n.military_rank, n.map_x, n.map_y)
+         for n in [nation] + other_nations]
+    )).encode()).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     
     # Format relation data for each nation
     relations = []
     for other_nation in other_nations:
-        relation = get_diplomatic_stance(nation.id, other_nation.id)
+        relation = stances[other_nation.id]
         
         # Add nation info to relation data
         relation["nation"] = {
@@ -191,7 +223,7 @@ def api_relations():
         
         relations.append(relation)
     
-    return jsonify({
+    response = jsonify({
         'success': True,
         'current_nation': {
             'id': nation.id,
@@ -202,6 +234,9 @@ def api_relations():
         },
         'relations': relations
     })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @diplomacy.route('/diplomacy/wars')
 @easy_login_required
@@ -210,24 +245,14 @@ def wars_view():
     # Get current user's nation
     nation = Nation.query.filter_by(user_id=current_user.id).first()
     
-    # Get all active wars
-    active_wars = War.query.filter(War.is_active == True).all()
-    
-    # Process war data to include nation objects
-    for war in active_wars:
-        war.aggressor = Nation.query.get(war.aggressor_id)
-        war.defender = Nation.query.get(war.defender_id)
-    
-    # Get your wars
-    your_wars = [war for war in active_wars if war.aggressor_id == nation.id or war.defender_id == nation.id]
-    
-    # Get other wars
-    other_wars = [war for war in active_wars if war.aggressor_id != nation.id and war.defender_id != nation.id]
+    # Your wars, and one page of the other active wars, with both nations loaded
+    your_wars, other_wars_page = get_war_listing(nation.id, request.args.get('page', 1, type=int))
     
     return render_template('diplomacy_wars.html',
                          nation=nation,
                          your_wars=your_wars,
-                         other_wars=other_wars)
+                         other_wars=other_wars_page.items,
+                         other_wars_page=other_wars_page)
 
 @diplomacy.route('/diplomacy/alliances')
 @easy_login_required
@@ -236,24 +261,14 @@ def alliances_view():
     # Get current user's nation
     nation = Nation.query.filter_by(user_id=current_user.id).first()
     
-    # Get all active alliances
-    active_alliances = Alliance.query.filter(Alliance.is_active == True).all()
-    
-    # Process alliance data to include nation objects
-    for alliance in active_alliances:
-        alliance.nation1 = Nation.query.get(alliance.nation1_id)
-        alliance.nation2 = Nation.query.get(alliance.nation2_id)
-    
-    # Get your alliances
-    your_alliances = [alliance for alliance in active_alliances if alliance.nation1_id == nation.id or alliance.nation2_id == nation.id]
-    
-    # Get other alliances
-    other_alliances = [alliance for alliance in active_alliances if alliance.nation1_id != nation.id and alliance.nation2_id != nation.id]
+    # Your alliances, and one page of the other active alliances, with both nations loaded
+    your_alliances, other_alliances_page = get_alliance_listing(nation.id, request.args.get('page', 1, type=int))
     
     return render_template('diplomacy_alliances.html',
                          nation=nation,
                          your_alliances=your_alliances,
-                         other_alliances=other_alliances)
+                         other_alliances=other_alliances_page.items,
+                         other_alliances_page=other_alliances_page)
 
 @diplomacy.route('/diplomacy/propose-peace/<int:war_id>', methods=['POST'])
 @easy_login_required
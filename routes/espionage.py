@@ -1,12 +1,12 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import current_user, login_required
-import json
 from datetime import datetime
 
 from app import db
 from models import Nation, Military, DeployedSpy, SpyMission, SpyReport
 from utils.advanced_espionage import AdvancedEspionageSystem
 from utils.auth_helpers import easy_login_required
+from utils.listings import get_deployed_spies, get_completed_missions, get_intel_reports
 
 espionage = Blueprint('espionage', __name__)
 
@@ -25,22 +25,13 @@ def espionage_view():
     # Get military info
     military = Military.query.filter_by(nation_id=nation.id).first()
     
-    # Get active deployed spies
-    deployed_spies = DeployedSpy.query.filter_by(
-        owner_nation_id=nation.id,
-        is_active=True
-    ).all()
+    # Get active deployed spies with their targets and open missions
+    deployed_spies = get_deployed_spies(nation.id)
     
     # Process spies for display
     spy_data = []
-    for spy in deployed_spies:
-        target_nation = Nation.query.get(spy.target_nation_id)
-        
-        # Get any active mission
-        active_mission = SpyMission.query.filter_by(
-            spy_id=spy.id,
-            is_completed=False
-        ).first()
+    for spy, active_mission in deployed_spies:
+        target_nation = spy.target_nation
         
         spy_info = {
             'id': spy.id,
@@ -73,16 +64,13 @@ def espionage_view():
         spy_data.append(spy_info)
     
     # Get completed missions (last 10)
-    completed_missions = SpyMission.query.join(DeployedSpy).filter(
-        DeployedSpy.owner_nation_id == nation.id,
-        SpyMission.is_completed == True
-    ).order_by(SpyMission.completion_date.desc()).limit(10).all()
+    completed_missions = get_completed_missions(nation.id, limit=10)
     
     # Process missions for display
     mission_data = []
     for mission in completed_missions:
         spy = mission.spy
-        target_nation = Nation.query.get(spy.target_nation_id) if spy else None
+        target_nation = spy.target_nation if spy else None
         
         mission_info = {
             'id': mission.id,
@@ -95,15 +83,15 @@ def espionage_view():
         
         mission_data.append(mission_info)
     
-    # Get intel reports (last 10)
-    intel_reports = SpyReport.query.filter_by(
-        nation_id=nation.id
-    ).order_by(SpyReport.report_date.desc()).limit(10).all()
+    # Get one page of intel reports (10 per page, older pages by cursor)
+    intel_reports, next_reports_cursor = get_intel_reports(
+        nation.id, limit=10, cursor=request.args.get('reports_before')
+    )
     
     # Process reports for display
     report_data = []
     for report in intel_reports:
-        target_nation = Nation.query.get(report.target_nation_id)
+        target_nation = report.target_nation
         
         report_info = {
             'id': report.id,
@@ -111,7 +99,7 @@ def espionage_view():
             'report_date': report.report_date.strftime('%Y-%m-%d %H:%M'),
             'report_type': report.report_type,
             'intel_quality': report.intel_quality,
-            'content': json.loads(report.report_content) if report.report_content else {}
+            'content': report.content
         }
         
         report_data.append(report_info)
@@ -129,6 +117,8 @@ def espionage_view():
                            max_spies=espionage_system.get_max_spies(),
                            missions=mission_data,
                            intel_reports=report_data,
+                           next_reports_cursor=next_reports_cursor,
+                           reports_paged=bool(request.args.get('reports_before')),
                            potential_targets=potential_targets,
                            counter_intelligence=military.counter_intelligence)
 
@@ -296,8 +286,8 @@ def api_report_details(report_id):
     if not nation:
         return jsonify({'success': False, 'message': 'No nation found'})
     
-    # Get report
-    report = SpyReport.query.filter_by(
+    # Get report with its target nation
+    report = SpyReport.query.options(db.joinedload(SpyReport.target_nation)).filter_by(
         id=report_id,
         nation_id=nation.id
     ).first()
@@ -305,7 +295,7 @@ def api_report_details(report_id):
     if not report:
         return jsonify({'success': False, 'message': 'Report not found'})
     
-    target_nation = Nation.query.get(report.target_nation_id)
+    target_nation = report.target_nation
     
     # Format report data
     report_data = {
@@ -314,7 +304,7 @@ def api_report_details(report_id):
         'report_date': report.report_date.strftime('%Y-%m-%d %H:%M'),
         'report_type': report.report_type,
         'intel_quality': report.intel_quality,
-        'content': json.loads(report.report_content) if report.report_content else {}
+        'content': report.content
     }
     
     return jsonify({
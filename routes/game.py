@@ -2,10 +2,13 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash,
 from flask_login import current_user
 from app import db
 from models import Nation, Resource, Technology, Military, MarketItem, Trade, War, Alliance, NewsArticle
-from datetime import datetime
-from utils.game_logic import update_resources, calculate_rankings
+from datetime import datetime, timedelta
+from utils.game_logic import calculate_rankings
 from utils.auth import easy_login_required
 from utils.news_generator import get_latest_news
+from utils.ranking_service import ranking_service
+from utils.technology_handler import get_nation_technologies
+from utils.resource_history import HISTORY_RESOURCES, get_resource_history
 
 game = Blueprint('game', __name__)
 
@@ -24,22 +27,21 @@ def dashboard():
         flash('You do not have a nation. Please contact an administrator.', 'danger')
         return redirect(url_for('auth.logout'))
     
-    # Update resources based on time elapsed
-    update_resources(nation)
-    
-    # Get related data
+    # Get related data (resource amounts are accrued on load, nothing is written here)
     resources = Resource.query.filter_by(nation_id=nation.id).first()
     military = Military.query.filter_by(nation_id=nation.id).first()
-    technologies = Technology.query.filter_by(nation_id=nation.id).all()
+    technologies = get_nation_technologies(nation)
     
-    # Get top nations for rankings
-    top_economic = Nation.query.order_by(Nation.economic_rank).limit(10).all()
-    top_military = Nation.query.order_by(Nation.military_rank).limit(10).all()
-    top_technology = Nation.query.order_by(Nation.technology_rank).limit(10).all()
-    top_overall = Nation.query.order_by(Nation.overall_rank).limit(10).all()
+    # Get top nations for rankings from the in-memory ranking indexes
+    top_economic = ranking_service.top_nations('economic', 10)
+    top_military = ranking_service.top_nations('military', 10)
+    top_technology = ranking_service.top_nations('technology', 10)
+    top_overall = ranking_service.top_nations('overall', 10)
+    technology_scores = {n.id: ranking_service.score('technology', n.id) for n in top_technology}
+    overall_ranks = dict(ranking_service.top('overall', 10))
     
-    # Update the nation's rankings
-    calculate_rankings()
+    # Current ranks of the nation (the stored columns are refreshed by the scheduler)
+    nation_ranks = ranking_service.get_ranks(nation)
     
     # Add current time for template timer calculations
     now = datetime.utcnow()
@@ -56,6 +58,9 @@ def dashboard():
                            top_military=top_military,
                            top_technology=top_technology,
                            top_overall=top_overall,
+                           technology_scores=technology_scores,
+                           overall_ranks=overall_ranks,
+                           nation_ranks=nation_ranks,
                            latest_news=latest_news,
                            now=now)
 
@@ -182,20 +187,17 @@ def rankings():
 @game.route('/api/resource_history/<resource_type>')
 @easy_login_required
 def resource_history(resource_type):
-    # This would fetch historical data for the specified resource
-    # For a real implementation, you would need to store historical data
-    # Here we return mock data for demonstration
+    """Resource history of the current nation for the dashboard charts.
+    The `days` window picks the snapshot tier (hourly, daily or weekly points)."""
+    if resource_type not in HISTORY_RESOURCES:
+        return jsonify({"error": "Unknown resource type"}), 404
     
-    # In a real implementation, this would query a ResourceHistory table
-    # or calculate from periodic snapshots
+    nation = Nation.query.filter_by(user_id=current_user.id).first()
+    days = min(max(request.args.get('days', 7, type=int), 1), 5 * 365)
+    now = datetime.utcnow()
+    tier, rows = get_resource_history(nation.id, resource_type, now - timedelta(days=days), now)
     
-    # Sample data for demonstration - would be replaced with real DB query
-    history = [
-        {"date": "2023-01-01", "value": 1000},
-        {"date": "2023-01-02", "value": 1050},
-        {"date": "2023-01-03", "value": 1100},
-        {"date": "2023-01-04", "value": 1075},
-        {"date": "2023-01-05", "value": 1125}
-    ]
+    date_format = "%Y-%m-%d %H:%M" if tier == 'hour' else "%Y-%m-%d"
+    history = [{"date": ts.strftime(date_format), "value": value} for ts, value in rows]
     
     return jsonify(history)
@@ -1,9 +1,12 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app
 from flask_login import current_user
 from app import db
-from models import Nation, Resource, MarketItem, Trade
-from datetime import datetime, timedelta
+from models import Nation, Resource, MarketItem, MarketBid, Trade
 from utils.auth_helpers import easy_login_required
+from utils.order_book import MARKET_RESOURCE_TYPES, get_listings_page, order_book
+from utils.matching_engine import OrderRequest, market_engine
+from utils.price_history import CANDLE_DEPTH, CANDLE_INTERVALS, price_history
+from utils.trade_settlement import settle_purchase, withdraw_bid, withdraw_listing
 
 market = Blueprint('market', __name__)
 
@@ -14,8 +17,19 @@ def market_view():
     nation = Nation.query.filter_by(user_id=current_user.id).first()
     resources = Resource.query.filter_by(nation_id=nation.id).first()
     
-    # Get active market listings
-    active_listings = MarketItem.query.filter_by(is_active=True).all()
+    # One page of the order book (all resources, or one resource in price-time priority)
+    resource_type = request.args.get('resource_type')
+    if resource_type not in MARKET_RESOURCE_TYPES:
+        resource_type = None
+    page = request.args.get('page', 1, type=int)
+    listings_page = get_listings_page(resource_type, page)
+    
+    # Cheapest listing and highest buy order of each resource from the in-memory books
+    best_asks = {rtype: order_book.best_ask(rtype) for rtype in MARKET_RESOURCE_TYPES}
+    best_bids = {rtype: market_engine.best_bid(rtype) for rtype in MARKET_RESOURCE_TYPES}
+    
+    # The nation's standing buy orders
+    your_bids = MarketBid.query.filter_by(bidder_id=nation.id, is_active=True).order_by(MarketBid.created_at.desc()).all()
     
     # Get market history for this nation
     selling_history = Trade.query.filter_by(seller_id=nation.id).order_by(Trade.trade_date.desc()).limit(10).all()
@@ -24,123 +38,111 @@ def market_view():
     return render_template('market.html',
                           nation=nation,
                           resources=resources,
-                          active_listings=active_listings,
+                          active_listings=listings_page.items,
+                          listings_page=listings_page,
+                          resource_type=resource_type,
+                          best_asks=best_asks,
+                          best_bids=best_bids,
+                          your_bids=your_bids,
                           selling_history=selling_history,
                           buying_history=buying_history)
 
-@market.route('/market/create', methods=['POST'])
-@easy_login_required
-def create_listing():
-    nation = Nation.query.filter_by(user_id=current_user.id).first()
-    resources = Resource.query.filter_by(nation_id=nation.id).first()
-    
+def _read_order_form():
+    """(resource_type, quantity, price_per_unit, error message or None) of a sell or buy form"""
     resource_type = request.form.get('resource_type')
     quantity = float(request.form.get('quantity', 0))
     price_per_unit = float(request.form.get('price_per_unit', 0))
     
     # Validate input
+    if resource_type not in MARKET_RESOURCE_TYPES:
+        return resource_type, quantity, price_per_unit, 'Unknown resource type.'
     if quantity <= 0:
-        flash('Quantity must be greater than zero.', 'danger')
-        return redirect(url_for('market.market_view'))
-    
+        return resource_type, quantity, price_per_unit, 'Quantity must be greater than zero.'
     if price_per_unit <= 0:
-        flash('Price must be greater than zero.', 'danger')
-        return redirect(url_for('market.market_view'))
-    
-    # Check if the nation has enough resources
-    current_amount = getattr(resources, resource_type, 0)
-    if current_amount < quantity:
-        flash(f'Not enough {resource_type} available.', 'danger')
+        return resource_type, quantity, price_per_unit, 'Price must be greater than zero.'
+    return resource_type, quantity, price_per_unit, None
+
+def _place_order(side):
+    """Submit the posted sell or buy order to the matching engine"""
+    nation = Nation.query.filter_by(user_id=current_user.id).first()
+    resource_type, quantity, price_per_unit, error = _read_order_form()
+    if error:
+        flash(error, 'danger')
         return redirect(url_for('market.market_view'))
     
-    # Create market listing
-    total_price = quantity * price_per_unit
+    # Escrow the goods (or currency), then match against the other side of the book
+    try:
+        result = market_engine.submit([OrderRequest(side, nation.id, resource_type, quantity, price_per_unit)])[0]
+        flash(result['message'], 'success' if result['success'] else 'danger')
+    except Exception as e:
+        # Log the error
+        current_app.logger.error(f"Error placing market order: {str(e)}")
+        flash(f'Error placing market order. Please try again.', 'danger')
     
-    listing = MarketItem(
-        seller_id=nation.id,
-        resource_type=resource_type,
-        quantity=quantity,
-        price_per_unit=price_per_unit,
-        total_price=total_price,
-        created_at=datetime.utcnow(),
-        expires_at=datetime.utcnow() + timedelta(days=1),
-        is_active=True
-    )
+    return redirect(url_for('market.market_view'))
+
+@market.route('/market/create', methods=['POST'])
+@easy_login_required
+def create_listing():
+    return _place_order('sell')
+
+@market.route('/market/bid', methods=['POST'])
+@easy_login_required
+def place_bid():
+    return _place_order('buy')
+
+@market.route('/market/bid/cancel/<int:bid_id>', methods=['POST'])
+@easy_login_required
+def cancel_bid(bid_id):
+    # Make sure the buy order exists
+    MarketBid.query.get_or_404(bid_id)
     
-    # Deduct the resources from the nation
-    setattr(resources, resource_type, current_amount - quantity)
+    nation = Nation.query.filter_by(user_id=current_user.id).first()
     
+    # Refund the held currency, unless the order was filled meanwhile
     try:
-        db.session.add(listing)
+        result = withdraw_bid(bid_id, nation.id)
+        if not result['success']:
+            db.session.rollback()
+            flash(result['message'], 'danger')
+            return redirect(url_for('market.market_view'))
+        
+        resource_type = result['bid'].resource_type
         db.session.commit()
-        flash(f'Successfully listed {quantity} {resource_type} on the market.', 'success')
+        market_engine.cancel(resource_type, 'buy', bid_id)
+        flash(result['message'], 'success')
     except Exception as e:
         db.session.rollback()
         # Log the error
-        current_app.logger.error(f"Error creating market listing: {str(e)}")
-        flash(f'Error creating market listing. Please try again.', 'danger')
+        current_app.logger.error(f"Error cancelling buy order: {str(e)}")
+        flash(f'Error cancelling buy order. Please try again.', 'danger')
     
     return redirect(url_for('market.market_view'))
 
 @market.route('/market/buy/<int:listing_id>', methods=['POST'])
 @easy_login_required
 def buy_listing(listing_id):
-    # Get the market listing
-    listing = MarketItem.query.get_or_404(listing_id)
-    
-    # Make sure the listing is active
-    if not listing.is_active:
-        flash('This listing is no longer active.', 'danger')
-        return redirect(url_for('market.market_view'))
+    # Make sure the listing exists
+    MarketItem.query.get_or_404(listing_id)
     
     # Get the buyer's nation
     buyer_nation = Nation.query.filter_by(user_id=current_user.id).first()
     
-    # Make sure the buyer is not the seller
-    if buyer_nation.id == listing.seller_id:
-        flash('You cannot buy your own listing.', 'danger')
-        return redirect(url_for('market.market_view'))
-    
-    # Check if the buyer has enough currency
-    buyer_resources = Resource.query.filter_by(nation_id=buyer_nation.id).first()
-    if buyer_resources.currency < listing.total_price:
-        flash('Not enough currency to complete this purchase.', 'danger')
-        return redirect(url_for('market.market_view'))
-    
-    # Get the seller's resources
-    seller_resources = Resource.query.filter_by(nation_id=listing.seller_id).first()
-    
-    # Execute the trade
+    # Settle the trade with guarded updates, so a listing is never sold twice
     try:
-        # Deduct currency from buyer
-        buyer_resources.currency -= listing.total_price
-        
-        # Add currency to seller
-        seller_resources.currency += listing.total_price
+        result = settle_purchase(listing_id, buyer_nation.id)
+        if not result['success']:
+            db.session.rollback()
+            flash(result['message'], 'danger')
+            return redirect(url_for('market.market_view'))
         
-        # Add resources to buyer
-        current_amount = getattr(buyer_resources, listing.resource_type)
-        setattr(buyer_resources, listing.resource_type, current_amount + listing.quantity)
-        
-        # Mark the listing as inactive
-        listing.is_active = False
-        
-        # Create a trade record
-        trade = Trade(
-            seller_id=listing.seller_id,
-            buyer_id=buyer_nation.id,
-            market_item_id=listing.id,
-            resource_type=listing.resource_type,
-            quantity=listing.quantity,
-            price_per_unit=listing.price_per_unit,
-            total_price=listing.total_price,
-            trade_date=datetime.utcnow()
-        )
-        
-        db.session.add(trade)
+        resource_type = result['listing'].resource_type
         db.session.commit()
+        order_book.refresh(resource_type)
+        market_engine.cancel(resource_type, 'sell', listing_id)
+        price_history.refresh(resource_type)
         
-        flash(f'Successfully purchased {listing.quantity} {listing.resource_type}.', 'success')
+        flash(result['message'], 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error processing purchase: {str(e)}', 'danger')
@@ -150,33 +152,24 @@ def buy_listing(listing_id):
 @market.route('/market/cancel/<int:listing_id>', methods=['POST'])
 @easy_login_required
 def cancel_listing(listing_id):
-    # Get the market listing
-    listing = MarketItem.query.get_or_404(listing_id)
+    # Make sure the listing exists
+    MarketItem.query.get_or_404(listing_id)
     
-    # Make sure the user owns this listing
     nation = Nation.query.filter_by(user_id=current_user.id).first()
-    if listing.seller_id != nation.id:
-        flash('You do not own this listing.', 'danger')
-        return redirect(url_for('market.market_view'))
-    
-    # Make sure the listing is still active
-    if not listing.is_active:
-        flash('This listing is no longer active.', 'danger')
-        return redirect(url_for('market.market_view'))
-    
-    # Get the resources
-    resources = Resource.query.filter_by(nation_id=nation.id).first()
-    
-    # Return the resources to the seller
-    current_amount = getattr(resources, listing.resource_type)
-    setattr(resources, listing.resource_type, current_amount + listing.quantity)
-    
-    # Mark the listing as inactive
-    listing.is_active = False
     
+    # Return the resources to the seller, unless the listing was sold or cancelled meanwhile
     try:
+        result = withdraw_listing(listing_id, nation.id)
+        if not result['success']:
+            db.session.rollback()
+            flash(result['message'], 'danger')
+            return redirect(url_for('market.market_view'))
+        
+        resource_type = result['listing'].resource_type
         db.session.commit()
-        flash(f'Listing cancelled. {listing.quantity} {listing.resource_type} returned to your inventory.', 'success')
+        order_book.refresh(resource_type)
+        market_engine.cancel(resource_type, 'sell', listing_id)
+        flash(result['message'], 'success')
     except Exception as e:
         db.session.rollback()
         # Log the error
@@ -186,20 +179,33 @@ def cancel_listing(listing_id):
     return redirect(url_for('market.market_view'))
 
 @market.route('/market/prices')
+@market.route('/api/market/prices')
 @easy_login_required
 def market_prices():
     """Get recent market prices for charting"""
     
-    # Get the price history from completed trades
-    raw_materials_prices = Trade.query.filter_by(resource_type='raw_materials').order_by(Trade.trade_date.desc()).limit(20).all()
-    food_prices = Trade.query.filter_by(resource_type='food').order_by(Trade.trade_date.desc()).limit(20).all()
-    energy_prices = Trade.query.filter_by(resource_type='energy').order_by(Trade.trade_date.desc()).limit(20).all()
+    # Precomputed candles of the requested interval (1m, 1h or 1d), oldest first
+    interval = request.args.get('interval', '1h')
+    if interval not in CANDLE_INTERVALS:
+        interval = '1h'
+    limit = min(max(request.args.get('limit', 20, type=int), 1), CANDLE_DEPTH)
+    date_format = '%Y-%m-%d' if interval == '1d' else '%Y-%m-%d %H:%M'
     
-    # Format the data for the chart
+    # Format the data for the chart; 'price' is the closing price of each candle
     price_data = {
-        'raw_materials': [{'date': trade.trade_date.strftime('%Y-%m-%d %H:%M'), 'price': trade.price_per_unit} for trade in raw_materials_prices],
-        'food': [{'date': trade.trade_date.strftime('%Y-%m-%d %H:%M'), 'price': trade.price_per_unit} for trade in food_prices],
-        'energy': [{'date': trade.trade_date.strftime('%Y-%m-%d %H:%M'), 'price': trade.price_per_unit} for trade in energy_prices]
+        rtype: [
+            {
+                'date': candle['time'].strftime(date_format),
+                'price': candle['close'],
+                'open': candle['open'],
+                'high': candle['high'],
+                'low': candle['low'],
+                'close': candle['close'],
+                'volume': candle['volume']
+            }
+            for candle in price_history.candles(rtype, interval, limit)
+        ]
+        for rtype in MARKET_RESOURCE_TYPES
     }
     
     return jsonify(price_data)
\ No newline at end of file
@@ -3,8 +3,10 @@ from flask_login import current_user
 from app import db
 from models import Nation, Resource, Military, War, Alliance, BattleReport
 from datetime import datetime
-from utils.game_logic import calculate_military_power, conduct_attack, conduct_espionage
+from utils.game_logic import calculate_military_power, conduct_attack, conduct_espionage, invalidate_nation_modifiers, refresh_resource_rates
 from utils.auth import easy_login_required
+from utils.ranking_service import ranking_service
+from utils.alliance_graph import alliance_graph
 
 military = Blueprint('military', __name__)
 
@@ -23,7 +25,7 @@ def military_view():
     # Get possible nations to attack (exclude allies and nations already at war with)
     all_nations = Nation.query.filter(Nation.id != nation.id).all()
     at_war_with = [war.defender_id for war in active_wars_as_aggressor] + [war.aggressor_id for war in active_wars_as_defender]
-    allies = [ally.id for ally in nation.allies]
+    allies = alliance_graph.allies(nation.id)
     
     potential_targets = [n for n in all_nations if n.id not in at_war_with and n.id not in allies]
     
@@ -31,10 +33,17 @@ def military_view():
     military_forces.offensive_power = calculate_military_power(military_forces, 'offensive')
     military_forces.defensive_power = calculate_military_power(military_forces, 'defensive')
     military_forces.espionage_power = calculate_military_power(military_forces, 'espionage')
+    ranking_service.update_score('military', nation.id, military_forces.offensive_power + military_forces.defensive_power)
     
     # Calculate military limits based on population
     military_limits = get_military_limits(nation)
     
+    # Combined power of every nation linked to this one by a chain of alliances
+    alliance_bloc = {
+        "size": len(alliance_graph.bloc(nation.id)),
+        "military_power": alliance_graph.bloc_military_power(nation.id)
+    }
+    
     db.session.commit()
     
     return render_template('military.html',
@@ -45,6 +54,7 @@ def military_view():
                           active_wars_as_aggressor=active_wars_as_aggressor,
                           active_wars_as_defender=active_wars_as_defender,
                           potential_targets=potential_targets,
+                          alliance_bloc=alliance_bloc,
                           datetime=datetime)
 
 def get_military_limits(nation):
@@ -150,6 +160,8 @@ def build_military():
     
     # Add units
     setattr(military_forces, unit_type, current_amount + quantity)
+    invalidate_nation_modifiers(nation.id)
+    refresh_resource_rates(nation, resources)
     
     db.session.commit()
     
@@ -176,8 +188,8 @@ def declare_war():
         flash('You are already at war with this nation.', 'danger')
         return redirect(url_for('military.military_view'))
     
-    # Check if this nation is an ally
-    if target_nation in nation.allies:
+    # Check if this nation is an ally (against the database, not the cached graph)
+    if alliance_graph.active_alliance(nation.id, target_id) is not None:
         flash('You cannot declare war on an ally. You must dissolve the alliance first.', 'danger')
         return redirect(url_for('military.military_view'))
     
@@ -267,8 +279,8 @@ def propose_alliance():
     # Check if the target nation exists
     target_nation = Nation.query.get_or_404(target_id)
     
-    # Check if already allies
-    if target_nation in nation.allies:
+    # Check if already allies (against the database, not the cached graph)
+    if alliance_graph.active_alliance(nation.id, target_id) is not None:
         flash('You are already allies with this nation.', 'warning')
         return redirect(url_for('military.military_view'))
     
@@ -296,6 +308,7 @@ def propose_alliance():
     
     db.session.add(new_alliance)
     db.session.commit()
+    alliance_graph.add_alliance(nation.id, target_id)
     
     flash(f'Alliance formed with {target_nation.name}!', 'success')
     return redirect(url_for('military.military_view'))
\ No newline at end of file
@@ -3,22 +3,32 @@ Advanced espionage system that handles spy deployment, missions, and counter-int
 """
 from datetime import datetime, timedelta
 import random
-import json
 import logging
 from flask import current_app
+from sqlalchemy import case, update
 
 from app import db
 from models import Nation, Military, DeployedSpy, SpyMission, SpyReport, Technology
+from utils.game_logic import invalidate_nation_modifiers, refresh_resource_rates
+from utils.ranking_service import ranking_service
+from utils.intel_snapshot import target_snapshots
+from utils.listings import get_intel_reports
+from utils.research_queue import research_queue
+from utils.tech_state import get_technology_state, get_researched_tech_ids, get_tech_level, rebuild_technology_states
+from utils.tech_graph import TECH_BY_ID
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Long-term spies send an unprompted report this often
+PERIODIC_REPORT_INTERVAL = timedelta(days=14)
+
 class AdvancedEspionageSystem:
     """Handles all espionage operations for a nation."""
     
-    def __init__(self, nation):
+    def __init__(self, nation, military=None):
         self.nation = nation
-        self.military = Military.query.filter_by(nation_id=nation.id).first()
+        self.military = military or Military.query.filter_by(nation_id=nation.id).first()
         
         if not self.military:
             raise ValueError(f"No military record found for nation {nation.id}")
@@ -95,11 +105,14 @@ class AdvancedEspionageSystem:
             return {"success": False, "message": "No spies available for deployment."}
         
         # Create deployed spy record
+        now = datetime.utcnow()
         spy = DeployedSpy(
             owner_nation_id=self.nation.id,
             target_nation_id=target_nation_id,
             specialization=specialization,
-            skill_level=1  # Start at lowest skill level
+            skill_level=1,  # Start at lowest skill level
+            deployment_date=now,
+            next_report_at=now + PERIODIC_REPORT_INTERVAL
         )
         
         db.session.add(spy)
@@ -262,12 +275,7 @@ class AdvancedEspionageSystem:
         if not completed_missions:
             return {"success": True, "message": "No completed missions to process.", "completed": 0}
         
-        # Process each completed mission
-        results = []
-        for mission in completed_missions:
-            result = self._process_mission_outcome(mission)
-            results.append(result)
-            
+        results = self.process_missions(completed_missions)
         db.session.commit()
         
         return {
@@ -277,6 +285,10 @@ class AdvancedEspionageSystem:
             "results": results
         }
     
+    def process_missions(self, missions):
+        """Process the outcome of due missions of this nation's spies. Does not commit."""
+        return [self._process_mission_outcome(mission) for mission in missions]
+    
     def _process_mission_outcome(self, mission):
         """Process the outcome of a completed mission."""
         spy = mission.spy
@@ -366,6 +378,7 @@ class AdvancedEspionageSystem:
                     # Apply reduction
                     setattr(target_resources, resource_type, max(0, current_amount - reduced_amount))
                     
+                    target_snapshots.invalidate(target_nation.id)
                     result["effects"].append(f"Sabotaged {reduced_amount} {resource_type} from target nation")
                     mission.outcome_description = f"Sabotaged {reduced_amount} {resource_type}"
                 
@@ -386,6 +399,7 @@ class AdvancedEspionageSystem:
                     # Apply reduction
                     setattr(target_military, unit_type, max(0, current_amount - reduced_amount))
                     
+                    target_snapshots.invalidate(target_nation.id)
                     result["effects"].append(f"Sabotaged {reduced_amount} {unit_type} from target military")
                     mission.outcome_description = f"Sabotaged {reduced_amount} {unit_type}"
                 
@@ -470,165 +484,153 @@ class AdvancedEspionageSystem:
             mission_id=mission.id if mission else None,
             target_nation_id=target_nation.id,
             report_type=report_type,
-            intel_quality=intel_quality,
-            report_content=json.dumps(report_content)
+            intel_quality=intel_quality
         )
+        report.content = report_content
         
         db.session.add(report)
         return report
     
     def _generate_report_content(self, target_nation, report_type, intel_quality):
-        """Generate content for an intelligence report."""
+        """Generate content for an intelligence report.
+        Exact values come from the shared target snapshot; the inaccuracy of this
+        report's intel quality is applied on top of them."""
+        snapshot = target_snapshots.get(target_nation, report_type)
+        
+        accuracy = 0.7 + (intel_quality * 0.06)  # 82-100% accuracy based on quality
+        
+        def fuzz_number(number):
+            """Add slight inaccuracy to numbers based on intel quality."""
+            fuzz_factor = 1 + ((random.random() * 2 - 1) * (1 - accuracy))
+            return int(number * fuzz_factor)
+        
         # Basic content available at all quality levels
         content = {
-            "nation_name": target_nation.name,
-            "continent": target_nation.continent,
+            "nation_name": snapshot["nation_name"],
+            "continent": snapshot["continent"],
             "intel_quality": intel_quality
         }
         
         # Add specific content based on report type and quality
         if report_type == 'military' or report_type == 'general':
-            target_military = Military.query.filter_by(nation_id=target_nation.id).first()
+            target_military = snapshot["military"]
             
             if target_military:
                 # Level 1: Basic military power
                 if intel_quality >= 1:
                     content["military_power"] = {
-                        "offensive": int(target_military.offensive_power),
-                        "defensive": int(target_military.defensive_power)
+                        "offensive": int(target_military["offensive_power"]),
+                        "defensive": int(target_military["defensive_power"])
                     }
                 
                 # Level 2: Basic unit counts (with slight inaccuracy)
                 if intel_quality >= 2:
-                    accuracy = 0.7 + (intel_quality * 0.06)  # 82-100% accuracy based on quality
-                    
-                    def fuzz_number(number):
-                        """Add slight inaccuracy to numbers based on intel quality."""
-                        fuzz_factor = 1 + ((random.random() * 2 - 1) * (1 - accuracy))
-                        return int(number * fuzz_factor)
-                    
                     content["military_units"] = {
-                        "infantry": fuzz_number(target_military.infantry),
-                        "tanks": fuzz_number(target_military.tanks),
-                        "aircraft": fuzz_number(target_military.aircraft)
+                        "infantry": fuzz_number(target_military["infantry"]),
+                        "tanks": fuzz_number(target_military["tanks"]),
+                        "aircraft": fuzz_number(target_military["aircraft"])
                     }
                 
                 # Level 3: More unit details
                 if intel_quality >= 3:
-                    content["military_units"]["navy"] = fuzz_number(target_military.navy)
-                    content["military_units"]["missiles"] = fuzz_number(target_military.missiles)
+                    content["military_units"]["navy"] = fuzz_number(target_military["navy"])
+                    content["military_units"]["missiles"] = fuzz_number(target_military["missiles"])
                 
                 # Level 4: Defensive structures
                 if intel_quality >= 4:
                     content["defensive_structures"] = {
-                        "bunkers": fuzz_number(target_military.bunkers),
-                        "anti_air": fuzz_number(target_military.anti_air),
-                        "coastal_defenses": fuzz_number(target_military.coastal_defenses)
+                        "bunkers": fuzz_number(target_military["bunkers"]),
+                        "anti_air": fuzz_number(target_military["anti_air"]),
+                        "coastal_defenses": fuzz_number(target_military["coastal_defenses"])
                     }
                 
                 # Level 5: Counter-intelligence capabilities
                 if intel_quality >= 5:
-                    content["counter_intelligence"] = target_military.counter_intelligence
-                    content["espionage_power"] = int(target_military.espionage_power)
+                    content["counter_intelligence"] = target_military["counter_intelligence"]
+                    content["espionage_power"] = int(target_military["espionage_power"])
         
         if report_type == 'economic' or report_type == 'general':
-            from models import Resource
-            target_resources = Resource.query.filter_by(nation_id=target_nation.id).first()
+            target_economy = snapshot["economic"]
             
-            if target_resources:
+            if target_economy:
+                amounts = target_economy["amounts"]
+                
                 # Level 1: GDP and tax rate
                 if intel_quality >= 1:
                     content["economic"] = {
-                        "gdp": int(target_nation.gdp),
-                        "tax_rate": target_nation.tax_rate
+                        "gdp": int(snapshot["gdp"]),
+                        "tax_rate": snapshot["tax_rate"]
                     }
                 
                 # Level 2: Basic resource amounts
                 if intel_quality >= 2:
-                    accuracy = 0.7 + (intel_quality * 0.06)
-                    
-                    def fuzz_number(number):
-                        fuzz_factor = 1 + ((random.random() * 2 - 1) * (1 - accuracy))
-                        return int(number * fuzz_factor)
-                    
                     content["resources"] = {
-                        "raw_materials": fuzz_number(target_resources.raw_materials),
-                        "food": fuzz_number(target_resources.food),
-                        "energy": fuzz_number(target_resources.energy)
+                        "raw_materials": fuzz_number(amounts["raw_materials"]),
+                        "food": fuzz_number(amounts["food"]),
+                        "energy": fuzz_number(amounts["energy"])
                     }
                 
                 # Level 3: Production rates
                 if intel_quality >= 3:
                     content["production_rates"] = {
-                        "raw_materials": fuzz_number(target_resources.raw_materials_production),
-                        "food": fuzz_number(target_resources.food_production),
-                        "energy": fuzz_number(target_resources.energy_production)
+                        resource_type: fuzz_number(rate)
+                        for resource_type, rate in target_economy["production"].items()
                     }
                 
                 # Level 4: Currency and tech points
                 if intel_quality >= 4:
-                    content["resources"]["currency"] = fuzz_number(target_resources.currency)
-                    content["resources"]["technology_points"] = fuzz_number(target_resources.technology_points)
+                    content["resources"]["currency"] = fuzz_number(amounts["currency"])
+                    content["resources"]["technology_points"] = fuzz_number(amounts["technology_points"])
                 
                 # Level 5: Consumption rates and population distribution
                 if intel_quality >= 5:
                     content["consumption_rates"] = {
-                        "raw_materials": fuzz_number(target_resources.raw_materials_consumption),
-                        "food": fuzz_number(target_resources.food_consumption),
-                        "energy": fuzz_number(target_resources.energy_consumption)
+                        resource_type: fuzz_number(rate)
+                        for resource_type, rate in target_economy["consumption"].items()
                     }
                     
-                    content["population_distribution"] = {
-                        "agriculture": target_nation.agriculture_population,
-                        "industry": target_nation.industry_population,
-                        "energy": target_nation.energy_population,
-                        "research": target_nation.research_population,
-                        "military": target_nation.military_population
-                    }
+                    content["population_distribution"] = dict(snapshot["population_distribution"])
         
         if report_type == 'technological' or report_type == 'general':
-            # Get target nation's technologies
-            technologies = Technology.query.filter_by(nation_id=target_nation.id).all()
+            target_technology = snapshot["technology"]
             
-            if technologies:
+            if target_technology:
+                technologies = target_technology["technologies"]
+                researched_techs = [tech for tech in technologies if tech["level"] > 0]
+                
                 # Level 1: Count of researched technologies
                 if intel_quality >= 1:
-                    researched_count = sum(1 for tech in technologies if tech.level > 0)
                     content["technology"] = {
-                        "researched_count": researched_count,
-                        "total_count": len(technologies)
+                        "researched_count": len(researched_techs),
+                        "total_count": target_technology["total_count"]
                     }
                 
                 # Level 2: Basic research categories
                 if intel_quality >= 2:
                     categories = {}
-                    for tech in technologies:
-                        if tech.level > 0:
-                            if tech.category not in categories:
-                                categories[tech.category] = 0
-                            categories[tech.category] += 1
+                    for tech in researched_techs:
+                        categories[tech["category"]] = categories.get(tech["category"], 0) + 1
                     
                     content["technology"]["categories"] = categories
                 
                 # Level 3: Some specific technology names
                 if intel_quality >= 3:
-                    researched_techs = [tech for tech in technologies if tech.level > 0]
                     sample_size = min(3 + intel_quality, len(researched_techs))
                     sample_techs = random.sample(researched_techs, sample_size) if researched_techs else []
                     
                     content["technology"]["sample_techs"] = [
-                        {"name": tech.name, "level": tech.level} for tech in sample_techs
+                        {"name": tech["name"], "level": tech["level"]} for tech in sample_techs
                     ]
                 
                 # Level 4: Current research
                 if intel_quality >= 4:
-                    researching_techs = [tech for tech in technologies if tech.researching]
+                    researching_techs = [tech for tech in technologies if tech["researching"]]
                     if researching_techs:
                         content["technology"]["current_research"] = [
                             {
-                                "name": tech.name,
-                                "progress": tech.research_points_current / tech.research_points_required if tech.research_points_required > 0 else 0,
-                                "estimated_completion": tech.estimated_completion.strftime("%Y-%m-%d %H:%M:%S") if tech.estimated_completion else None
+                                "name": tech["name"],
+                                "progress": tech["progress"],
+                                "estimated_completion": tech["estimated_completion"]
                             } for tech in researching_techs
                         ]
                 
@@ -636,137 +638,70 @@ class AdvancedEspionageSystem:
                 if intel_quality >= 5:
                     content["technology"]["tech_tree"] = [
                         {
-                            "name": tech.name,
-                            "category": tech.category,
-                            "level": tech.level,
-                            "max_level": tech.max_level,
-                            "description": tech.description
-                        } for tech in technologies if tech.level > 0
+                            "name": tech["name"],
+                            "category": tech["category"],
+                            "level": tech["level"],
+                            "max_level": tech["max_level"],
+                            "description": tech["description"]
+                        } for tech in researched_techs
                     ]
         
         if report_type == 'diplomatic' or report_type == 'general':
+            target_diplomacy = snapshot["diplomacy"]
+            
             # Level 1: Basic diplomatic status (wars and alliances count)
             if intel_quality >= 1:
-                from models import War, Alliance
-                
-                active_wars = War.query.filter(
-                    (War.aggressor_id == target_nation.id) | (War.defender_id == target_nation.id),
-                    War.is_active == True
-                ).count()
-                
-                alliances = Alliance.query.filter(
-                    (Alliance.nation1_id == target_nation.id) | (Alliance.nation2_id == target_nation.id),
-                    Alliance.is_active == True
-                ).count()
-                
                 content["diplomacy"] = {
-                    "active_wars": active_wars,
-                    "alliances": alliances
+                    "active_wars": len(target_diplomacy["wars"]),
+                    "alliances": target_diplomacy["alliance_count"]
                 }
             
             # Level 2: War details
-            if intel_quality >= 2:
-                wars = War.query.filter(
-                    (War.aggressor_id == target_nation.id) | (War.defender_id == target_nation.id),
-                    War.is_active == True
-                ).all()
-                
-                if wars:
-                    content["diplomacy"]["wars"] = []
-                    for war in wars:
-                        opponent_id = war.defender_id if war.aggressor_id == target_nation.id else war.aggressor_id
-                        opponent = Nation.query.get(opponent_id)
-                        
-                        war_info = {
-                            "opponent": opponent.name if opponent else "Unknown",
-                            "is_aggressor": war.aggressor_id == target_nation.id,
-                            "start_date": war.start_date.strftime("%Y-%m-%d")
-                        }
-                        
-                        content["diplomacy"]["wars"].append(war_info)
+            if intel_quality >= 2 and target_diplomacy["wars"]:
+                content["diplomacy"]["wars"] = [
+                    {
+                        "opponent": war["opponent"],
+                        "is_aggressor": war["is_aggressor"],
+                        "start_date": war["start_date"]
+                    } for war in target_diplomacy["wars"]
+                ]
             
             # Level 3: Alliance details
-            if intel_quality >= 3:
-                alliances = Alliance.query.filter(
-                    (Alliance.nation1_id == target_nation.id) | (Alliance.nation2_id == target_nation.id),
-                    Alliance.is_active == True
-                ).all()
-                
-                if alliances:
-                    content["diplomacy"]["alliances"] = []
-                    for alliance in alliances:
-                        ally_id = alliance.nation2_id if alliance.nation1_id == target_nation.id else alliance.nation1_id
-                        ally = Nation.query.get(ally_id)
-                        
-                        alliance_info = {
-                            "ally": ally.name if ally else "Unknown",
-                            "formed_date": alliance.formed_date.strftime("%Y-%m-%d")
-                        }
-                        
-                        content["diplomacy"]["alliances"].append(alliance_info)
+            if intel_quality >= 3 and target_diplomacy["alliances"]:
+                content["diplomacy"]["alliances"] = [dict(alliance) for alliance in target_diplomacy["alliances"]]
             
             # Level 4: Transit rights
-            if intel_quality >= 4:
-                from models import TransitRights
-                
-                transit_rights = TransitRights.query.filter(
-                    (TransitRights.grantor_id == target_nation.id) | (TransitRights.receiver_id == target_nation.id),
-                    TransitRights.is_active == True
-                ).all()
-                
-                if transit_rights:
-                    content["diplomacy"]["transit_rights"] = []
-                    for tr in transit_rights:
-                        other_id = tr.receiver_id if tr.grantor_id == target_nation.id else tr.grantor_id
-                        other_nation = Nation.query.get(other_id)
-                        
-                        tr_info = {
-                            "nation": other_nation.name if other_nation else "Unknown",
-                            "is_grantor": tr.grantor_id == target_nation.id,
-                            "granted_date": tr.granted_date.strftime("%Y-%m-%d")
-                        }
-                        
-                        content["diplomacy"]["transit_rights"].append(tr_info)
+            if intel_quality >= 4 and target_diplomacy["transit_rights"]:
+                content["diplomacy"]["transit_rights"] = [dict(right) for right in target_diplomacy["transit_rights"]]
             
             # Level 5: War casualties and peace proposals
             if intel_quality >= 5 and "wars" in content.get("diplomacy", {}):
-                wars = War.query.filter(
-                    (War.aggressor_id == target_nation.id) | (War.defender_id == target_nation.id),
-                    War.is_active == True
-                ).all()
-                
-                for i, war in enumerate(wars):
-                    if war.aggressor_id == target_nation.id:
-                        casualties = war.aggressor_casualties
-                    else:
-                        casualties = war.defender_casualties
-                    
-                    content["diplomacy"]["wars"][i]["casualties"] = casualties
-                    content["diplomacy"]["wars"][i]["peace_proposed"] = war.peace_proposed
+                for war_info, war in zip(content["diplomacy"]["wars"], target_diplomacy["wars"]):
+                    war_info["casualties"] = war["casualties"]
+                    war_info["peace_proposed"] = war["peace_proposed"]
         
         return content
     
     def _steal_technology(self, spy, target_nation):
         """Attempt to steal technology from target nation."""
-        # Get a random researched technology from target
-        researched_techs = Technology.query.filter(
-            Technology.nation_id == target_nation.id,
-            Technology.level > 0
-        ).all()
+        # Get a random researched technology from the target's technology state
+        target_state = get_technology_state(target_nation.id)
+        researched_tech_ids = get_researched_tech_ids(target_state)
         
-        if not researched_techs:
+        if not researched_tech_ids:
             return False  # No technologies to steal
         
         # Pick a random technology
-        stolen_tech = random.choice(researched_techs)
+        stolen_tech_id = random.choice(researched_tech_ids)
+        stolen_tech_level = get_tech_level(target_state, stolen_tech_id)
         
         # Check if we already have this technology
         our_tech = Technology.query.filter_by(
             nation_id=self.nation.id,
-            name=stolen_tech.name
+            tech_id=stolen_tech_id
         ).first()
         
-        if our_tech and our_tech.level >= stolen_tech.level:
+        if our_tech and our_tech.level >= stolen_tech_level:
             # We already have this tech at same or higher level
             return False
         
@@ -774,26 +709,37 @@ class AdvancedEspionageSystem:
         if our_tech:
             # If we're researching it, add a significant boost
             if our_tech.researching:
-                our_tech.research_points_current += our_tech.research_points_required * 0.5
+                # Progress is derived from the research timestamps, so the boost
+                # moves the whole research window half of its duration earlier
+                if our_tech.research_started and our_tech.estimated_completion:
+                    boost = (our_tech.estimated_completion - our_tech.research_started) * 0.5
+                    our_tech.research_started -= boost
+                    our_tech.estimated_completion -= boost
                 
                 # If this completes the research, level up the tech
-                if our_tech.research_points_current >= our_tech.research_points_required:
+                if our_tech.research_progress() >= 1.0:
                     our_tech.level += 1
                     our_tech.researching = False
                     our_tech.research_points_current = 0
+                    rebuild_technology_states([self.nation.id])
+                    invalidate_nation_modifiers(self.nation.id)
+                    refresh_resource_rates(self.nation)
+                    ranking_service.adjust_score('technology', self.nation.id, 1)
+                else:
+                    research_queue.schedule(our_tech.id, our_tech.estimated_completion)
             else:
                 # If we're not researching it, add tech points to our nation
                 from models import Resource
                 resources = Resource.query.filter_by(nation_id=self.nation.id).first()
                 if resources:
                     # Add significant tech points
-                    resources.technology_points += 250 * stolen_tech.level
+                    resources.technology_points += 250 * stolen_tech_level
         else:
             # We don't have this tech at all - add tech points
             from models import Resource
             resources = Resource.query.filter_by(nation_id=self.nation.id).first()
             if resources:
-                resources.technology_points += 500 * stolen_tech.level
+                resources.technology_points += 500 * stolen_tech_level
         
         return True
     
@@ -877,11 +823,7 @@ class AdvancedEspionageSystem:
         total_power = spy_power + counter_intel_power
         
         # Apply technology bonuses if any
-        tech_bonus = 1.0
-        technologies = Technology.query.filter_by(nation_id=self.nation.id).all()
-        for tech in technologies:
-            if tech.level > 0 and tech.espionage_bonus > 0:
-                tech_bonus += (tech.espionage_bonus * tech.level * 0.1)
+        tech_bonus = 1.0 + get_technology_state(self.nation.id).espionage_bonus
         
         total_power *= tech_bonus
         
@@ -890,28 +832,18 @@ class AdvancedEspionageSystem:
         
         return total_power
     
-    def get_intel_reports(self, target_nation_id=None, report_type=None, limit=10):
+    def get_intel_reports(self, target_nation_id=None, report_type=None, limit=10, cursor=None):
         """Get intelligence reports for this nation."""
-        query = SpyReport.query.filter_by(nation_id=self.nation.id)
-        
-        if target_nation_id:
-            query = query.filter_by(target_nation_id=target_nation_id)
-        
-        if report_type:
-            query = query.filter_by(report_type=report_type)
-        
-        # Get the most recent reports
-        reports = query.order_by(SpyReport.report_date.desc()).limit(limit).all()
+        # Get the most recent reports with their target nations
+        reports, _ = get_intel_reports(
+            self.nation.id, limit=limit, cursor=cursor,
+            target_nation_id=target_nation_id, report_type=report_type
+        )
         
         # Process reports for display
         processed_reports = []
         for report in reports:
-            # Parse the JSON content
-            content = json.loads(report.report_content)
-            
-            # Get target nation name
-            target_nation = Nation.query.get(report.target_nation_id)
-            target_name = target_nation.name if target_nation else "Unknown"
+            target_name = report.target_nation.name if report.target_nation else "Unknown"
             
             # Process report
             processed_report = {
@@ -920,7 +852,7 @@ class AdvancedEspionageSystem:
                 "report_date": report.report_date.strftime("%Y-%m-%d %H:%M"),
                 "report_type": report.report_type,
                 "intel_quality": report.intel_quality,
-                "content": content
+                "content": report.content
             }
             
             processed_reports.append(processed_report)
@@ -1014,21 +946,50 @@ def check_active_missions():
     """Background task to check for completed missions across all nations."""
     with current_app.app_context():
         try:
-            # Get all nations
-            nations = Nation.query.all()
-            total_completed = 0
+            now = datetime.utcnow()
+            target_snapshots.clear()  # New tick: targets are read again, once each
+            
+            # Due missions of active spies, from the (is_completed, completion_date) index
+            due_missions = SpyMission.query.join(DeployedSpy, SpyMission.spy_id == DeployedSpy.id).options(
+                db.contains_eager(SpyMission.spy)
+            ).filter(
+                SpyMission.is_completed == False,
+                SpyMission.completion_date <= now,
+                DeployedSpy.is_active == True
+            ).order_by(SpyMission.completion_date, SpyMission.id).all()
+            
+            if not due_missions:
+                return {"success": True, "total_completed": 0}
             
-            for nation in nations:
-                try:
-                    # Process missions for this nation
-                    espionage_system = AdvancedEspionageSystem(nation)
-                    result = espionage_system.check_mission_outcomes()
+            # Group by owner nation, then load the owners and their military in two queries
+            missions_by_owner = {}
+            for mission in due_missions:
+                missions_by_owner.setdefault(mission.spy.owner_nation_id, []).append(mission)
+            
+            owner_ids = list(missions_by_owner)
+            nations = {nation.id: nation for nation in Nation.query.filter(Nation.id.in_(owner_ids)).all()}
+            militaries = {}
+            for military in Military.query.filter(Military.nation_id.in_(owner_ids)).order_by(Military.id).all():
+                militaries.setdefault(military.nation_id, military)
+            
+            # Resolve every outcome in one transaction
+            total_completed = 0
+            try:
+                for owner_id, missions in missions_by_owner.items():
+                    nation = nations.get(owner_id)
+                    military = militaries.get(owner_id)
+                    if not nation or not military:
+                        logger.error(f"Skipping {len(missions)} due missions of nation {owner_id}: no nation or military record")
+                        continue
                     
-                    if result["completed"] > 0:
-                        total_completed += result["completed"]
-                        logger.info(f"Processed {result['completed']} missions for {nation.name}")
-                except Exception as e:
-                    logger.error(f"Error processing missions for nation {nation.id}: {str(e)}")
+                    AdvancedEspionageSystem(nation, military).process_missions(missions)
+                    total_completed += len(missions)
+                    logger.info(f"Processed {len(missions)} missions for {nation.name}")
+                
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
             
             if total_completed > 0:
                 logger.info(f"Completed {total_completed} spy missions across all nations")
@@ -1043,46 +1004,73 @@ def update_spy_cover_and_intel():
     """Background task to update spy cover and intel levels for all deployed spies."""
     with current_app.app_context():
         try:
-            # Get all active deployed spies
-            active_spies = DeployedSpy.query.filter_by(is_active=True).all()
+            now = datetime.utcnow()
+            target_snapshots.clear()  # New tick: targets are read again, once each
             
-            for spy in active_spies:
-                try:
-                    # Decrease cover over time (more if spy has been discovered)
-                    cover_decay = 0.5 if not spy.is_discovered else 2.0
-                    spy.cover_strength = max(0, spy.cover_strength - cover_decay)
-                    
-                    # If cover reaches 0, spy is automatically discovered
-                    if spy.cover_strength <= 0 and not spy.is_discovered:
-                        spy.is_discovered = True
-                        # TODO: Create diplomatic incident
-                    
-                    # Increase intel level over time (if not discovered)
-                    if not spy.is_discovered:
-                        # Intel gain is based on skill level
-                        intel_gain = 0.2 * spy.skill_level
-                        spy.intel_level += intel_gain
-                        
-                        # Generate periodic reports from long-term spies
-                        # Every 14 days (336 hours) of deployment, generate a report
-                        hours_deployed = (datetime.utcnow() - spy.deployment_date).total_seconds() / 3600
-                        if hours_deployed > 0 and hours_deployed % 336 < 1:  # Within 1 hour of the 14-day mark
-                            try:
-                                # Get the spy's nation
-                                nation = Nation.query.get(spy.owner_nation_id)
-                                if nation:
-                                    espionage_system = AdvancedEspionageSystem(nation)
-                                    # Generate a report
-                                    espionage_system._generate_spy_report(spy)
-                                    logger.info(f"Generated periodic report for spy {spy.id} in {spy.target_nation_id}")
-                            except Exception as e:
-                                logger.error(f"Error generating periodic report for spy {spy.id}: {str(e)}")
-                except Exception as e:
-                    logger.error(f"Error updating spy {spy.id}: {str(e)}")
+            # Cover decays over time (more if the spy has been discovered); a spy whose
+            # cover runs out is discovered, and undiscovered spies gain intel by skill.
+            # Every SET expression reads the values from before the update.
+            spy_table = DeployedSpy.__table__.c
+            cover_decay = case((spy_table.is_discovered == True, 2.0), else_=0.5)
+            loses_cover = spy_table.cover_strength - cover_decay <= 0
+            spies_updated = db.session.execute(
+                update(DeployedSpy.__table__)
+                .where(spy_table.is_active == True)
+                .values(
+                    cover_strength=case((loses_cover, 0.0), else_=spy_table.cover_strength - cover_decay),
+                    is_discovered=case((spy_table.is_discovered == True, True), (loses_cover, True), else_=False),
+                    # TODO: Create diplomatic incident for newly discovered spies
+                    intel_level=case(
+                        ((spy_table.is_discovered == False) & ~loses_cover,
+                         spy_table.intel_level + 0.2 * spy_table.skill_level),
+                        else_=spy_table.intel_level
+                    )
+                )
+            ).rowcount
+            
+            # Periodic reports from long-term spies that are still undercover
+            reports_generated = generate_periodic_reports(now)
             
             db.session.commit()
-            return {"success": True, "spies_updated": len(active_spies)}
+            return {"success": True, "spies_updated": spies_updated, "reports_generated": reports_generated}
         except Exception as e:
             logger.error(f"Error in update_spy_cover_and_intel: {str(e)}")
             db.session.rollback()
-            return {"success": False, "error": str(e)}
\ No newline at end of file
+            return {"success": False, "error": str(e)}
+
+
+def generate_periodic_reports(now=None):
+    """Generate the periodic report of every undercover spy whose next_report_at has
+    passed and schedule its next one. Does not commit."""
+    if now is None:
+        now = datetime.utcnow()
+    
+    due_spies = DeployedSpy.query.filter(
+        DeployedSpy.is_active == True,
+        DeployedSpy.next_report_at <= now,
+        DeployedSpy.is_discovered == False
+    ).order_by(DeployedSpy.next_report_at, DeployedSpy.id).all()
+    if not due_spies:
+        return 0
+    
+    owner_ids = list({spy.owner_nation_id for spy in due_spies})
+    nations = {nation.id: nation for nation in Nation.query.filter(Nation.id.in_(owner_ids)).all()}
+    militaries = {}
+    for military in Military.query.filter(Military.nation_id.in_(owner_ids)).order_by(Military.id).all():
+        militaries.setdefault(military.nation_id, military)
+    
+    reports_generated = 0
+    for spy in due_spies:
+        # Skip the reports missed while the job was not running
+        while spy.next_report_at <= now:
+            spy.next_report_at += PERIODIC_REPORT_INTERVAL
+        
+        nation = nations.get(spy.owner_nation_id)
+        military = militaries.get(spy.owner_nation_id)
+        if not nation or not military:
+            continue
+        AdvancedEspionageSystem(nation, military)._generate_spy_report(spy)
+        reports_generated += 1
+        logger.info(f"Generated periodic report for spy {spy.id} in {spy.target_nation_id}")
+    
+    return reports_generated
@@ -0,0 +1,175 @@
+"""
+Alliance graph.
+
+Active alliances are kept in memory as adjacency sets, together with the connected
+alliance blocs (nations linked by a chain of alliances). Both are updated when an
+alliance is formed or dissolved, so ally, shared-ally and bloc questions no longer
+query the Alliance table.
+"""
+from datetime import datetime, timedelta
+import threading
+from app import db
+from models import Alliance
+from utils.ranking_service import ranking_service
+
+# The graph is rebuilt from the database after this long, so alliances changed
+# by other worker processes are picked up even without an explicit update
+GRAPH_MAX_AGE = timedelta(minutes=10)
+
+class AllianceGraph:
+    """Active alliances as an undirected graph with its connected blocs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._allies = {}    # nation_id -> set of allied nation ids
+        self._bloc_of = {}   # nation_id -> bloc (shared set of member ids), for allied nations only
+        self._loaded_at = None
+
+    def _load(self):
+        """Rebuild the adjacency sets and blocs from the active alliances."""
+        self._allies = {}
+        self._bloc_of = {}
+        pairs = db.session.query(Alliance.nation1_id, Alliance.nation2_id).filter(Alliance.is_active == True).all()
+        for nation1_id, nation2_id in pairs:
+            self._link(nation1_id, nation2_id)
+        self._loaded_at = datetime.utcnow()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or datetime.utcnow() - self._loaded_at > GRAPH_MAX_AGE:
+            self._load()
+
+    def _link(self, nation1_id, nation2_id):
+        if nation1_id == nation2_id:
+            return
+        self._allies.setdefault(nation1_id, set()).add(nation2_id)
+        self._allies.setdefault(nation2_id, set()).add(nation1_id)
+
+        bloc1 = self._bloc_of.get(nation1_id, {nation1_id})
+        bloc2 = self._bloc_of.get(nation2_id, {nation2_id})
+        if bloc1 is bloc2:
+            return
+        # Merge the smaller bloc into the larger one
+        if len(bloc1) < len(bloc2):
+            bloc1, bloc2 = bloc2, bloc1
+        bloc1 |= bloc2
+        for nation_id in bloc1:
+            self._bloc_of[nation_id] = bloc1
+
+    def _unlink(self, nation1_id, nation2_id):
+        if nation2_id not in self._allies.get(nation1_id, ()):
+            return
+        for nation_id, other_id in ((nation1_id, nation2_id), (nation2_id, nation1_id)):
+            self._allies[nation_id].discard(other_id)
+            if not self._allies[nation_id]:
+                del self._allies[nation_id]
+
+        # Re-walk the bloc from one side; the other side becomes a bloc of its own if cut off
+        old_bloc = self._bloc_of[nation1_id]
+        for nation_id in old_bloc:
+            self._bloc_of.pop(nation_id, None)
+        remaining = set(old_bloc)
+        while remaining:
+            start = remaining.pop()
+            bloc = {start}
+            stack = [start]
+            while stack:
+                for ally_id in self._allies.get(stack.pop(), ()):
+                    if ally_id not in bloc:
+                        bloc.add(ally_id)
+                        stack.append(ally_id)
+            remaining -= bloc
+            if len(bloc) > 1:
+                for nation_id in bloc:
+                    self._bloc_of[nation_id] = bloc
+
+    def invalidate(self):
+        """Force a rebuild on the next lookup."""
+        with self._lock:
+            self._loaded_at = None
+
+    def add_alliance(self, nation1_id, nation2_id):
+        """Record a newly formed alliance."""
+        with self._lock:
+            if self._loaded_at is None:
+                return  # Nothing loaded yet, the next lookup reads it from the database
+            self._link(nation1_id, nation2_id)
+
+    def remove_alliance(self, nation1_id, nation2_id):
+        """Record a dissolved alliance."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._unlink(nation1_id, nation2_id)
+
+    def allies(self, nation_id):
+        """Ids of a nation's allies."""
+        with self._lock:
+            self._ensure_loaded()
+            return set(self._allies.get(nation_id, ()))
+
+    def alliance_count(self, nation_id):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._allies.get(nation_id, ()))
+
+    def are_allied(self, nation1_id, nation2_id):
+        with self._lock:
+            self._ensure_loaded()
+            return nation2_id in self._allies.get(nation1_id, ())
+
+    def active_alliance(self, nation1_id, nation2_id):
+        """Active Alliance row between two nations, read from the database.
+        Forming an alliance or declaring war checks this rather than the graph, which
+        may not have seen a change made by another worker process yet; the graph is
+        corrected if it disagrees."""
+        alliance = Alliance.query.filter(
+            ((Alliance.nation1_id == nation1_id) & (Alliance.nation2_id == nation2_id)) |
+            ((Alliance.nation1_id == nation2_id) & (Alliance.nation2_id == nation1_id)),
+            Alliance.is_active == True
+        ).first()
+        with self._lock:
+            if self._loaded_at is not None:
+                allied = nation2_id in self._allies.get(nation1_id, ())
+                if alliance is not None and not allied:
+                    self._link(nation1_id, nation2_id)
+                elif alliance is None and allied:
+                    self._unlink(nation1_id, nation2_id)
+        return alliance
+
+    def shared_allies(self, nation1_id, nation2_id):
+        """Number of nations allied with both nations."""
+        with self._lock:
+            self._ensure_loaded()
+            allies1 = self._allies.get(nation1_id, set())
+            allies2 = self._allies.get(nation2_id, set())
+            if len(allies1) > len(allies2):
+                allies1, allies2 = allies2, allies1
+            return sum(1 for ally_id in allies1 if ally_id in allies2)
+
+    def shared_allies_with(self, nation_id):
+        """Map other nation id -> number of allies it shares with a nation, for every
+        nation sharing at least one (walks the allies of the nation's allies)."""
+        with self._lock:
+            self._ensure_loaded()
+            shared = {}
+            for ally_id in self._allies.get(nation_id, ()):
+                for other_id in self._allies[ally_id]:
+                    if other_id != nation_id:
+                        shared[other_id] = shared.get(other_id, 0) + 1
+            return shared
+
+    def bloc(self, nation_id):
+        """Ids of every nation in a nation's alliance bloc, the nation included."""
+        with self._lock:
+            self._ensure_loaded()
+            return set(self._bloc_of.get(nation_id, {nation_id}))
+
+    def bloc_military_power(self, nation_id):
+        """Combined offensive + defensive power of a nation's alliance bloc."""
+        return sum(
+            score or 0 for score in ranking_service.scores('military', self.bloc(nation_id)).values()
+        )
+
+
+# Shared instance used by the diplomacy, military and espionage code
+alliance_graph = AllianceGraph()
@@ -3,6 +3,8 @@ from flask import redirect, url_for, flash, session
 from flask_login import current_user, login_user
 from models import User, Nation, Resource, Military, Technology
 from app import db
+from utils.geography import geography
+from utils.tech_state import new_technology_state
 import traceback
 
 def easy_login_required(f):
@@ -50,6 +52,7 @@ def easy_login_required(f):
                     )
                     db.session.add(test_nation)
                     db.session.commit()
+                    geography.update_nation(test_nation)
                     
                     # Create initial resources with default values
                     initial_resources = Resource(
@@ -91,6 +94,9 @@ def easy_login_required(f):
                     )
                     db.session.add(initial_military)
                     
+                    # Technology state of a nation without technologies
+                    db.session.add(new_technology_state(test_nation.id))
+                    
                     db.session.commit()
                     print("Created demo nation with resources and military")
                 
@@ -2,26 +2,62 @@
 Diplomacy handler for managing diplomatic relations and actions.
 """
 from datetime import datetime, timedelta
+import hashlib
 from app import db
 from models import Nation, Alliance, War, TransitRights
 from data.diplomacy import DIPLOMATIC_ACTIONS, RELATION_STATES
-import random
+from utils.relation_store import get_stored_relation, get_stored_relations, record_relation_change, update_relations
+from utils.geography import geography, nations_are_neighbors, travel_time_between
+from utils.alliance_graph import alliance_graph
 
 # Maximum diplomatic influence a nation can have
 MAX_DIPLOMATIC_INFLUENCE = 100
 
+# Relation bonus per ally two nations have in common, and its cap
+SHARED_ALLY_BONUS = 5
+MAX_SHARED_ALLY_BONUS = 15
+
+def get_relation_state_for(value):
+    """Relation state (from RELATION_STATES) of a relation value."""
+    for state in RELATION_STATES:
+        if state["range"][0] <= value <= state["range"][1]:
+            return state
+    
+    # Default to neutral if no matching range found
+    return next(state for state in RELATION_STATES if state["name"] == "Neutral")
+
+def get_shared_allies_modifier(shared_allies):
+    """Relation modifier for the allies two nations have in common, or None."""
+    if not shared_allies:
+        return None
+    return {
+        "source": f"Shared allies ({shared_allies})",
+        "value": min(MAX_SHARED_ALLY_BONUS, shared_allies * SHARED_ALLY_BONUS),
+        "expiry": None
+    }
+
+def get_base_relation_value(is_allied, is_at_war):
+    """Relation value implied by an alliance or a war, before stored adjustments."""
+    if is_allied:
+        return 80  # Allied nations start with high relation
+    if is_at_war:
+        return -80  # Nations at war start with low relation
+    return 0  # Neutral by default
+
 class DiplomaticRelation:
     """Class for tracking and managing relations between nations."""
     def __init__(self, nation1_id, nation2_id):
         self.nation1_id = nation1_id
         self.nation2_id = nation2_id
         
-        # Check for existing alliance
-        self.alliance = Alliance.query.filter(
-            ((Alliance.nation1_id == nation1_id) & (Alliance.nation2_id == nation2_id)) |
-            ((Alliance.nation1_id == nation2_id) & (Alliance.nation2_id == nation1_id)),
-            Alliance.is_active == True
-        ).first()
+        # Check for existing alliance (the row is only loaded for allied nations)
+        self.alliance = None
+        if alliance_graph.are_allied(nation1_id, nation2_id):
+            self.alliance = Alliance.query.filter(
+                ((Alliance.nation1_id == nation1_id) & (Alliance.nation2_id == nation2_id)) |
+                ((Alliance.nation1_id == nation2_id) & (Alliance.nation2_id == nation1_id)),
+                Alliance.is_active == True
+            ).first()
         
         # Check for existing war
         self.war = War.query.filter(
@@ -31,27 +67,23 @@ class DiplomaticRelation:
         ).first()
         
         # Initialize relation value based on alliance/war status
-        if self.alliance:
-            self.value = 80  # Allied nations start with high relation
-        elif self.war:
-            self.value = -80  # Nations at war start with low relation
-        else:
-            self.value = 0  # Neutral by default
+        base_value = get_base_relation_value(self.alliance is not None, self.war is not None)
         
-        # Relation modifiers
-        self.modifiers = []
+        # Stored drift, relation modifiers and diplomatic actions in progress
+        stored = get_stored_relation(nation1_id, nation2_id)
+        self.modifiers = stored["modifiers"]
+        self.active_actions = stored["active_actions"]
         
-        # Diplomatic actions in progress
-        self.active_actions = []
+        shared_allies_modifier = get_shared_allies_modifier(alliance_graph.shared_allies(nation1_id, nation2_id))
+        if shared_allies_modifier:
+            self.modifiers.append(shared_allies_modifier)
+        
+        adjustment = stored["drift"] + sum(modifier["value"] for modifier in self.modifiers)
+        self.value = max(-100, min(100, base_value + adjustment))
     
     def get_relation_state(self):
         """Get the current state of relations based on value."""
-        for state in RELATION_STATES:
-            if state["range"][0] <= self.value <= state["range"][1]:
-                return state
-        
-        # Default to neutral if no matching range found
-        return next(state for state in RELATION_STATES if state["name"] == "Neutral")
+        return get_relation_state_for(self.value)
     
     def apply_action(self, action_id, initiator_id, target_id, resources=None):
         """Apply a diplomatic action and its effects."""
@@ -120,6 +152,11 @@ class DiplomaticRelation:
                     self.war.aggressor_victory = action["effects"].get("aggressor_victory", None)
         
         # Handle alliance changes
+        alliance_formed = False
+        alliance_dissolved = False
+        if action["id"] == 5 or action["effects"].get("alliance_state") is False:
+            # Decide on the alliance row in the database, not the cached graph
+            self.alliance = alliance_graph.active_alliance(initiator_id, target_id)
         if action["id"] == 5:  # Form Alliance
             if not self.alliance:
                 self.alliance = Alliance(
@@ -129,27 +166,46 @@ class DiplomaticRelation:
                     is_active=True
                 )
                 db.session.add(self.alliance)
+                alliance_formed = True
+        elif action["effects"].get("alliance_state") is False:  # Cancel Alliance
+            if self.alliance:
+                self.alliance.is_active = False
+                self.alliance.dissolved_date = datetime.utcnow()
+                self.alliance = None
+                alliance_dissolved = True
         
         # Add the action to active actions if it has a duration
+        now = datetime.utcnow()
+        end_date = None
         if action["duration"] > 0:
-            end_date = datetime.utcnow() + timedelta(days=action["duration"])
+            end_date = now + timedelta(days=action["duration"])
             self.active_actions.append({
                 "action_id": action_id,
-                "start_date": datetime.utcnow(),
+                "start_date": now,
                 "end_date": end_date,
                 "initiator_id": initiator_id
             })
         
-        # Add a relation modifier
-        self.modifiers.append({
+        # Add a relation modifier (the relation change lasts as long as the modifier)
+        modifier = {
             "source": f"Diplomatic action: {action['name']}",
             "value": action["effects"].get("relation_change", 0),
-            "expiry": datetime.utcnow() + timedelta(days=30)  # Most modifiers expire after 30 days
-        })
+            "expiry": now + timedelta(days=30)  # Most modifiers expire after 30 days
+        }
+        self.modifiers.append(modifier)
+        record_relation_change(
+            initiator_id, target_id, modifier["source"], modifier["value"], modifier["expiry"],
+            action_id=action_id, action_end=end_date, now=now
+        )
         
         # Commit changes
         db.session.commit()
         
+        if alliance_formed:
+            alliance_graph.add_alliance(initiator_id, target_id)
+        if alliance_dissolved:
+            alliance_graph.remove_alliance(initiator_id, target_id)
+        
         return {
             "success": True,
             "message": f"Diplomatic action '{action['name']}' performed successfully.",
@@ -288,6 +344,85 @@ def get_diplomatic_stance(nation_id, target_nation_id=None):
             "diplomatic_influence": calculate_diplomatic_influence(nation)
         }
 
+def get_diplomatic_stances(nation, other_nations, now=None):
+    """Stance of a nation towards each of `other_nations` (already loaded Nation rows),
+    with the same fields as get_diplomatic_stance. Every pair is resolved from a fixed
+    number of queries: the active alliances, wars and transit rights touching the nation
+    and its stored relations (modifiers and actions in progress, non-aggression pacts
+    included). Returns (stances by nation id, version), the version being a digest of
+    every relation row used, so it only changes when one of those relations changes."""
+    if now is None:
+        now = datetime.utcnow()
+    
+    alliances = Alliance.query.filter(
+        ((Alliance.nation1_id == nation.id) | (Alliance.nation2_id == nation.id)),
+        Alliance.is_active == True
+    ).order_by(Alliance.id).all()
+    wars = War.query.filter(
+        ((War.aggressor_id == nation.id) | (War.defender_id == nation.id)),
+        War.is_active == True
+    ).order_by(War.id).all()
+    transit_rights = TransitRights.query.filter(
+        ((TransitRights.grantor_id == nation.id) | (TransitRights.receiver_id == nation.id)),
+        TransitRights.is_active == True
+    ).order_by(TransitRights.id).all()
+    stored_relations = get_stored_relations(nation.id, now)
+    shared_allies = alliance_graph.shared_allies_with(nation.id)
+    
+    # First active alliance/war per pair, as DiplomaticRelation picks them
+    alliance_by_nation = {}
+    for alliance in alliances:
+        other_id = alliance.nation2_id if alliance.nation1_id == nation.id else alliance.nation1_id
+        alliance_by_nation.setdefault(other_id, alliance)
+    war_by_nation = {}
+    for war in wars:
+        other_id = war.defender_id if war.aggressor_id == nation.id else war.aggressor_id
+        war_by_nation.setdefault(other_id, war)
+    granted_to_nation = {right.grantor_id for right in transit_rights if right.receiver_id == nation.id}
+    granted_by_nation = {right.receiver_id for right in transit_rights if right.grantor_id == nation.id}
+    
+    version = hashlib.sha1(repr((
+        [(a.id, a.nation1_id, a.nation2_id) for a in alliances],
+        [(w.id, w.aggressor_id, w.defender_id, w.start_date) for w in wars],
+        [(t.id, t.grantor_id, t.receiver_id) for t in transit_rights],
+        sorted(stored_relations.items(), key=lambda item: item[0]),
+        sorted(shared_allies.items())
+    )).encode()).hexdigest()
+    
+    stances = {}
+    for other in other_nations:
+        stored = stored_relations.get(other.id, {"drift": 0.0, "modifiers": [], "active_actions": []})
+        war = war_by_nation.get(other.id)
+        is_allied = other.id in alliance_by_nation
+        
+        modifiers = list(stored["modifiers"])
+        shared_allies_modifier = get_shared_allies_modifier(shared_allies.get(other.id, 0))
+        if shared_allies_modifier:
+            modifiers.append(shared_allies_modifier)
+        
+        base_value = get_base_relation_value(is_allied, war is not None)
+        adjustment = stored["drift"] + sum(modifier["value"] for modifier in modifiers)
+        value = max(-100, min(100, base_value + adjustment))
+        
+        is_neighbor = nations_are_neighbors(nation, other)
+        has_transit_rights = other.id in granted_to_nation
+        
+        stances[other.id] = {
+            "relation_value": value,
+            "relation_state": get_relation_state_for(value)["name"],
+            "is_allied": is_allied,
+            "is_at_war": war is not None,
+            "is_neighbor": is_neighbor,
+            "has_transit_rights": has_transit_rights or is_neighbor,  # Neighbors don't need transit rights
+            "has_granted_transit": other.id in granted_by_nation or is_neighbor,
+            "travel_time": travel_time_between(nation, other, has_transit_rights),
+            "war_start_date": war.start_date if war else None,
+            "modifiers": modifiers,
+            "active_actions": stored["active_actions"]
+        }
+    
+    return stances, version
+
 def calculate_diplomatic_influence(nation):
     """Calculate a nation's diplomatic influence based on various factors."""
     # This would be a more complex calculation in a real implementation,
@@ -302,11 +437,7 @@ def calculate_diplomatic_influence(nation):
     military_factor = (military.offensive_power + military.defensive_power) / 100
     
     # Alliance factor
-    alliances = Alliance.query.filter(
-        ((Alliance.nation1_id == nation.id) | (Alliance.nation2_id == nation.id)),
-        Alliance.is_active == True
-    ).count()
-    alliance_factor = alliances * 2
+    alliance_factor = alliance_graph.alliance_count(nation.id) * 2
     
     # Total influence (capped at MAX_DIPLOMATIC_INFLUENCE)
     total_influence = base_influence + economic_factor + military_factor + alliance_factor
@@ -315,43 +446,12 @@ def calculate_diplomatic_influence(nation):
 
 def update_diplomatic_relations():
     """Update diplomatic relations for all nations.
-    This function is intended to be run periodically (e.g. daily)."""
-    # Get all nations
-    nations = Nation.query.all()
-    
-    # Process all bilateral relationships
-    for i in range(len(nations)):
-        for j in range(i+1, len(nations)):
-            nation1 = nations[i]
-            nation2 = nations[j]
-            
-            # Skip if same nation
-            if nation1.id == nation2.id:
-                continue
-            
-            # Create diplomatic relation
-            relation = DiplomaticRelation(nation1.id, nation2.id)
-            
-            # Update relation value based on various factors
-            # This would be more complex in a real implementation
-            
-            # Random small fluctuation (-2 to +2)
-            random_change = random.randint(-2, 2)
-            relation.value += random_change
-            
-            # Limit relation value to valid range
-            relation.value = max(-100, min(100, relation.value))
-            
-            # Update expired modifiers
-            now = datetime.utcnow()
-            relation.modifiers = [mod for mod in relation.modifiers if mod["expiry"] > now]
-            
-            # Update expired actions
-            relation.active_actions = [action for action in relation.active_actions if action["end_date"] > now]
-    
+    This function is intended to be run periodically (e.g. daily).
+    Only the stored (non-default) relations are visited, with bulk statements."""
+    result = update_relations()
     db.session.commit()
     
-    return {"success": True, "message": "Diplomatic relations updated."}
+    return {"success": True, "message": "Diplomatic relations updated.", **result}
 
 
 def check_transit_rights(grantor_id, receiver_id):
@@ -410,79 +510,16 @@ def get_transit_rights(nation_id, target_nation_id=None):
             "given_rights": given_nations
         }
 
-
 def are_nations_neighbors(nation1_id, nation2_id):
     """Check if two nations are neighbors (sharing a border).
     This is determined by checking if they are in the same continent
     and their map coordinates are close enough."""
-    
-    nation1 = Nation.query.get(nation1_id)
-    nation2 = Nation.query.get(nation2_id)
-    
-    if not nation1 or not nation2:
-        return False
-    
-    # First check if they're in the same continent
-    if nation1.continent != nation2.continent:
-        return False
-    
-    # Calculate the Euclidean distance between their map coordinates
-    distance = ((nation1.map_x - nation2.map_x) ** 2 + (nation1.map_y - nation2.map_y) ** 2) ** 0.5
-    
-    # Define a threshold for considering nations as neighbors
-    # This value should be calibrated based on your map scale
-    NEIGHBOR_DISTANCE_THRESHOLD = 70.0
-    
-    return distance <= NEIGHBOR_DISTANCE_THRESHOLD
+    return geography.are_neighbors(nation1_id, nation2_id)
 
 def calculate_travel_time(nation1_id, nation2_id, transit_rights=False):
     """Calculate the travel time between two nations in hours.
     If transit rights are available, travel time is reduced."""
-    
-    nation1 = Nation.query.get(nation1_id)
-    nation2 = Nation.query.get(nation2_id)
-    
-    if not nation1 or not nation2:
-        return None
-    
-    # Calculate the Euclidean distance between their map coordinates
-    distance = ((nation1.map_x - nation2.map_x) ** 2 + (nation1.map_y - nation2.map_y) ** 2) ** 0.5
-    
-    # Applica un fattore di scala per ottenere tempi di viaggio più realistici
-    # Questo fattore è calibrato per dare tempi tra 0.5 e 6 ore basati sulla distribuzione delle nazioni
-    # Un valore più alto = viaggi più lunghi
-    TRAVEL_TIME_FACTOR = 0.03
-    
-    # Different continents add a travel time penalty
-    continent_multiplier = 1.5 if nation1.continent != nation2.continent else 1.0
-    
-    # Se sono vicini (neighbors) hanno uno sconto sul tempo di viaggio
-    neighbor_discount = 0.8 if are_nations_neighbors(nation1_id, nation2_id) else 1.0
-    
-    # Se hanno diritti di transito, viaggiano più velocemente
-    transit_discount = 0.7 if transit_rights else 1.0
-    
-    # Calcola il tempo di viaggio base
-    travel_time = distance * TRAVEL_TIME_FACTOR * continent_multiplier * neighbor_discount * transit_discount
-    
-    # Assicurati che il tempo sia almeno 0.5 ore per le nazioni più vicine
-    travel_time = max(0.5, travel_time)
-    
-    # Calcola un tempo più lungo per Canada e altre nazioni più lontane
-    # Questo è basato sulla distanza effettiva che vediamo dai log
-    if distance > 130:  # Canada è a distanza 142.1 da Australia
-        travel_time = max(travel_time, 5.0)  # Garantisce almeno 5 ore per nazioni molto lontane
-    elif distance > 90:  # Per nazioni a distanza media
-        travel_time = max(travel_time, 2.0)  # Garantisce almeno 2 ore
-    
-    # Cap maximum travel time at 6 hours
-    travel_time = min(6.0, travel_time)
-    
-    # Debug print
-    travel_time_rounded = round(travel_time, 1)
-    print(f"DEBUG: Travel time from {nation1.name} to {nation2.name}: {travel_time_rounded}h (distance: {round(distance, 1)})")
-    
-    return travel_time_rounded  # Round to 1 decimal place
+    return geography.travel_time(nation1_id, nation2_id, transit_rights)
 
 def grant_transit_rights(grantor_id, receiver_id, duration_days=None):
     """Grant transit rights to another nation."""
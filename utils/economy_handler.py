@@ -5,6 +5,7 @@ population happiness, and economic events.
 from datetime import datetime, timedelta
 from app import db
 from models import Nation, Resource
+from utils.ranking_service import ranking_service
 from data.economy import (
     ECONOMIC_POLICIES, 
     INFLATION_FACTORS,
@@ -300,6 +301,7 @@ class EconomyManager:
         
         # Commit changes
         db.session.commit()
+        ranking_service.update_score('economic', self.nation.id, self.nation.gdp)
         
         # Update active events
         self.active_events = self.nation.economic_events
@@ -373,6 +375,7 @@ class EconomyManager:
         
         # Commit changes
         db.session.commit()
+        ranking_service.update_score('economic', self.nation.id, self.nation.gdp)
         
         return {
             "success": True,
@@ -3,8 +3,10 @@ Espionage handler for managing spy operations and intelligence gathering.
 """
 from datetime import datetime, timedelta
 from app import db
-from models import Nation, Military, Resource, Technology
+from models import Nation, Military, Resource
 from data.espionage import ESPIONAGE_MISSIONS
+from utils.tech_graph import TECH_BY_ID
+from utils.tech_state import get_technology_state, get_researched_tech_ids
 import random
 import math
 
@@ -328,15 +330,15 @@ class EspionageManager:
                 tech_points = mission_data["rewards"].get("technology_points", 0)
                 self.resources.technology_points += tech_points
                 
-                # Identify a random technology to boost
-                techs = Technology.query.filter_by(nation_id=self.nation.id, level__gt=0).all()
-                if techs:
-                    tech = random.choice(techs)
+                # Identify a random researched technology to boost
+                researched_tech_ids = get_researched_tech_ids(get_technology_state(self.nation.id))
+                if researched_tech_ids:
+                    tech_name = TECH_BY_ID[random.choice(researched_tech_ids)]["name"]
                     tech_boost = mission_data["rewards"].get("specific_technology_boost", 0)
-                    result["technology_boosted"] = tech.name
+                    result["technology_boosted"] = tech_name
                     result["technology_boost"] = tech_boost * 100  # Convert to percentage
                     result["effects"].append(f"Gained {tech_points} technology points")
-                    result["effects"].append(f"Boosted research on {tech.name} by {tech_boost * 100}%")
+                    result["effects"].append(f"Boosted research on {tech_name} by {tech_boost * 100}%")
             
             elif mission["id"] == 5:  # Sabotage Resources
                 # Reduce target resources
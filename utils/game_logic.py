@@ -1,95 +1,93 @@
 from datetime import datetime
-from sqlalchemy import desc
+from flask import g, has_app_context
+from sqlalchemy import and_, case, desc, func, update
 from app import db
-from models import Nation, Resource, Technology, Military, War, BattleReport
+from models import Nation, Resource, Military, War, BattleReport, TechnologyState
+from utils.tech_state import ensure_technology_states, get_technology_state
 import random
-import math
+
+def refresh_resource_rates(nation, resources=None):
+    """Recalculate a nation's production and consumption rates.
+    Resources accrue lazily at the stored rates, so this must run whenever an input
+    of the rates changes (population, technology, military). Returns True if any rate changed."""
+    if resources is None:
+        resources = Resource.query.filter_by(nation_id=nation.id).first()
+    if not resources:
+        return False
+    
+    rates = {
+        'raw_materials_production': get_production_rate(nation, 'raw_materials'),
+        'food_production': get_production_rate(nation, 'food'),
+        'energy_production': get_production_rate(nation, 'energy'),
+        'technology_production': get_production_rate(nation, 'technology'),
+        'currency_production': get_production_rate(nation, 'currency'),
+        'raw_materials_consumption': get_consumption_rate(nation, 'raw_materials'),
+        'food_consumption': get_consumption_rate(nation, 'food'),
+        'energy_consumption': get_consumption_rate(nation, 'energy')
+    }
+    
+    changed = False
+    for column, rate in rates.items():
+        if getattr(resources, column) != rate:
+            # The amounts were settled on load, so the new rate applies from now on
+            setattr(resources, column, rate)
+            changed = True
+    return changed
 
 def update_resources(nation):
-    """Update a nation's resources based on time elapsed since last update"""
-    resources = Resource.query.filter_by(nation_id=nation.id).first()
-    now = datetime.utcnow()
-    
-    # Calculate time elapsed in hours
-    elapsed_hours = 0
-    if resources.last_updated:
-        time_diff = now - resources.last_updated
-        elapsed_hours = time_diff.total_seconds() / 3600  # Convert to hours
-    
-    if elapsed_hours > 0:
-        # Calculate production rates based on population distribution and technology
-        raw_materials_rate = get_production_rate(nation, 'raw_materials')
-        food_rate = get_production_rate(nation, 'food')
-        energy_rate = get_production_rate(nation, 'energy')
-        tech_rate = get_production_rate(nation, 'technology')
-        currency_rate = get_production_rate(nation, 'currency')
-        
-        # Calculate consumption rates
-        raw_materials_consumption = get_consumption_rate(nation, 'raw_materials')
-        food_consumption = get_consumption_rate(nation, 'food')
-        energy_consumption = get_consumption_rate(nation, 'energy')
-        
-        # Update production rates
-        resources.raw_materials_production = raw_materials_rate
-        resources.food_production = food_rate
-        resources.energy_production = energy_rate
-        resources.technology_production = tech_rate
-        resources.currency_production = currency_rate
-        
-        # Update consumption rates
-        resources.raw_materials_consumption = raw_materials_consumption
-        resources.food_consumption = food_consumption
-        resources.energy_consumption = energy_consumption
-        
-        # Calculate net production (per hour)
-        net_raw_materials = raw_materials_rate - raw_materials_consumption
-        net_food = food_rate - food_consumption
-        net_energy = energy_rate - energy_consumption
-        
-        # Update resource amounts
-        resources.raw_materials += net_raw_materials * elapsed_hours
-        resources.food += net_food * elapsed_hours
-        resources.energy += net_energy * elapsed_hours
-        resources.technology_points += tech_rate * elapsed_hours
-        resources.currency += currency_rate * elapsed_hours
-        
-        # Ensure no negative resources
-        resources.raw_materials = max(0, resources.raw_materials)
-        resources.food = max(0, resources.food)
-        resources.energy = max(0, resources.energy)
-        
-        # Update last updated timestamp
-        resources.last_updated = now
-        
+    """Bring a nation's resource rates up to date, writing only if they changed"""
+    if refresh_resource_rates(nation):
         db.session.commit()
 
+# Base production rates
+PRODUCTION_BASE_RATES = {
+    'raw_materials': 150,  # Aumentato da 100 a 150
+    'food': 150,           # Aumentato da 100 a 150
+    'energy': 150,         # Aumentato da 100 a 150
+    'technology': 20,      # Aumentato da 10 a 20
+    'currency': 1000
+}
+
+# Base consumption rates
+CONSUMPTION_BASE_RATES = {
+    'raw_materials': 10,  # Ridotto drasticamente da 20 a 10
+    'food': 10,           # Ridotto drasticamente da 20 a 10
+    'energy': 10          # Ridotto drasticamente da 20 a 10
+}
+
 def get_production_rate(nation, resource_type):
     """Calculate production rate for a specific resource"""
-    # Base production rates
-    base_rates = {
-        'raw_materials': 150,  # Aumentato da 100 a 150
-        'food': 150,           # Aumentato da 100 a 150
-        'energy': 150,         # Aumentato da 100 a 150
-        'technology': 20,      # Aumentato da 10 a 20
-        'currency': 1000
-    }
-    
-    # Population distribution affects production
-    population_factors = {
-        'raw_materials': nation.industry_population / 100,
-        'food': nation.agriculture_population / 100,
-        'energy': nation.energy_population / 100,
-        'technology': nation.research_population / 100,
-        'currency': (nation.industry_population + nation.agriculture_population) / 200  # Both contribute to GDP
-    }
-    
     # Get technology multipliers
     tech_multiplier = get_technology_multiplier(nation, resource_type)
     
+    return calculate_production_rate(
+        resource_type,
+        nation.agriculture_population,
+        nation.industry_population,
+        nation.energy_population,
+        nation.research_population,
+        nation.total_population,
+        tech_multiplier
+    )
+
+def calculate_production_rate(resource_type, agriculture_population, industry_population,
+                              energy_population, research_population, total_population, tech_multiplier):
+    """Production rate formula shared by the per-nation and bulk resource updates"""
+    # Population distribution affects production
+    if resource_type == 'raw_materials':
+        population_factor = industry_population / 100
+    elif resource_type == 'food':
+        population_factor = agriculture_population / 100
+    elif resource_type == 'energy':
+        population_factor = energy_population / 100
+    elif resource_type == 'technology':
+        population_factor = research_population / 100
+    else:
+        population_factor = (industry_population + agriculture_population) / 200  # Both contribute to GDP
+    
     # Calculate production rate
-    base_rate = base_rates[resource_type]
-    population_factor = population_factors[resource_type]
-    population_scale = nation.total_population / 1000000  # Scale by population size
+    base_rate = PRODUCTION_BASE_RATES[resource_type]
+    population_scale = total_population / 1000000  # Scale by population size
     
     production_rate = base_rate * population_factor * population_scale * tech_multiplier
     
@@ -97,108 +95,138 @@ def get_production_rate(nation, resource_type):
 
 def get_consumption_rate(nation, resource_type):
     """Calculate consumption rate for a specific resource"""
-    # Base consumption rates
-    base_rates = {
-        'raw_materials': 10,  # Ridotto drasticamente da 20 a 10
-        'food': 10,           # Ridotto drasticamente da 20 a 10
-        'energy': 10          # Ridotto drasticamente da 20 a 10
-    }
-    
-    # Population consumes resources
-    population_scale = nation.total_population / 1000000
-    
     # Military consumes resources
-    military = Military.query.filter_by(nation_id=nation.id).first()
-    military_factor = 1.0
-    if military:
-        # More military units = higher consumption
-        unit_count = (
-            military.infantry * 0.25 +    # Ridotto ulteriormente l'impatto (prima era 0.5)
-            military.tanks * 2.5 +        # Ridotto ulteriormente l'impatto (prima era 5)
-            military.aircraft * 5 +       # Ridotto ulteriormente l'impatto (prima era 10)
-            military.navy * 7.5 +         # Ridotto ulteriormente l'impatto (prima era 15)
-            military.missiles * 1.25      # Ridotto ulteriormente l'impatto (prima era 2.5)
-        )
-        military_factor += unit_count / 40000  # Ridotto ulteriormente l'impatto (prima era 20000)
+    military_factor = get_nation_modifiers(nation)['military_factor']
     
     # Technology can improve efficiency (reduce consumption)
     tech_efficiency = get_technology_efficiency(nation, resource_type)
     
+    return calculate_consumption_rate(resource_type, nation.total_population, military_factor, tech_efficiency)
+
+def calculate_military_consumption_factor(infantry, tanks, aircraft, navy, missiles):
+    """Consumption multiplier caused by the size of a nation's military"""
+    military_factor = 1.0
+    # More military units = higher consumption
+    unit_count = (
+        infantry * 0.25 +    # Ridotto ulteriormente l'impatto (prima era 0.5)
+        tanks * 2.5 +        # Ridotto ulteriormente l'impatto (prima era 5)
+        aircraft * 5 +       # Ridotto ulteriormente l'impatto (prima era 10)
+        navy * 7.5 +         # Ridotto ulteriormente l'impatto (prima era 15)
+        missiles * 1.25      # Ridotto ulteriormente l'impatto (prima era 2.5)
+    )
+    military_factor += unit_count / 40000  # Ridotto ulteriormente l'impatto (prima era 20000)
+    return military_factor
+
+def calculate_consumption_rate(resource_type, total_population, military_factor, tech_efficiency):
+    """Consumption rate formula shared by the per-nation and bulk resource updates"""
+    # Population consumes resources
+    population_scale = total_population / 1000000
+    
     # Garantire un'efficienza minima anche senza tecnologie
     tech_efficiency = max(tech_efficiency, 1.2)  # Minimo 20% di efficienza
     
     # Calculate consumption rate
-    base_rate = base_rates[resource_type]
+    base_rate = CONSUMPTION_BASE_RATES[resource_type]
     consumption_rate = base_rate * population_scale * military_factor / tech_efficiency
     
     return consumption_rate
 
 def get_technology_multiplier(nation, resource_type):
     """Get the production multiplier from technologies"""
-    multiplier = 1.2  # Bonus base di produzione del 20%
-    
-    # Get relevant technologies
-    technologies = Technology.query.filter(Technology.nation_id == nation.id, Technology.level > 0).all()
-    
-    for tech in technologies:
-        if tech.category == 'Production':
-            multiplier *= tech.production_multiplier
-    
-    return multiplier
+    return get_nation_modifiers(nation)['production_multiplier']
 
 def get_technology_efficiency(nation, resource_type):
     """Get the consumption efficiency from technologies"""
-    efficiency = 1.0
-    
-    # Get relevant technologies
-    technologies = Technology.query.filter(Technology.nation_id == nation.id, Technology.level > 0).all()
+    return get_nation_modifiers(nation)['consumption_efficiency']
+
+def get_nation_modifiers(nation):
+    """Get the production multiplier, consumption efficiency and military consumption factor of a nation.
+    Computed once and memoized for the rest of the request (app context)."""
+    cache = g.setdefault('nation_modifiers', {}) if has_app_context() else {}
+    modifiers = cache.get(nation.id)
+    if modifiers is not None:
+        return modifiers
+    
+    # Technology bonuses are precomputed in the nation's technology state
+    # (production multiplier includes the 20% base bonus)
+    tech_state = get_technology_state(nation.id)
+    multiplier = tech_state.production_multiplier
+    efficiency = tech_state.consumption_efficiency
     
-    for tech in technologies:
-        if tech.category == 'Efficiency':
-            efficiency *= tech.consumption_efficiency
+    military = Military.query.filter_by(nation_id=nation.id).first()
+    military_factor = 1.0
+    if military:
+        military_factor = calculate_military_consumption_factor(
+            military.infantry, military.tanks, military.aircraft, military.navy, military.missiles
+        )
     
-    return efficiency
+    modifiers = {
+        'production_multiplier': multiplier,
+        'consumption_efficiency': efficiency,
+        'military_factor': military_factor
+    }
+    cache[nation.id] = modifiers
+    return modifiers
+
+def invalidate_nation_modifiers(nation_id):
+    """Drop the memoized modifiers of a nation after its technology levels or military units change"""
+    if has_app_context() and 'nation_modifiers' in g:
+        g.nation_modifiers.pop(nation_id, None)
 
 def calculate_rankings():
-    """Calculate and update rankings for all nations"""
-    nations = Nation.query.all()
-    
-    # Calculate economic rankings
-    economic_list = sorted(nations, key=lambda n: n.gdp, reverse=True)
-    for i, nation in enumerate(economic_list):
-        nation.economic_rank = i + 1
-    
-    # Calculate military rankings
-    military_list = []
-    for nation in nations:
-        military = Military.query.filter_by(nation_id=nation.id).first()
-        if military:
-            military_power = military.offensive_power + military.defensive_power
-            military_list.append((nation, military_power))
-    
-    military_list.sort(key=lambda x: x[1], reverse=True)
-    for i, (nation, _) in enumerate(military_list):
-        nation.military_rank = i + 1
-    
-    # Calculate technology rankings
-    tech_list = []
-    for nation in nations:
-        tech_level_sum = 0
-        technologies = Technology.query.filter_by(nation_id=nation.id).all()
-        for tech in technologies:
-            tech_level_sum += tech.level
-        tech_list.append((nation, tech_level_sum))
-    
-    tech_list.sort(key=lambda x: x[1], reverse=True)
-    for i, (nation, _) in enumerate(tech_list):
-        nation.technology_rank = i + 1
-    
-    # Calculate overall rankings (average of all three)
-    for nation in nations:
-        if nation.economic_rank and nation.military_rank and nation.technology_rank:
-            overall_score = (nation.economic_rank + nation.military_rank + nation.technology_rank) / 3
-            nation.overall_rank = math.ceil(overall_score)
+    """Calculate and update rankings for all nations with a single UPDATE statement"""
+    ensure_technology_states()
+    
+    # Military power per nation (technology level sums are kept in TechnologyState)
+    military_power = db.session.query(
+        Military.nation_id.label('nation_id'),
+        func.sum(Military.offensive_power + Military.defensive_power).label('power')
+    ).group_by(Military.nation_id).subquery()
+    
+    # Ranks are distinct positions (ties ordered by nation id), like the previous sort-based ranking
+    has_military = military_power.c.nation_id.isnot(None)
+    ranked = db.session.query(
+        Nation.id.label('nation_id'),
+        func.row_number().over(
+            order_by=(desc(func.coalesce(Nation.gdp, 0)), Nation.id)
+        ).label('economic_rank'),
+        # Nations without a military are left out of the military ranking
+        case(
+            (has_military, func.row_number().over(
+                partition_by=has_military,
+                order_by=(desc(military_power.c.power), Nation.id)
+            ))
+        ).label('military_rank'),
+        func.row_number().over(
+            order_by=(desc(func.coalesce(TechnologyState.level_sum, 0)), Nation.id)
+        ).label('technology_rank')
+    ).outerjoin(
+        military_power, military_power.c.nation_id == Nation.id
+    ).outerjoin(
+        TechnologyState, TechnologyState.nation_id == Nation.id
+    ).subquery()
+    
+    # Nations without a military keep their previous military rank
+    military_rank = func.coalesce(ranked.c.military_rank, Nation.military_rank)
+    
+    # Overall ranking is the average of all three, rounded up
+    overall_rank = case(
+        (and_(military_rank > 0, ranked.c.economic_rank > 0, ranked.c.technology_rank > 0),
+         (ranked.c.economic_rank + military_rank + ranked.c.technology_rank + 2) // 3),
+        else_=Nation.overall_rank
+    )
     
+    db.session.execute(
+        update(Nation)
+        .where(Nation.id == ranked.c.nation_id)
+        .values(
+            economic_rank=ranked.c.economic_rank,
+            military_rank=military_rank,
+            technology_rank=ranked.c.technology_rank,
+            overall_rank=overall_rank
+        )
+        .execution_options(synchronize_session=False)
+    )
     db.session.commit()
 
 def calculate_military_power(military, power_type):
@@ -480,6 +508,12 @@ def conduct_attack(attacker_id, defender_id, attack_type, war_id):
         message = f'Attack failed! You lost {attacker_casualties} {attack_type} units. The enemy lost {defender_casualties} infantry. Check the detailed report for more information.'
         status = 'warning'
     
+    # Unit counts and populations changed on both sides
+    invalidate_nation_modifiers(attacker_id)
+    invalidate_nation_modifiers(defender_id)
+    refresh_resource_rates(attacker_nation)
+    refresh_resource_rates(defender_nation)
+    
     db.session.commit()
     return {'message': message, 'status': status, 'battle_report_id': battle_report.id}
 
@@ -0,0 +1,264 @@
+"""
+Nation geography.
+
+Positions (map_x, map_y, continent) of every nation are kept in memory in a uniform
+grid spatial index. The neighbor adjacency and a dense travel-time matrix (with and
+without transit rights) are precomputed, and only the affected row and column are
+recomputed when a nation is created or moved, so neighbor and travel-time questions
+are answered without touching the database.
+"""
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+import math
+import threading
+from app import db
+from models import Nation
+
+# Define a threshold for considering nations as neighbors
+# This value should be calibrated based on your map scale
+NEIGHBOR_DISTANCE_THRESHOLD = 70.0
+
+# Applica un fattore di scala per ottenere tempi di viaggio più realistici
+# Questo fattore è calibrato per dare tempi tra 0.5 e 6 ore basati sulla distribuzione delle nazioni
+# Un valore più alto = viaggi più lunghi
+TRAVEL_TIME_FACTOR = 0.03
+
+# Side of a grid cell, in map units; neighbor lookups only visit the adjacent cells
+GRID_CELL_SIZE = NEIGHBOR_DISTANCE_THRESHOLD
+
+# Ids looked up but not found are not queried again for this long
+MISSING_NATION_TTL = timedelta(minutes=5)
+
+NationPosition = namedtuple('NationPosition', ['id', 'map_x', 'map_y', 'continent'])
+
+def map_distance(nation1, nation2):
+    """Euclidean distance between the map coordinates of two nations."""
+    return ((nation1.map_x - nation2.map_x) ** 2 + (nation1.map_y - nation2.map_y) ** 2) ** 0.5
+
+def nations_are_neighbors(nation1, nation2):
+    """Neighbor check on already loaded nations (same continent and close on the map)."""
+    if nation1.continent != nation2.continent:
+        return False
+    return map_distance(nation1, nation2) <= NEIGHBOR_DISTANCE_THRESHOLD
+
+def travel_time_between(nation1, nation2, transit_rights=False):
+    """Travel time in hours between two already loaded nations, rounded to 0.1h."""
+    distance = map_distance(nation1, nation2)
+
+    # Different continents add a travel time penalty
+    continent_multiplier = 1.5 if nation1.continent != nation2.continent else 1.0
+
+    # Se sono vicini (neighbors) hanno uno sconto sul tempo di viaggio
+    neighbor_discount = 0.8 if nations_are_neighbors(nation1, nation2) else 1.0
+
+    # Se hanno diritti di transito, viaggiano più velocemente
+    transit_discount = 0.7 if transit_rights else 1.0
+
+    # Calcola il tempo di viaggio base
+    travel_time = distance * TRAVEL_TIME_FACTOR * continent_multiplier * neighbor_discount * transit_discount
+
+    # Assicurati che il tempo sia almeno 0.5 ore per le nazioni più vicine
+    travel_time = max(0.5, travel_time)
+
+    # Calcola un tempo più lungo per Canada e altre nazioni più lontane
+    # Questo è basato sulla distanza effettiva che vediamo dai log
+    if distance > 130:  # Canada è a distanza 142.1 da Australia
+        travel_time = max(travel_time, 5.0)  # Garantisce almeno 5 ore per nazioni molto lontane
+    elif distance > 90:  # Per nazioni a distanza media
+        travel_time = max(travel_time, 2.0)  # Garantisce almeno 2 ore
+
+    # Cap maximum travel time at 6 hours
+    travel_time = min(6.0, travel_time)
+
+    return round(travel_time, 1)  # Round to 1 decimal place
+
+def _cell(position):
+    return (math.floor(position.map_x / GRID_CELL_SIZE), math.floor(position.map_y / GRID_CELL_SIZE))
+
+def _nearby_ids(grid, position, radius):
+    """Ids in the grid cells overlapping the square of side 2*radius around a position."""
+    reach = math.ceil(radius / GRID_CELL_SIZE)
+    cell_x, cell_y = _cell(position)
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            yield from grid.get((cell_x + dx, cell_y + dy), ())
+
+
+class GeographyIndex:
+    """Grid index of nation positions with precomputed neighbors and travel times."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()  # One rebuild at a time; readers keep the current index
+        self._loaded = False
+        self._positions = {}   # nation_id -> NationPosition
+        self._grid = {}        # (cell x, cell y) -> set of nation ids
+        self._neighbors = {}   # nation_id -> set of neighbor nation ids
+        self._ids = []         # matrix row/column -> nation_id
+        self._index = {}       # nation_id -> matrix row/column
+        self._travel = []      # rows of travel times without transit rights
+        self._transit_travel = []  # rows of travel times with transit rights
+        self._missing = {}     # nation_id -> when it was last looked up and not found
+
+    def load(self, if_unloaded=False):
+        """Rebuild the whole index from the nations table (with `if_unloaded`, only
+        if no other thread built it meanwhile). The index is built aside and swapped
+        in, so lookups are not blocked meanwhile."""
+        with self._load_lock:
+            if if_unloaded and self._loaded:
+                return
+            rows = db.session.query(Nation.id, Nation.map_x, Nation.map_y, Nation.continent).order_by(Nation.id).all()
+            positions = [NationPosition(*row) for row in rows]
+
+            by_id = {}
+            grid = {}
+            neighbors = {}
+            for position in positions:
+                by_id[position.id] = position
+                grid.setdefault(_cell(position), set()).add(position.id)
+                neighbors[position.id] = set()
+
+            for position in positions:
+                for other_id in _nearby_ids(grid, position, NEIGHBOR_DISTANCE_THRESHOLD):
+                    if other_id != position.id and nations_are_neighbors(position, by_id[other_id]):
+                        neighbors[position.id].add(other_id)
+
+            ids = [position.id for position in positions]
+            travel = [
+                array('d', (travel_time_between(a, b) for b in positions)) for a in positions
+            ]
+            transit_travel = [
+                array('d', (travel_time_between(a, b, True) for b in positions)) for a in positions
+            ]
+
+            with self._lock:
+                self._positions = by_id
+                self._grid = grid
+                self._neighbors = neighbors
+                self._ids = ids
+                self._index = {nation_id: i for i, nation_id in enumerate(ids)}
+                self._travel = travel
+                self._transit_travel = transit_travel
+                self._missing = {}
+                self._loaded = True
+
+    def _ensure_loaded(self, *nation_ids):
+        """Load the index on first use, and add nations it does not know yet (e.g.
+        created by another worker process) one row at a time. Ids that do not exist
+        are remembered for MISSING_NATION_TTL, so repeated lookups return at once."""
+        if not self._loaded:
+            self.load(if_unloaded=True)
+
+        now = datetime.utcnow()
+        with self._lock:
+            unknown = [
+                nation_id for nation_id in set(nation_ids)
+                if nation_id not in self._positions and
+                not (nation_id in self._missing and now - self._missing[nation_id] < MISSING_NATION_TTL)
+            ]
+        if not unknown:
+            return
+
+        rows = db.session.query(Nation.id, Nation.map_x, Nation.map_y, Nation.continent).filter(
+            Nation.id.in_(unknown)
+        ).all()
+        for row in rows:
+            self.update_nation(NationPosition(*row))
+        found = {row.id for row in rows}
+        with self._lock:
+            for nation_id in unknown:
+                if nation_id not in found:
+                    self._missing[nation_id] = now
+
+    def _nearby(self, position, radius):
+        return _nearby_ids(self._grid, position, radius)
+
+    def update_nation(self, nation):
+        """Add a newly created nation, or move an existing one, recomputing only its
+        neighbors and its row and column of the travel-time matrices. `nation` is a
+        Nation or a NationPosition."""
+        position = NationPosition(nation.id, nation.map_x, nation.map_y, nation.continent)
+        with self._lock:
+            if not self._loaded:
+                return  # Built with the nation on first use
+            self._missing.pop(position.id, None)
+
+            old = self._positions.get(position.id)
+            if old is not None:
+                self._grid[_cell(old)].discard(position.id)
+                for other_id in self._neighbors.pop(position.id, set()):
+                    self._neighbors[other_id].discard(position.id)
+            self._positions[position.id] = position
+            self._grid.setdefault(_cell(position), set()).add(position.id)
+
+            self._neighbors[position.id] = set()
+            for other_id in self._nearby(position, NEIGHBOR_DISTANCE_THRESHOLD):
+                if other_id != position.id and nations_are_neighbors(position, self._positions[other_id]):
+                    self._neighbors[position.id].add(other_id)
+                    self._neighbors[other_id].add(position.id)
+
+            if position.id not in self._index:
+                self._index[position.id] = len(self._ids)
+                self._ids.append(position.id)
+                for row in self._travel:
+                    row.append(0.0)
+                for row in self._transit_travel:
+                    row.append(0.0)
+                self._travel.append(array('d', [0.0] * len(self._ids)))
+                self._transit_travel.append(array('d', [0.0] * len(self._ids)))
+
+            i = self._index[position.id]
+            for j, other_id in enumerate(self._ids):
+                other = self._positions[other_id]
+                self._travel[i][j] = self._travel[j][i] = travel_time_between(position, other)
+                self._transit_travel[i][j] = self._transit_travel[j][i] = travel_time_between(position, other, True)
+
+    def position(self, nation_id):
+        """NationPosition of a nation, or None if it does not exist."""
+        self._ensure_loaded(nation_id)
+        with self._lock:
+            return self._positions.get(nation_id)
+
+    def neighbors(self, nation_id):
+        """Ids of the neighbors of a nation (same continent, within the neighbor threshold)."""
+        self._ensure_loaded(nation_id)
+        with self._lock:
+            return set(self._neighbors.get(nation_id, ()))
+
+    def neighbors_within(self, nation_id, radius):
+        """Ids of the nations within `radius` map units of a nation, on any continent, nearest first."""
+        self._ensure_loaded(nation_id)
+        with self._lock:
+            position = self._positions.get(nation_id)
+            if position is None:
+                return []
+            found = []
+            for other_id in self._nearby(position, radius):
+                if other_id == nation_id:
+                    continue
+                distance = map_distance(position, self._positions[other_id])
+                if distance <= radius:
+                    found.append((distance, other_id))
+        return [other_id for distance, other_id in sorted(found)]
+
+    def are_neighbors(self, nation1_id, nation2_id):
+        """Whether two nations are neighbors (False if either does not exist)."""
+        self._ensure_loaded(nation1_id, nation2_id)
+        with self._lock:
+            return nation2_id in self._neighbors.get(nation1_id, ())
+
+    def travel_time(self, nation1_id, nation2_id, transit_rights=False):
+        """Travel time in hours between two nations, or None if either does not exist."""
+        self._ensure_loaded(nation1_id, nation2_id)
+        with self._lock:
+            i = self._index.get(nation1_id)
+            j = self._index.get(nation2_id)
+            if i is None or j is None:
+                return None
+            matrix = self._transit_travel if transit_rights else self._travel
+            return matrix[i][j]
+
+
+# Shared instance used by the diplomacy handler and routes
+geography = GeographyIndex()
@@ -0,0 +1,193 @@
+"""
+Target intel snapshots for spy reports.
+
+A snapshot holds the exact values a report of one type can reveal about a target
+nation (military, economy, technology, diplomacy), read with a fixed number of
+queries. Snapshots are cached per (target nation, report type) for the current
+espionage tick, so many spies watching the same nation share one snapshot; each
+report then applies its own intel-quality noise on top of the exact values.
+"""
+from datetime import datetime, timedelta
+import threading
+from app import db
+from models import Military, Resource, Technology, War, Alliance, TransitRights
+from utils.alliance_graph import alliance_graph
+from utils.tech_graph import TECH_BY_ID
+
+# Snapshots older than this are rebuilt even within a long-running tick
+SNAPSHOT_MAX_AGE = timedelta(minutes=5)
+
+def _military_snapshot(nation_id):
+    military = Military.query.filter_by(nation_id=nation_id).first()
+    if not military:
+        return None
+    return {
+        "offensive_power": military.offensive_power,
+        "defensive_power": military.defensive_power,
+        "espionage_power": military.espionage_power,
+        "infantry": military.infantry,
+        "tanks": military.tanks,
+        "aircraft": military.aircraft,
+        "navy": military.navy,
+        "missiles": military.missiles,
+        "bunkers": military.bunkers,
+        "anti_air": military.anti_air,
+        "coastal_defenses": military.coastal_defenses,
+        "counter_intelligence": military.counter_intelligence
+    }
+
+def _economic_snapshot(nation_id):
+    resources = Resource.query.filter_by(nation_id=nation_id).first()
+    if not resources:
+        return None
+    return {
+        "amounts": resources.current_amounts(),
+        "production": {
+            "raw_materials": resources.raw_materials_production,
+            "food": resources.food_production,
+            "energy": resources.energy_production
+        },
+        "consumption": {
+            "raw_materials": resources.raw_materials_consumption,
+            "food": resources.food_consumption,
+            "energy": resources.energy_consumption
+        }
+    }
+
+def _technology_snapshot(nation_id):
+    technologies = Technology.query.filter_by(nation_id=nation_id).order_by(Technology.tech_id).all()
+    if not technologies:
+        return None
+    return {
+        "total_count": len(TECH_BY_ID),
+        "technologies": [
+            {
+                "name": tech.name,
+                "category": tech.category,
+                "level": tech.level,
+                "max_level": tech.max_level,
+                "description": tech.description,
+                "researching": tech.researching,
+                "progress": tech.research_progress(),
+                "estimated_completion": tech.estimated_completion.strftime("%Y-%m-%d %H:%M:%S") if tech.estimated_completion else None
+            }
+            for tech in technologies
+        ]
+    }
+
+def _diplomatic_snapshot(nation_id):
+    wars = War.query.options(db.joinedload(War.aggressor), db.joinedload(War.defender)).filter(
+        (War.aggressor_id == nation_id) | (War.defender_id == nation_id),
+        War.is_active == True
+    ).order_by(War.id).all()
+    alliances = Alliance.query.options(db.joinedload(Alliance.nation1), db.joinedload(Alliance.nation2)).filter(
+        (Alliance.nation1_id == nation_id) | (Alliance.nation2_id == nation_id),
+        Alliance.is_active == True
+    ).order_by(Alliance.id).all()
+    transit_rights = TransitRights.query.options(
+        db.joinedload(TransitRights.grantor), db.joinedload(TransitRights.receiver)
+    ).filter(
+        (TransitRights.grantor_id == nation_id) | (TransitRights.receiver_id == nation_id),
+        TransitRights.is_active == True
+    ).order_by(TransitRights.id).all()
+
+    wars_info = []
+    for war in wars:
+        is_aggressor = war.aggressor_id == nation_id
+        opponent = war.defender if is_aggressor else war.aggressor
+        wars_info.append({
+            "opponent": opponent.name if opponent else "Unknown",
+            "is_aggressor": is_aggressor,
+            "start_date": war.start_date.strftime("%Y-%m-%d"),
+            "casualties": war.aggressor_casualties if is_aggressor else war.defender_casualties,
+            "peace_proposed": war.peace_proposed
+        })
+
+    alliances_info = []
+    for alliance in alliances:
+        ally = alliance.nation2 if alliance.nation1_id == nation_id else alliance.nation1
+        alliances_info.append({
+            "ally": ally.name if ally else "Unknown",
+            "formed_date": alliance.formed_date.strftime("%Y-%m-%d")
+        })
+
+    transit_info = []
+    for right in transit_rights:
+        is_grantor = right.grantor_id == nation_id
+        other_nation = right.receiver if is_grantor else right.grantor
+        transit_info.append({
+            "nation": other_nation.name if other_nation else "Unknown",
+            "is_grantor": is_grantor,
+            "granted_date": right.granted_date.strftime("%Y-%m-%d")
+        })
+
+    return {
+        "alliance_count": alliance_graph.alliance_count(nation_id),
+        "wars": wars_info,
+        "alliances": alliances_info,
+        "transit_rights": transit_info
+    }
+
+def build_target_snapshot(target_nation, report_type):
+    """Exact values a report of `report_type` can reveal about a nation"""
+    general = report_type == 'general'
+    snapshot = {
+        "nation_name": target_nation.name,
+        "continent": target_nation.continent,
+        "gdp": target_nation.gdp,
+        "tax_rate": target_nation.tax_rate,
+        "population_distribution": {
+            "agriculture": target_nation.agriculture_population,
+            "industry": target_nation.industry_population,
+            "energy": target_nation.energy_population,
+            "research": target_nation.research_population,
+            "military": target_nation.military_population
+        }
+    }
+    if general or report_type == 'military':
+        snapshot["military"] = _military_snapshot(target_nation.id)
+    if general or report_type == 'economic':
+        snapshot["economic"] = _economic_snapshot(target_nation.id)
+    if general or report_type == 'technological':
+        snapshot["technology"] = _technology_snapshot(target_nation.id)
+    if general or report_type == 'diplomatic':
+        snapshot["diplomacy"] = _diplomatic_snapshot(target_nation.id)
+    return snapshot
+
+
+class TargetSnapshotCache:
+    """Snapshots keyed by (target_nation_id, report_type), shared by every spy and
+    nation reporting on the same target during one tick."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}   # (target_nation_id, report_type) -> (built_at, snapshot)
+
+    def get(self, target_nation, report_type):
+        """Cached snapshot of a target, built on first use in this tick."""
+        key = (target_nation.id, report_type)
+        now = datetime.utcnow()
+        with self._lock:
+            cached = self._snapshots.get(key)
+            if cached is not None and now - cached[0] < SNAPSHOT_MAX_AGE:
+                return cached[1]
+
+        snapshot = build_target_snapshot(target_nation, report_type)
+        with self._lock:
+            self._snapshots[key] = (now, snapshot)
+        return snapshot
+
+    def invalidate(self, target_nation_id):
+        """Drop every snapshot of a nation (e.g. after it was sabotaged)."""
+        with self._lock:
+            for key in [key for key in self._snapshots if key[0] == target_nation_id]:
+                del self._snapshots[key]
+
+    def clear(self):
+        """Start a new tick."""
+        with self._lock:
+            self._snapshots.clear()
+
+
+# Shared instance used by the espionage system
+target_snapshots = TargetSnapshotCache()
@@ -0,0 +1,99 @@
+"""
+Listing queries for the war, alliance and espionage pages.
+
+Each listing loads its rows together with the nations they involve (joined eager
+loads), so rendering a page costs a fixed number of queries however many rows it
+shows. World-wide listings are paginated and capped at LISTING_MAX_ROWS; intel
+reports are paged with a cursor (see utils.spy_reports).
+"""
+from app import db
+from models import War, Alliance, DeployedSpy, SpyMission, SpyReport
+from utils.spy_reports import encode_report_cursor, reports_before
+
+LISTING_PAGE_SIZE = 25
+
+# Deepest row a world-wide listing will page to, and most rows a nation's own listing returns
+LISTING_MAX_ROWS = 500
+
+def _page_number(page, per_page):
+    """Clamp a requested page to the pages that fit under LISTING_MAX_ROWS"""
+    last_page = max(1, LISTING_MAX_ROWS // per_page)
+    return max(1, min(page or 1, last_page))
+
+def get_war_listing(nation_id, page=1, per_page=LISTING_PAGE_SIZE):
+    """(the nation's active wars, one page of the other active wars), newest first,
+    with both belligerents loaded"""
+    base = War.query.options(
+        db.joinedload(War.aggressor),
+        db.joinedload(War.defender)
+    ).filter(War.is_active == True).order_by(War.start_date.desc(), War.id.desc())
+    involved = (War.aggressor_id == nation_id) | (War.defender_id == nation_id)
+
+    your_wars = base.filter(involved).limit(LISTING_MAX_ROWS).all()
+    other_wars = base.filter(~involved).paginate(
+        page=_page_number(page, per_page), per_page=per_page, error_out=False
+    )
+    return your_wars, other_wars
+
+def get_alliance_listing(nation_id, page=1, per_page=LISTING_PAGE_SIZE):
+    """(the nation's active alliances, one page of the other active alliances), newest
+    first, with both members loaded"""
+    base = Alliance.query.options(
+        db.joinedload(Alliance.nation1),
+        db.joinedload(Alliance.nation2)
+    ).filter(Alliance.is_active == True).order_by(Alliance.formed_date.desc(), Alliance.id.desc())
+    involved = (Alliance.nation1_id == nation_id) | (Alliance.nation2_id == nation_id)
+
+    your_alliances = base.filter(involved).limit(LISTING_MAX_ROWS).all()
+    other_alliances = base.filter(~involved).paginate(
+        page=_page_number(page, per_page), per_page=per_page, error_out=False
+    )
+    return your_alliances, other_alliances
+
+def get_deployed_spies(nation_id):
+    """[(spy, active mission or None), ...] for a nation's active spies, with the
+    target nations loaded, in two queries"""
+    spies = DeployedSpy.query.options(db.joinedload(DeployedSpy.target_nation)).filter(
+        DeployedSpy.owner_nation_id == nation_id,
+        DeployedSpy.is_active == True
+    ).order_by(DeployedSpy.id).limit(LISTING_MAX_ROWS).all()
+    if not spies:
+        return []
+
+    # First open mission of each spy
+    active_missions = {}
+    for mission in SpyMission.query.filter(
+        SpyMission.spy_id.in_([spy.id for spy in spies]),
+        SpyMission.is_completed == False
+    ).order_by(SpyMission.id):
+        active_missions.setdefault(mission.spy_id, mission)
+
+    return [(spy, active_missions.get(spy.id)) for spy in spies]
+
+def get_completed_missions(nation_id, limit=10):
+    """A nation's most recently completed spy missions, with spy and target loaded"""
+    return SpyMission.query.join(DeployedSpy).options(
+        db.contains_eager(SpyMission.spy).joinedload(DeployedSpy.target_nation)
+    ).filter(
+        DeployedSpy.owner_nation_id == nation_id,
+        SpyMission.is_completed == True
+    ).order_by(SpyMission.completion_date.desc()).limit(min(limit, LISTING_MAX_ROWS)).all()
+
+def get_intel_reports(nation_id, limit=10, cursor=None, target_nation_id=None, report_type=None):
+    """(one page of a nation's intel reports newest first with the target nations
+    loaded, cursor of the next page or None)"""
+    limit = min(limit, LISTING_MAX_ROWS)
+    query = SpyReport.query.options(db.joinedload(SpyReport.target_nation)).filter(
+        SpyReport.nation_id == nation_id
+    )
+    if target_nation_id:
+        query = query.filter(SpyReport.target_nation_id == target_nation_id)
+    if report_type:
+        query = query.filter(SpyReport.report_type == report_type)
+
+    # One extra row tells whether there is a next page
+    reports = reports_before(query, cursor).order_by(
+        SpyReport.report_date.desc(), SpyReport.id.desc()
+    ).limit(limit + 1).all()
+    next_cursor = encode_report_cursor(reports[limit - 1]) if len(reports) > limit else None
+    return reports[:limit], next_cursor
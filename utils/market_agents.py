@@ -0,0 +1,194 @@
+"""
+AI market agents.
+
+Every AI nation (a nation without a user account) is a market agent. One run
+loads the stocks, rates and currency of all agents as columns with a single
+query, brings the amounts up to date column by column, lets each agent's strategy
+decide one ask and one bid over those columns, and submits all the orders to the
+matching engine in a few bulk batches. Asks and bids rest in the book when they
+do not cross, so the agents also provide liquidity to human players.
+
+Each batch is its own transaction and the engine lock is released between
+batches, so player orders are never held up for a whole run.
+"""
+from array import array
+from collections import namedtuple
+from datetime import datetime
+import random
+from app import db
+from models import Nation, Resource, User, ACCRUING_RESOURCES
+from utils.matching_engine import OrderRequest, market_engine
+from utils.order_book import MARKET_RESOURCE_TYPES
+from utils.price_history import price_history
+
+# Prices used before a resource type has traded
+DEFAULT_PRICES = {
+    'raw_materials': 10.0,
+    'food': 15.0,
+    'energy': 20.0
+}
+
+# Orders submitted per MarketEngine.submit() transaction
+AGENT_BATCH_SIZE = 200
+
+# Smaller orders are not placed
+MIN_ORDER_QUANTITY = 1.0
+
+AgentStrategy = namedtuple('AgentStrategy', [
+    'sell_chance',     # Chance of placing an ask in a run
+    'buy_chance',      # Chance of placing a bid in a run
+    'pick',            # 'random' resource, or 'balance' (sell the largest surplus, buy the shortest stock)
+    'reserve_hours',   # Hours of consumption never sold
+    'sell_fraction',   # (low, high) share of the surplus offered
+    'ask_markup',      # (low, high) ask price, as a multiple of the reference price
+    'bid_discount',    # (low, high) bid price, as a multiple of the reference price
+    'spend_fraction',  # (low, high) share of the currency above min_currency bid
+    'min_currency',    # Currency never bid
+])
+
+# Strategy name -> parameters; agents are spread over the strategies by nation id
+AGENT_STRATEGIES = {
+    # Random resource, asks around the reference price, bids only on bargains
+    'trader': AgentStrategy(0.10, 0.05, 'random', 12, (0.1, 0.3), (0.85, 1.15), (0.80, 0.85), (0.1, 0.5), 1000.0),
+    # Sells what it has most of and buys what it is shortest of, close to the reference price
+    'balancer': AgentStrategy(0.05, 0.10, 'balance', 48, (0.05, 0.2), (0.95, 1.10), (0.90, 1.0), (0.05, 0.2), 2000.0),
+}
+
+AGENT_COLUMNS = ['currency', 'currency_production', *[
+    column for resource_type in MARKET_RESOURCE_TYPES
+    for column in (resource_type, *ACCRUING_RESOURCES[resource_type][:2])
+]]
+
+
+class MarketAgentEngine:
+    """Decides and submits the market orders of every AI nation."""
+
+    def __init__(self, strategies=None, batch_size=AGENT_BATCH_SIZE):
+        self.strategies = dict(strategies or AGENT_STRATEGIES)
+        self.batch_size = batch_size
+
+    def _load(self, now):
+        """Current stocks, rates and currency of every AI nation, as columns.
+        Returns (nation ids, {column: array}); stocks and currency are accrued to `now`."""
+        rows = db.session.query(
+            Resource.nation_id,
+            Resource.last_updated,
+            *[getattr(Resource, column) for column in AGENT_COLUMNS]
+        ).join(Nation, Nation.id == Resource.nation_id).outerjoin(
+            User, User.id == Nation.user_id
+        ).filter(User.id.is_(None)).order_by(Resource.id).all()
+
+        # Nation code only ever touches the first resource row of a nation
+        seen = set()
+        first_rows = []
+        for row in rows:
+            if row.nation_id not in seen:
+                seen.add(row.nation_id)
+                first_rows.append(row)
+        if not first_rows:
+            return [], {column: array('d') for column in AGENT_COLUMNS}
+
+        nation_ids, last_updated, *values = zip(*first_rows)
+        columns = {
+            column: array('d', (value or 0.0 for value in column_values))
+            for column, column_values in zip(AGENT_COLUMNS, values)
+        }
+        hours = array('d', (max(0.0, (now - ts).total_seconds() / 3600) if ts else 0.0 for ts in last_updated))
+
+        # The closed-form accrual of Resource.current_amounts, one column at a time
+        for resource_type in ['currency', *MARKET_RESOURCE_TYPES]:
+            production_column, consumption_column, clamped = ACCRUING_RESOURCES[resource_type]
+            net_rates = columns[production_column]
+            if consumption_column:
+                net_rates = array('d', (p - c for p, c in zip(net_rates, columns[consumption_column])))
+            amounts = (amount + rate * h for amount, rate, h in zip(columns[resource_type], net_rates, hours))
+            columns[resource_type] = array('d', (max(0.0, a) for a in amounts) if clamped else amounts)
+        return list(nation_ids), columns
+
+    def decide(self, nation_ids, columns, prices, rng):
+        """OrderRequests of the agents: at most one ask and one bid each.
+        `prices` maps resource types to reference prices."""
+        names = sorted(self.strategies)
+        strategies = [self.strategies[names[nation_id % len(names)]] for nation_id in nation_ids]
+        count = len(nation_ids)
+
+        # Surplus above the reserve, and hours of consumption in stock, per resource type
+        surplus = {}
+        coverage = {}
+        for resource_type in MARKET_RESOURCE_TYPES:
+            stocks = columns[resource_type]
+            consumption = columns[ACCRUING_RESOURCES[resource_type][1]]
+            surplus[resource_type] = array('d', (
+                max(0.0, stock - strategy.reserve_hours * rate)
+                for stock, strategy, rate in zip(stocks, strategies, consumption)
+            ))
+            coverage[resource_type] = array('d', (
+                stock / rate if rate > 0 else float('inf') for stock, rate in zip(stocks, consumption)
+            ))
+
+        # Resource each agent sells and buys (None: no order this run)
+        sells = [None] * count
+        buys = [None] * count
+        for i, strategy in enumerate(strategies):
+            if rng.random() < strategy.sell_chance:
+                if strategy.pick == 'balance':
+                    sells[i] = max(MARKET_RESOURCE_TYPES, key=lambda rtype: surplus[rtype][i] * prices[rtype])
+                else:
+                    sells[i] = rng.choice(MARKET_RESOURCE_TYPES)
+            if rng.random() < strategy.buy_chance:
+                if strategy.pick == 'balance':
+                    buys[i] = min(MARKET_RESOURCE_TYPES, key=lambda rtype: coverage[rtype][i])
+                else:
+                    buys[i] = rng.choice(MARKET_RESOURCE_TYPES)
+                if buys[i] == sells[i]:
+                    buys[i] = None
+
+        requests = []
+        for i, (nation_id, strategy, resource_type) in enumerate(zip(nation_ids, strategies, sells)):
+            if resource_type is None:
+                continue
+            quantity = surplus[resource_type][i] * rng.uniform(*strategy.sell_fraction)
+            if quantity >= MIN_ORDER_QUANTITY:
+                price = round(prices[resource_type] * rng.uniform(*strategy.ask_markup), 2)
+                requests.append(OrderRequest('sell', nation_id, resource_type, quantity, max(0.01, price)))
+
+        for nation_id, strategy, currency, resource_type in zip(nation_ids, strategies, columns['currency'], buys):
+            if resource_type is None:
+                continue
+            budget = (currency - strategy.min_currency) * rng.uniform(*strategy.spend_fraction)
+            price = max(0.01, round(prices[resource_type] * rng.uniform(*strategy.bid_discount), 2))
+            # Round down so the escrow stays within the budget
+            quantity = float(int(budget / price))
+            if quantity >= MIN_ORDER_QUANTITY:
+                requests.append(OrderRequest('buy', nation_id, resource_type, quantity, price))
+        return requests
+
+    def run(self, now=None, seed=None):
+        """Let every AI nation trade once. Commits after each batch of orders.
+        Returns {'agents', 'placed', 'rejected', 'filled'}."""
+        if now is None:
+            now = datetime.utcnow()
+        rng = random.Random(seed)
+
+        nation_ids, columns = self._load(now)
+        prices = {}
+        for resource_type in MARKET_RESOURCE_TYPES:
+            reference_price = price_history.reference_price(resource_type)
+            prices[resource_type] = reference_price if reference_price is not None else DEFAULT_PRICES[resource_type]
+        requests = self.decide(nation_ids, columns, prices, rng)
+        # The load only read; end its transaction before the batches take the engine lock
+        db.session.commit()
+
+        summary = {'agents': len(nation_ids), 'placed': 0, 'rejected': 0, 'filled': 0.0}
+        for start in range(0, len(requests), self.batch_size):
+            for result in market_engine.submit(requests[start:start + self.batch_size], now):
+                if result['success']:
+                    summary['placed'] += 1
+                    summary['filled'] += result['filled']
+                else:
+                    summary['rejected'] += 1
+        return summary
+
+
+# Shared instance used by the scheduler
+market_agents = MarketAgentEngine()
@@ -0,0 +1,411 @@
+"""
+Continuous double-auction matching engine.
+
+Every resource type has one book of standing bids (MarketBid) and asks
+(MarketItem). An incoming order is matched on insert against the opposite side in
+price-time priority (best price first, oldest first at the same price), can fill
+partially against several resting orders, and any remainder rests in the book.
+Trades execute at the resting order's price; a bidder who gets a better price
+than their limit is refunded the difference from their escrow.
+
+DoubleAuctionBook is the pure in-memory matcher. MarketEngine keeps one book per
+resource type loaded from the database and persists a batch of orders in one
+transaction: a guarded escrow update per new order, then the remaining quantities,
+Trade rows and balance credits of all fills with one batched statement each.
+"""
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+import heapq
+import itertools
+import threading
+from sqlalchemy import bindparam, insert, update
+from app import db
+from models import MarketItem, MarketBid, Resource, Trade, accrued_amount_sql, credited_amount_sql
+from utils.order_book import MARKET_RESOURCE_TYPES, BOOK_MAX_AGE, order_book
+from utils.price_history import price_history, record_trades
+
+# Remaining quantities at or below this count as filled
+QUANTITY_EPSILON = 1e-9
+
+# Bids and asks placed through the engine expire after this long
+ORDER_LIFETIME = timedelta(days=1)
+
+ORDER_SIDES = ('buy', 'sell')
+
+Fill = namedtuple('Fill', ['bid', 'ask', 'price', 'quantity'])
+
+# side is 'buy' (a MarketBid) or 'sell' (a MarketItem)
+OrderRequest = namedtuple('OrderRequest', ['side', 'nation_id', 'resource_type', 'quantity', 'price_per_unit'])
+
+
+class StaleBookError(Exception):
+    """An order matched in memory was changed by another process"""
+
+
+class Order:
+    """A bid or ask in a book. `quantity` is the remaining quantity."""
+    __slots__ = ('order_id', 'side', 'owner_id', 'price', 'quantity', 'expires_at', 'sequence')
+
+    def __init__(self, order_id, side, owner_id, price, quantity, expires_at=None):
+        self.order_id = order_id
+        self.side = side
+        self.owner_id = owner_id
+        self.price = price
+        self.quantity = quantity
+        self.expires_at = expires_at
+        self.sequence = None
+
+
+class DoubleAuctionBook:
+    """Bids and asks of one resource type.
+    Each side is a heap keyed by (price priority, arrival sequence). Cancelled,
+    filled and expired orders are dropped lazily when they reach the top."""
+
+    def __init__(self):
+        self._bids = []      # heap of (-price, sequence, order)
+        self._asks = []      # heap of (price, sequence, order)
+        self._orders = {}    # (side, order_id) -> live order
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def rest(self, order):
+        """Add an order to its side without matching it (e.g. when loading a book)."""
+        order.sequence = next(self._sequence)
+        if order.side == 'buy':
+            heapq.heappush(self._bids, (-order.price, order.sequence, order))
+        else:
+            heapq.heappush(self._asks, (order.price, order.sequence, order))
+        self._orders[(order.side, order.order_id)] = order
+
+    def _pop(self, heap):
+        order = heapq.heappop(heap)[2]
+        if self._orders.get((order.side, order.order_id)) is order:
+            del self._orders[(order.side, order.order_id)]
+        return order
+
+    def submit(self, order, now=None):
+        """Match an incoming order against the opposite side; the remainder rests.
+        Returns the fills in execution order."""
+        if now is None:
+            now = datetime.utcnow()
+        buying = order.side == 'buy'
+        opposite = self._asks if buying else self._bids
+
+        fills = []
+        own_orders = []
+        while order.quantity > QUANTITY_EPSILON and opposite:
+            resting = opposite[0][2]
+            if resting.quantity <= QUANTITY_EPSILON or (resting.expires_at is not None and resting.expires_at <= now):
+                self._pop(opposite)
+                continue
+            if (resting.price > order.price) if buying else (resting.price < order.price):
+                break
+            if resting.owner_id == order.owner_id:
+                # Nations never trade with themselves; look past their own orders
+                own_orders.append(heapq.heappop(opposite))
+                continue
+
+            quantity = min(order.quantity, resting.quantity)
+            order.quantity -= quantity
+            resting.quantity -= quantity
+            if buying:
+                fills.append(Fill(order, resting, resting.price, quantity))
+            else:
+                fills.append(Fill(resting, order, resting.price, quantity))
+            if resting.quantity <= QUANTITY_EPSILON:
+                self._pop(opposite)
+
+        for entry in own_orders:
+            heapq.heappush(opposite, entry)
+        if order.quantity > QUANTITY_EPSILON:
+            self.rest(order)
+        return fills
+
+    def cancel(self, side, order_id):
+        """Remove an order from the book; returns it, or None if it was not live."""
+        order = self._orders.pop((side, order_id), None)
+        if order is not None:
+            order.quantity = 0
+        return order
+
+    def depth(self, side, limit=10, now=None):
+        """Best live orders of one side, best first."""
+        if now is None:
+            now = datetime.utcnow()
+        orders = [
+            order for (order_side, _), order in self._orders.items()
+            if order_side == side and (order.expires_at is None or order.expires_at > now)
+        ]
+        if side == 'buy':
+            return heapq.nsmallest(limit, orders, key=lambda order: (-order.price, order.sequence))
+        return heapq.nsmallest(limit, orders, key=lambda order: (order.price, order.sequence))
+
+
+def _execute_guarded(statement, rows):
+    """Run a guarded UPDATE for every parameter set; False unless each one
+    matched exactly one row"""
+    if not rows:
+        return True
+    if db.engine.dialect.supports_sane_multi_rowcount:
+        return db.session.execute(statement, rows).rowcount == len(rows)
+    return all(db.session.execute(statement, row).rowcount == 1 for row in rows)
+
+
+class MarketEngine:
+    """Matching books of every resource type, persisted to the market tables.
+    Books are loaded on first use and reloaded after BOOK_MAX_AGE, or as soon as
+    a batch finds an order that another worker process changed meanwhile."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books = {}
+        self._loaded_at = {}
+
+    def _load(self, resource_type, now):
+        """Read the live bids and asks of one resource type in arrival order."""
+        book = DoubleAuctionBook()
+        asks = db.session.query(
+            MarketItem.id, MarketItem.seller_id, MarketItem.price_per_unit, MarketItem.quantity, MarketItem.expires_at
+        ).filter(
+            MarketItem.resource_type == resource_type,
+            MarketItem.is_active == True,
+            (MarketItem.expires_at == None) | (MarketItem.expires_at > now)
+        ).order_by(MarketItem.created_at, MarketItem.id)
+        for order_id, owner_id, price, quantity, expires_at in asks:
+            book.rest(Order(order_id, 'sell', owner_id, price, quantity, expires_at))
+
+        bids = db.session.query(
+            MarketBid.id, MarketBid.bidder_id, MarketBid.price_per_unit, MarketBid.quantity, MarketBid.expires_at
+        ).filter(
+            MarketBid.resource_type == resource_type,
+            MarketBid.is_active == True,
+            (MarketBid.expires_at == None) | (MarketBid.expires_at > now)
+        ).order_by(MarketBid.created_at, MarketBid.id)
+        for order_id, owner_id, price, quantity, expires_at in bids:
+            book.rest(Order(order_id, 'buy', owner_id, price, quantity, expires_at))
+
+        self._books[resource_type] = book
+        self._loaded_at[resource_type] = now
+        return book
+
+    def _book(self, resource_type, now):
+        loaded_at = self._loaded_at.get(resource_type)
+        if loaded_at is None or now - loaded_at > BOOK_MAX_AGE:
+            return self._load(resource_type, now)
+        return self._books[resource_type]
+
+    def reload(self, resource_type=None):
+        """Reload one book (or every book) on next use, after orders changed outside the engine."""
+        with self._lock:
+            if resource_type:
+                self._loaded_at.pop(resource_type, None)
+            else:
+                self._loaded_at.clear()
+
+    def cancel(self, resource_type, side, order_id):
+        """Drop an order that was bought, cancelled or expired outside the engine."""
+        with self._lock:
+            book = self._books.get(resource_type)
+            if book is not None:
+                book.cancel(side, order_id)
+
+    def depth(self, resource_type, side, limit=10):
+        """Best bids or asks of a resource type as dicts, best first."""
+        now = datetime.utcnow()
+        with self._lock:
+            orders = self._book(resource_type, now).depth(side, limit, now)
+            return [
+                {"id": order.order_id, "nation_id": order.owner_id, "price_per_unit": order.price, "quantity": order.quantity}
+                for order in orders
+            ]
+
+    def best_bid(self, resource_type):
+        """Highest standing bid of a resource type, or None."""
+        bids = self.depth(resource_type, 'buy', 1)
+        return bids[0] if bids else None
+
+    def _escrow_statement(self, resource_type, now):
+        """Guarded debit of `b_amount` of a resource from nation `b_nation`, only if
+        the nation currently has that much"""
+        resource_table = Resource.__table__
+        column = resource_table.c[resource_type]
+        return update(resource_table).where(
+            resource_table.c.nation_id == bindparam('b_nation'),
+            accrued_amount_sql(resource_type, now) >= bindparam('b_amount')
+        ).values({column: column - bindparam('b_amount')})
+
+    def _persist_fills(self, fills, now):
+        """Write the fills of a batch: remaining quantities, trades and credits."""
+        ask_fills = defaultdict(float)
+        bid_fills = defaultdict(float)
+        currency_credits = defaultdict(float)   # nation_id -> amount
+        goods_credits = defaultdict(float)      # (resource_type, nation_id) -> amount
+        trades = []
+        for resource_type, fill in fills:
+            value = fill.price * fill.quantity
+            ask_fills[fill.ask.order_id] += fill.quantity
+            bid_fills[fill.bid.order_id] += fill.quantity
+            currency_credits[fill.ask.owner_id] += value
+            if fill.bid.price > fill.price:
+                # Refund the part of the bidder's escrow the better price saved
+                currency_credits[fill.bid.owner_id] += (fill.bid.price - fill.price) * fill.quantity
+            goods_credits[(resource_type, fill.bid.owner_id)] += fill.quantity
+            trades.append({
+                "seller_id": fill.ask.owner_id,
+                "buyer_id": fill.bid.owner_id,
+                "market_item_id": fill.ask.order_id,
+                "market_bid_id": fill.bid.order_id,
+                "resource_type": resource_type,
+                "quantity": fill.quantity,
+                "price_per_unit": fill.price,
+                "total_price": value,
+                "trade_date": now
+            })
+
+        # Remaining quantities, only for orders still active with enough left
+        for table, filled in ((MarketItem.__table__, ask_fills), (MarketBid.__table__, bid_fills)):
+            remaining = table.c.quantity - bindparam('b_filled')
+            values = {"quantity": remaining, "is_active": remaining > QUANTITY_EPSILON}
+            if table is MarketItem.__table__:
+                values["total_price"] = remaining * table.c.price_per_unit
+            statement = update(table).where(
+                table.c.id == bindparam('b_id'),
+                table.c.is_active == True,
+                table.c.quantity >= bindparam('b_filled') - QUANTITY_EPSILON
+            ).values(values)
+            if not _execute_guarded(statement, [{"b_id": order_id, "b_filled": quantity} for order_id, quantity in filled.items()]):
+                raise StaleBookError()
+
+        db.session.execute(insert(Trade.__table__), trades)
+        record_trades(trades)
+
+        resource_table = Resource.__table__
+        db.session.execute(
+            update(resource_table).where(resource_table.c.nation_id == bindparam('b_nation'))
+            .values(currency=resource_table.c.currency + bindparam('b_amount')),
+            [{"b_nation": nation_id, "b_amount": amount} for nation_id, amount in currency_credits.items()]
+        )
+        for resource_type in MARKET_RESOURCE_TYPES:
+            credits = [
+                {"b_nation": nation_id, "b_amount": amount}
+                for (credited_type, nation_id), amount in goods_credits.items() if credited_type == resource_type
+            ]
+            if credits:
+                db.session.execute(
+                    update(resource_table).where(resource_table.c.nation_id == bindparam('b_nation'))
+                    .values({resource_table.c[resource_type]: credited_amount_sql(resource_type, bindparam('b_amount'), now)}),
+                    credits
+                )
+
+    def _submit(self, requests, now):
+        # Load the books before the new orders are inserted, so they are not read twice
+        books = {
+            resource_type: self._book(resource_type, now)
+            for resource_type in {request.resource_type for request in requests}
+            if resource_type in MARKET_RESOURCE_TYPES
+        }
+        results = [None] * len(requests)
+        accepted = []
+        escrow_statements = {}
+        for index, request in enumerate(requests):
+            if (request.side not in ORDER_SIDES or request.resource_type not in MARKET_RESOURCE_TYPES or
+                    not request.quantity > 0 or not request.price_per_unit > 0):
+                results[index] = {'success': False, 'message': 'Invalid order.', 'order_id': None, 'filled': 0}
+                continue
+            # Hold the goods of an ask or the currency of a bid
+            escrow_type = 'currency' if request.side == 'buy' else request.resource_type
+            if escrow_type not in escrow_statements:
+                escrow_statements[escrow_type] = self._escrow_statement(escrow_type, now)
+            amount = request.quantity * request.price_per_unit if request.side == 'buy' else request.quantity
+            escrowed = db.session.execute(
+                escrow_statements[escrow_type], {"b_nation": request.nation_id, "b_amount": amount}
+            ).rowcount == 1
+            if not escrowed:
+                results[index] = {'success': False, 'message': f'Not enough {escrow_type} available.', 'order_id': None, 'filled': 0}
+                continue
+            accepted.append((index, request))
+
+        if not accepted:
+            return results, set(), set()
+
+        # Insert the new bids and asks with one statement per table, ids in request order
+        order_ids = {}
+        expires_at = now + ORDER_LIFETIME
+        for side, table, owner_column in (('buy', MarketBid.__table__, 'bidder_id'), ('sell', MarketItem.__table__, 'seller_id')):
+            rows = [
+                {
+                    owner_column: request.nation_id,
+                    "resource_type": request.resource_type,
+                    "quantity": request.quantity,
+                    "price_per_unit": request.price_per_unit,
+                    "created_at": now,
+                    "expires_at": expires_at,
+                    "is_active": True
+                }
+                for _, request in accepted if request.side == side
+            ]
+            if not rows:
+                continue
+            if table is MarketItem.__table__:
+                for row in rows:
+                    row["total_price"] = row["quantity"] * row["price_per_unit"]
+            inserted = db.session.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows)
+            order_ids[side] = iter(inserted.scalars().all())
+
+        fills = []
+        touched = set()
+        for index, request in accepted:
+            order_id = next(order_ids[request.side])
+            order = Order(order_id, request.side, request.nation_id, request.price_per_unit, request.quantity, expires_at)
+            order_fills = books[request.resource_type].submit(order, now)
+            fills.extend((request.resource_type, fill) for fill in order_fills)
+            touched.add(request.resource_type)
+
+            filled = sum(fill.quantity for fill in order_fills)
+            verb = 'Bought' if request.side == 'buy' else 'Sold'
+            order_name = 'buy order' if request.side == 'buy' else 'listing'
+            message = f'Placed a {order_name} for {request.quantity:,.0f} {request.resource_type}.'
+            if filled > QUANTITY_EPSILON:
+                message += f' {verb} {filled:,.0f} immediately.'
+            results[index] = {'success': True, 'message': message, 'order_id': order_id, 'filled': filled}
+
+        if fills:
+            self._persist_fills(fills, now)
+        return results, touched, {resource_type for resource_type, _ in fills}
+
+    def submit(self, requests, now=None):
+        """Escrow, match and persist a batch of OrderRequests in one transaction.
+        Commits the session. Returns one {'success', 'message', 'order_id', 'filled'}
+        per request; a request whose escrow failed changes nothing."""
+        if now is None:
+            now = datetime.utcnow()
+
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    results, touched, traded = self._submit(requests, now)
+                    db.session.commit()
+                    break
+                except StaleBookError:
+                    # Another process filled or withdrew an order we matched: reload and retry
+                    db.session.rollback()
+                    self._loaded_at.clear()
+                except Exception:
+                    db.session.rollback()
+                    self._loaded_at.clear()
+                    raise
+            else:
+                message = 'The market changed while your order was placed. Please try again.'
+                return [{'success': False, 'message': message, 'order_id': None, 'filled': 0} for _ in requests]
+
+        for resource_type in touched:
+            order_book.refresh(resource_type)
+        for resource_type in traded:
+            price_history.refresh(resource_type)
+        return results
+
+
+# Shared instance used by the market routes and the scheduler
+market_engine = MarketEngine()
@@ -8,9 +8,10 @@ import random
 from sqlalchemy import desc, func, or_, and_
 from app import db
 from models import (
-    NewsArticle, Nation, War, Alliance, Trade, Technology, 
+    NewsArticle, Nation, War, Alliance, Trade, Technology, TechnologyState,
     MarketItem, Resource, Military, DeployedSpy, SpyMission
 )
+from utils.price_history import price_history
 
 def get_latest_news(limit=10, category=None, nation_id=None, featured_only=False):
     """
@@ -95,28 +96,26 @@ def generate_market_news():
     # Find notable market trends
     resource_types = ['raw_materials', 'food', 'energy']
     for resource_type in resource_types:
-        # Get average price for this resource type
-        active_listings = MarketItem.query.filter_by(
-            resource_type=resource_type,
-            is_active=True
-        ).all()
-        
-        if not active_listings or len(active_listings) < 3:
+        # Get average price for this resource type (aggregated over the order book index)
+        listing_count, avg_price = db.session.query(
+            func.count(MarketItem.id),
+            func.avg(MarketItem.price_per_unit)
+        ).filter(
+            MarketItem.resource_type == resource_type,
+            MarketItem.is_active == True
+        ).one()
+        
+        if listing_count < 3:
             continue
-            
-        # Calculate average price
-        avg_price = sum(item.price_per_unit for item in active_listings) / len(active_listings)
         
-        # Get recent completed trades for this resource
-        recent_trades = Trade.query.filter_by(
-            resource_type=resource_type
-        ).order_by(desc(Trade.trade_date)).limit(20).all()
+        # Trend price of recent completed trades (EWMA of about the last 20)
+        prices = price_history.prices(resource_type)
         
-        if not recent_trades or len(recent_trades) < 3:
+        if not prices or prices['trade_count'] < 3:
             continue
             
         # Calculate previous average price
-        prev_avg_price = sum(trade.price_per_unit for trade in recent_trades) / len(recent_trades)
+        prev_avg_price = prices['trend_price']
         
         # Check if there's a significant price change
         if abs(avg_price - prev_avg_price) / prev_avg_price > 0.15:  # 15% change
@@ -504,8 +503,10 @@ def generate_technology_news():
     if random.random() < 0.3:  # 30% chance each day
         # Find technology categories where nations are competing
         top_tech_nations = db.session.query(
-            Nation.id, Nation.name, func.sum(Technology.level).label('tech_sum')
-        ).join(Technology).group_by(Nation.id).order_by(desc('tech_sum')).limit(3).all()
+            Nation.id, Nation.name, TechnologyState.level_sum
+        ).join(TechnologyState, TechnologyState.nation_id == Nation.id).order_by(
+            desc(TechnologyState.level_sum)
+        ).limit(3).all()
         
         if len(top_tech_nations) >= 2:
             leader_name = top_tech_nations[0][1]
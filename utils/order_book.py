@@ -0,0 +1,107 @@
+"""
+Market order book.
+
+Active listings are read per resource type in price-time priority (cheapest first,
+oldest first at the same price) through the composite index on
+(resource_type, is_active, price_per_unit, created_at). The top of each book is
+kept in memory and refreshed whenever a listing is created, bought, cancelled or
+expires, so market pages and bots never load the full listing table.
+"""
+from datetime import datetime, timedelta
+import threading
+from app import db
+from models import MarketItem
+
+MARKET_RESOURCE_TYPES = ['raw_materials', 'food', 'energy']
+
+# Number of best asks kept in memory per resource type
+BOOK_DEPTH = 20
+
+# Cached books are reloaded after this long, so listings changed by other
+# worker processes are picked up even without an explicit refresh
+BOOK_MAX_AGE = timedelta(minutes=5)
+
+LISTINGS_PER_PAGE = 25
+
+def order_book_query(resource_type):
+    """Active listings of a resource type in price-time priority"""
+    return MarketItem.query.filter(
+        MarketItem.resource_type == resource_type,
+        MarketItem.is_active == True
+    ).order_by(MarketItem.price_per_unit, MarketItem.created_at, MarketItem.id)
+
+def get_listings_page(resource_type=None, page=1, per_page=LISTINGS_PER_PAGE):
+    """One page of active listings, for a single resource type or all of them
+    (grouped by resource type, each in price-time priority)"""
+    if resource_type in MARKET_RESOURCE_TYPES:
+        query = order_book_query(resource_type)
+    else:
+        query = MarketItem.query.filter(MarketItem.is_active == True).order_by(
+            MarketItem.resource_type, MarketItem.price_per_unit, MarketItem.created_at, MarketItem.id
+        )
+    query = query.options(db.joinedload(MarketItem.seller))
+    return query.paginate(page=page, per_page=per_page, error_out=False)
+
+
+class OrderBook:
+    """In-memory best asks of every resource type.
+    The market only has sell listings, so each book is the ask side."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._asks = {}        # resource_type -> list of listing dicts, best first
+        self._loaded_at = {}   # resource_type -> datetime
+
+    def _load(self, resource_type):
+        """Read the top of one book with a single index range scan."""
+        rows = db.session.query(
+            MarketItem.id,
+            MarketItem.seller_id,
+            MarketItem.price_per_unit,
+            MarketItem.quantity,
+            MarketItem.total_price,
+            MarketItem.created_at
+        ).filter(
+            MarketItem.resource_type == resource_type,
+            MarketItem.is_active == True
+        ).order_by(MarketItem.price_per_unit, MarketItem.created_at, MarketItem.id).limit(BOOK_DEPTH).all()
+
+        return [
+            {
+                "id": listing_id,
+                "seller_id": seller_id,
+                "price_per_unit": price_per_unit,
+                "quantity": quantity,
+                "total_price": total_price,
+                "created_at": created_at
+            }
+            for listing_id, seller_id, price_per_unit, quantity, total_price, created_at in rows
+        ]
+
+    def refresh(self, resource_type=None):
+        """Reload one book (or every book) after listings changed."""
+        resource_types = [resource_type] if resource_type else MARKET_RESOURCE_TYPES
+        for rtype in resource_types:
+            asks = self._load(rtype)
+            with self._lock:
+                self._asks[rtype] = asks
+                self._loaded_at[rtype] = datetime.utcnow()
+
+    def asks(self, resource_type):
+        """Best asks of a resource type (at most BOOK_DEPTH), cheapest first."""
+        with self._lock:
+            loaded_at = self._loaded_at.get(resource_type)
+            if loaded_at is not None and datetime.utcnow() - loaded_at < BOOK_MAX_AGE:
+                return list(self._asks[resource_type])
+        self.refresh(resource_type)
+        with self._lock:
+            return list(self._asks[resource_type])
+
+    def best_ask(self, resource_type):
+        """Cheapest active listing of a resource type, or None."""
+        asks = self.asks(resource_type)
+        return asks[0] if asks else None
+
+
+# Shared instance used by the market routes and the scheduler
+order_book = OrderBook()
@@ -0,0 +1,239 @@
+"""
+Market price series.
+
+Every trade insert also updates the 1-minute, 1-hour and 1-day OHLCV candles of
+its resource type (price_candle, one upsert per touched bucket) and the latest and
+EWMA reference prices (market_price, one row per resource type). The EWMA update
+of a batch of trades is folded into a single `price = decay * price + shift`
+statement, so trades written by several worker processes at once all count.
+
+Charts, bots and news read the series from an in-memory cache refreshed after
+every commit that recorded trades, instead of re-reading the Trade table.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+import threading
+from sqlalchemy import case, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import PriceCandle, MarketPrice
+from utils.order_book import MARKET_RESOURCE_TYPES
+
+# interval -> retention (None keeps every candle)
+CANDLE_INTERVALS = {
+    '1m': timedelta(days=2),
+    '1h': timedelta(days=90),
+    '1d': None,
+}
+
+# Trades averaged by the fast (reference) and slow (trend) EWMA prices
+REFERENCE_PRICE_SPAN = 10
+TREND_PRICE_SPAN = 20
+
+# Most recent candles kept in memory per resource type and interval
+CANDLE_DEPTH = 60
+
+# Cached series are reloaded after this long, so trades recorded by other
+# worker processes are picked up even without an explicit refresh
+SERIES_MAX_AGE = timedelta(minutes=1)
+
+def candle_start(ts, interval):
+    """Start of the candle of `interval` containing `ts`"""
+    start = ts.replace(second=0, microsecond=0)
+    if interval in ('1h', '1d'):
+        start = start.replace(minute=0)
+    if interval == '1d':
+        start = start.replace(hour=0)
+    return start
+
+def _upsert(model):
+    """INSERT ... ON CONFLICT statement of the current database"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model.__table__)
+    return sqlite.insert(model.__table__)
+
+def _ewma_terms(prices, span):
+    """(decay, shift) such that the EWMA after `prices` is decay * before + shift"""
+    alpha = 2.0 / (span + 1)
+    decay, shift = 1.0, 0.0
+    for price in prices:
+        decay *= 1 - alpha
+        shift = shift * (1 - alpha) + alpha * price
+    return decay, shift
+
+def _record_candles(trades):
+    """Fold the trades into their candles with one upsert statement"""
+    candles = {}
+    for trade in trades:
+        price, quantity = trade["price_per_unit"], trade["quantity"]
+        for interval in CANDLE_INTERVALS:
+            key = (trade["resource_type"], interval, candle_start(trade["trade_date"], interval))
+            candle = candles.get(key)
+            if candle is None:
+                candles[key] = {
+                    "resource_type": key[0], "interval": interval, "bucket_start": key[2],
+                    "open": price, "high": price, "low": price, "close": price,
+                    "volume": quantity, "turnover": price * quantity, "trade_count": 1
+                }
+            else:
+                candle["high"] = max(candle["high"], price)
+                candle["low"] = min(candle["low"], price)
+                candle["close"] = price
+                candle["volume"] += quantity
+                candle["turnover"] += price * quantity
+                candle["trade_count"] += 1
+
+    table = PriceCandle.__table__
+    statement = _upsert(PriceCandle)
+    new = statement.excluded
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.resource_type, table.c.interval, table.c.bucket_start],
+        set_={
+            # An existing candle keeps its open price
+            "high": case((new.high > table.c.high, new.high), else_=table.c.high),
+            "low": case((new.low < table.c.low, new.low), else_=table.c.low),
+            "close": new.close,
+            "volume": table.c.volume + new.volume,
+            "turnover": table.c.turnover + new.turnover,
+            "trade_count": table.c.trade_count + new.trade_count,
+        }
+    ), list(candles.values()))
+
+def _record_prices(resource_type, trades):
+    """Move the latest and EWMA prices of a resource type past the trades"""
+    prices = [trade["price_per_unit"] for trade in trades]
+    reference_decay, reference_shift = _ewma_terms(prices, REFERENCE_PRICE_SPAN)
+    trend_decay, trend_shift = _ewma_terms(prices, TREND_PRICE_SPAN)
+
+    table = MarketPrice.__table__
+    statement = _upsert(MarketPrice).values(
+        resource_type=resource_type,
+        last_price=prices[-1],
+        # A resource's first trade seeds its averages
+        reference_price=reference_decay * prices[0] + reference_shift,
+        trend_price=trend_decay * prices[0] + trend_shift,
+        trade_count=len(prices),
+        last_trade_at=trades[-1]["trade_date"]
+    )
+    new = statement.excluded
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.resource_type],
+        set_={
+            "last_price": new.last_price,
+            "reference_price": table.c.reference_price * reference_decay + reference_shift,
+            "trend_price": table.c.trend_price * trend_decay + trend_shift,
+            "trade_count": table.c.trade_count + new.trade_count,
+            "last_trade_at": new.last_trade_at,
+        }
+    ))
+
+def record_trades(trades):
+    """Update candles and reference prices for newly inserted trades.
+    `trades` are dicts with resource_type, quantity, price_per_unit and trade_date
+    (the Trade insert values), oldest first. Does not commit."""
+    trades = list(trades)
+    if not trades:
+        return
+    _record_candles(trades)
+
+    by_resource = defaultdict(list)
+    for trade in trades:
+        by_resource[trade["resource_type"]].append(trade)
+    for resource_type, resource_trades in sorted(by_resource.items()):
+        _record_prices(resource_type, resource_trades)
+
+def prune_price_candles(now=None):
+    """Delete candles older than the retention of their interval.
+    Returns the number of candles deleted; the caller commits."""
+    if now is None:
+        now = datetime.utcnow()
+    deleted = 0
+    for interval, retention in CANDLE_INTERVALS.items():
+        if retention is None:
+            continue
+        deleted += db.session.execute(delete(PriceCandle).where(
+            PriceCandle.interval == interval,
+            PriceCandle.bucket_start < candle_start(now - retention, interval)
+        )).rowcount
+    return deleted
+
+
+class PriceHistory:
+    """In-memory recent candles and reference prices of every resource type."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}      # resource_type -> {'candles': {interval: [dict, ...]}, 'prices': dict or None}
+        self._loaded_at = {}   # resource_type -> datetime
+
+    def _load(self, resource_type):
+        """Read the latest candles of each interval with one primary key range scan each."""
+        candles = {}
+        for interval in CANDLE_INTERVALS:
+            rows = PriceCandle.query.filter(
+                PriceCandle.resource_type == resource_type,
+                PriceCandle.interval == interval
+            ).order_by(PriceCandle.bucket_start.desc()).limit(CANDLE_DEPTH).all()
+            candles[interval] = [
+                {
+                    "time": row.bucket_start,
+                    "open": row.open,
+                    "high": row.high,
+                    "low": row.low,
+                    "close": row.close,
+                    "volume": row.volume,
+                    "average": row.turnover / row.volume if row.volume else row.close,
+                    "trades": row.trade_count
+                }
+                for row in reversed(rows)
+            ]
+
+        row = db.session.get(MarketPrice, resource_type)
+        prices = None
+        if row is not None:
+            prices = {
+                "last_price": row.last_price,
+                "reference_price": row.reference_price,
+                "trend_price": row.trend_price,
+                "trade_count": row.trade_count,
+                "last_trade_at": row.last_trade_at
+            }
+        return {"candles": candles, "prices": prices}
+
+    def refresh(self, resource_type=None):
+        """Reload one series (or every series) after trades were recorded."""
+        resource_types = [resource_type] if resource_type else MARKET_RESOURCE_TYPES
+        for rtype in resource_types:
+            series = self._load(rtype)
+            with self._lock:
+                self._series[rtype] = series
+                self._loaded_at[rtype] = datetime.utcnow()
+
+    def _get(self, resource_type):
+        with self._lock:
+            loaded_at = self._loaded_at.get(resource_type)
+            if loaded_at is not None and datetime.utcnow() - loaded_at < SERIES_MAX_AGE:
+                return self._series[resource_type]
+        self.refresh(resource_type)
+        with self._lock:
+            return self._series[resource_type]
+
+    def candles(self, resource_type, interval='1h', limit=CANDLE_DEPTH):
+        """Latest candles (at most CANDLE_DEPTH) of a resource type, oldest first."""
+        candles = self._get(resource_type)["candles"].get(interval, [])
+        return candles[-limit:] if limit else []
+
+    def prices(self, resource_type):
+        """Latest, reference and trend prices and trade count of a resource type,
+        or None before its first trade."""
+        prices = self._get(resource_type)["prices"]
+        return dict(prices) if prices else None
+
+    def reference_price(self, resource_type):
+        """Fast EWMA of a resource type's trade prices, or None before its first trade."""
+        prices = self.prices(resource_type)
+        return prices["reference_price"] if prices else None
+
+
+# Shared instance used by the market routes, the scheduler and the news generator
+price_history = PriceHistory()
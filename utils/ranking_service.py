@@ -0,0 +1,213 @@
+"""
+Ranking service that keeps sorted score indexes for the economic, military and
+technology rankings and updates them incrementally when a nation's score changes.
+"""
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+import math
+import threading
+from sqlalchemy import func
+from app import db
+from models import Nation, Military, Technology, TechnologyState
+
+RANKING_CATEGORIES = ['economic', 'military', 'technology']
+
+# Indexes are rebuilt from the database after this long, so changes made by
+# other worker processes are picked up even without an explicit update
+INDEX_MAX_AGE = timedelta(minutes=10)
+
+class ScoreIndex:
+    """Nations sorted by score (highest first, ties broken by nation id).
+    Rank lookups are a binary search over the sorted keys. Updates find their
+    position by binary search too, but inserting into and deleting from the
+    Python list moves the tail of the list, so an update is O(N) memory moves;
+    at a few thousand nations that is a few microseconds."""
+
+    def __init__(self):
+        self._keys = []     # sorted list of (-score, nation_id)
+        self._scores = {}   # nation_id -> score
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, nation_id):
+        return nation_id in self._scores
+
+    def score(self, nation_id):
+        return self._scores.get(nation_id)
+
+    def update(self, nation_id, score):
+        """Insert or move a nation to its new score."""
+        score = score or 0
+        if self._scores.get(nation_id) == score:
+            return
+        self.remove(nation_id)
+        self._scores[nation_id] = score
+        insort(self._keys, (-score, nation_id))
+
+    def remove(self, nation_id):
+        old_score = self._scores.pop(nation_id, None)
+        if old_score is None:
+            return
+        position = bisect_left(self._keys, (-old_score, nation_id))
+        del self._keys[position]
+
+    def rank(self, nation_id):
+        """1-based rank of a nation, or None if it is not indexed."""
+        score = self._scores.get(nation_id)
+        if score is None:
+            return None
+        return bisect_left(self._keys, (-score, nation_id)) + 1
+
+    def top(self, limit):
+        """The first `limit` (nation_id, score) pairs in rank order."""
+        return [(nation_id, -negative_score) for negative_score, nation_id in self._keys[:limit]]
+
+    def ranks(self):
+        """Map nation_id -> 1-based rank of every indexed nation."""
+        return {nation_id: position for position, (_, nation_id) in enumerate(self._keys, start=1)}
+
+
+class RankingService:
+    """In-memory economic, military and technology rankings.
+    Scores are the same ones calculate_rankings() uses: GDP, offensive + defensive
+    power, and the sum of technology levels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._loaded_at = None
+        self._overall = None  # [(nation_id, overall rank), ...] in rank order, rebuilt after score changes
+
+    def _load(self):
+        """Rebuild every index with one aggregate query per category."""
+        indexes = {category: ScoreIndex() for category in RANKING_CATEGORIES}
+
+        nation_ids = []
+        for nation_id, gdp in db.session.query(Nation.id, Nation.gdp).all():
+            nation_ids.append(nation_id)
+            indexes['economic'].update(nation_id, gdp)
+
+        military_power = db.session.query(
+            Military.nation_id,
+            func.sum(Military.offensive_power + Military.defensive_power)
+        ).group_by(Military.nation_id).all()
+        for nation_id, power in military_power:
+            indexes['military'].update(nation_id, power)
+
+        tech_levels = dict(db.session.query(TechnologyState.nation_id, TechnologyState.level_sum).all())
+        # Nations without a state row yet are summed from their Technology rows, without writing one
+        tech_levels.update(db.session.query(
+            Technology.nation_id,
+            func.sum(Technology.level)
+        ).outerjoin(
+            TechnologyState, TechnologyState.nation_id == Technology.nation_id
+        ).filter(TechnologyState.nation_id.is_(None)).group_by(Technology.nation_id).all())
+        for nation_id in nation_ids:
+            indexes['technology'].update(nation_id, tech_levels.get(nation_id, 0))
+
+        self._indexes = indexes
+        self._loaded_at = datetime.utcnow()
+        self._overall = None
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or datetime.utcnow() - self._loaded_at > INDEX_MAX_AGE:
+            self._load()
+
+    def invalidate(self):
+        """Force a rebuild on the next lookup (e.g. after a full ranking recompute)."""
+        with self._lock:
+            self._loaded_at = None
+
+    def update_score(self, category, nation_id, score):
+        """Set a nation's score in one ranking."""
+        with self._lock:
+            if self._loaded_at is None:
+                return  # Nothing loaded yet, the next lookup reads the new value from the database
+            self._indexes[category].update(nation_id, score)
+            self._overall = None
+
+    def adjust_score(self, category, nation_id, delta):
+        """Add `delta` to a nation's score in one ranking (e.g. +1 technology level)."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            index = self._indexes[category]
+            index.update(nation_id, (index.score(nation_id) or 0) + delta)
+            self._overall = None
+
+    def rank(self, category, nation_id):
+        with self._lock:
+            self._ensure_loaded()
+            return self._indexes[category].rank(nation_id)
+
+    def score(self, category, nation_id):
+        with self._lock:
+            self._ensure_loaded()
+            return self._indexes[category].score(nation_id)
+
+    def scores(self, category, nation_ids):
+        """Map nation_id -> score in one ranking, for several nations at once."""
+        with self._lock:
+            self._ensure_loaded()
+            index = self._indexes[category]
+            return {nation_id: index.score(nation_id) for nation_id in nation_ids}
+
+    def _overall_ranking(self):
+        """(nation_id, overall rank) of every nation ranked in all three categories,
+        best first. The overall rank is the average of the three, rounded up, as in
+        calculate_rankings(); ties are ordered by nation id."""
+        if self._overall is None:
+            economic, military, technology = (self._indexes[category].ranks() for category in RANKING_CATEGORIES)
+            self._overall = sorted(
+                (
+                    (nation_id, math.ceil((rank + military[nation_id] + technology[nation_id]) / 3))
+                    for nation_id, rank in economic.items()
+                    if nation_id in military and nation_id in technology
+                ),
+                key=lambda entry: (entry[1], entry[0])
+            )
+        return self._overall
+
+    def top(self, category, limit=10):
+        """Top (nation_id, score) pairs of a ranking; for 'overall' the second
+        value is the overall rank."""
+        with self._lock:
+            self._ensure_loaded()
+            if category == 'overall':
+                return self._overall_ranking()[:limit]
+            return self._indexes[category].top(limit)
+
+    def top_nations(self, category, limit=10):
+        """Top nations of a ranking as Nation objects, loaded in a single query."""
+        nation_ids = [nation_id for nation_id, _ in self.top(category, limit)]
+        if not nation_ids:
+            return []
+        nations = {n.id: n for n in Nation.query.filter(Nation.id.in_(nation_ids)).all()}
+        return [nations[nation_id] for nation_id in nation_ids if nation_id in nations]
+
+    def get_ranks(self, nation):
+        """Current economic, military, technology and overall rank of a nation.
+        Falls back to the stored rank columns for rankings the nation is not indexed in."""
+        with self._lock:
+            self._ensure_loaded()
+            if nation.id not in self._indexes['economic']:
+                # Nation created after the last rebuild
+                self._indexes['economic'].update(nation.id, nation.gdp)
+                self._overall = None
+            ranks = {category: self._indexes[category].rank(nation.id) for category in RANKING_CATEGORIES}
+
+        ranks['economic'] = ranks['economic'] or nation.economic_rank
+        ranks['military'] = ranks['military'] or nation.military_rank
+        ranks['technology'] = ranks['technology'] or nation.technology_rank
+
+        # Overall rank (average of all three), as in calculate_rankings()
+        ranks['overall'] = nation.overall_rank
+        if ranks['economic'] and ranks['military'] and ranks['technology']:
+            ranks['overall'] = math.ceil((ranks['economic'] + ranks['military'] + ranks['technology']) / 3)
+
+        return ranks
+
+
+# Shared instance used by routes and handlers
+ranking_service = RankingService()
@@ -0,0 +1,208 @@
+"""
+Sparse store for diplomatic relations.
+
+The relation between two nations is its alliance/war baseline plus a stored part:
+an accumulated daily drift and the temporary modifiers left by diplomatic actions.
+Only pairs with a stored part get a NationRelation row, keyed by (low id, high id),
+so the daily update touches the stored pairs with a few bulk statements instead
+of visiting every pair of nations.
+"""
+from datetime import datetime
+import random
+from sqlalchemy import and_, bindparam, delete, exists, func, or_, update
+from app import db
+from models import NationRelation, RelationModifier, RelationAction
+
+# Daily drift of a stored relation, in relation points
+DRIFT_RANGE = (-2, 2)
+
+def pair_key(nation_id, other_id):
+    """(low id, high id) key of an unordered pair of nations"""
+    return (nation_id, other_id) if nation_id < other_id else (other_id, nation_id)
+
+def _pair_filter(model, nation_id, other_id):
+    low, high = pair_key(nation_id, other_id)
+    return and_(model.nation_low_id == low, model.nation_high_id == high)
+
+def get_stored_relation(nation_id, other_id, now=None):
+    """Stored drift, active modifiers and active actions between two nations"""
+    if now is None:
+        now = datetime.utcnow()
+
+    relation = db.session.get(NationRelation, pair_key(nation_id, other_id))
+    modifiers = RelationModifier.query.filter(
+        _pair_filter(RelationModifier, nation_id, other_id),
+        RelationModifier.expires_at > now
+    ).order_by(RelationModifier.id).all()
+    actions = RelationAction.query.filter(
+        _pair_filter(RelationAction, nation_id, other_id),
+        RelationAction.end_date > now
+    ).order_by(RelationAction.id).all()
+
+    return {
+        "drift": relation.drift if relation and relation.drift else 0.0,
+        "modifiers": [
+            {"source": modifier.source, "value": modifier.value, "expiry": modifier.expires_at}
+            for modifier in modifiers
+        ],
+        "active_actions": [
+            {
+                "action_id": action.action_id,
+                "start_date": action.start_date,
+                "end_date": action.end_date,
+                "initiator_id": action.initiator_id
+            }
+            for action in actions
+        ]
+    }
+
+def get_stored_relations(nation_id, now=None):
+    """Map other nation id -> stored drift, active modifiers and active actions for every
+    stored pair involving a nation, in three queries (bulk form of get_stored_relation)"""
+    if now is None:
+        now = datetime.utcnow()
+
+    def other_of(low, high):
+        return high if low == nation_id else low
+
+    relations = {}
+    def relation_for(other_id):
+        return relations.setdefault(other_id, {"drift": 0.0, "modifiers": [], "active_actions": []})
+
+    for relation in NationRelation.query.filter(
+        or_(NationRelation.nation_low_id == nation_id, NationRelation.nation_high_id == nation_id)
+    ):
+        relation_for(other_of(relation.nation_low_id, relation.nation_high_id))["drift"] = relation.drift or 0.0
+
+    for modifier in RelationModifier.query.filter(
+        or_(RelationModifier.nation_low_id == nation_id, RelationModifier.nation_high_id == nation_id),
+        RelationModifier.expires_at > now
+    ).order_by(RelationModifier.id):
+        relation_for(other_of(modifier.nation_low_id, modifier.nation_high_id))["modifiers"].append(
+            {"source": modifier.source, "value": modifier.value, "expiry": modifier.expires_at}
+        )
+
+    for action in RelationAction.query.filter(
+        or_(RelationAction.nation_low_id == nation_id, RelationAction.nation_high_id == nation_id),
+        RelationAction.end_date > now
+    ).order_by(RelationAction.id):
+        relation_for(other_of(action.nation_low_id, action.nation_high_id))["active_actions"].append({
+            "action_id": action.action_id,
+            "start_date": action.start_date,
+            "end_date": action.end_date,
+            "initiator_id": action.initiator_id
+        })
+
+    return relations
+
+def get_relation_adjustments(nation_id, now=None):
+    """Map other nation id -> stored relation adjustment (drift + active modifiers)
+    for every stored pair involving a nation, in two queries"""
+    if now is None:
+        now = datetime.utcnow()
+
+    adjustments = {}
+    for low, high, drift in db.session.query(
+        NationRelation.nation_low_id, NationRelation.nation_high_id, NationRelation.drift
+    ).filter(or_(NationRelation.nation_low_id == nation_id, NationRelation.nation_high_id == nation_id)):
+        other_id = high if low == nation_id else low
+        adjustments[other_id] = drift or 0.0
+
+    for low, high, total in db.session.query(
+        RelationModifier.nation_low_id, RelationModifier.nation_high_id, func.sum(RelationModifier.value)
+    ).filter(
+        or_(RelationModifier.nation_low_id == nation_id, RelationModifier.nation_high_id == nation_id),
+        RelationModifier.expires_at > now
+    ).group_by(RelationModifier.nation_low_id, RelationModifier.nation_high_id):
+        other_id = high if low == nation_id else low
+        adjustments[other_id] = adjustments.get(other_id, 0.0) + (total or 0.0)
+
+    return adjustments
+
+def record_relation_change(initiator_id, target_id, source, value, expires_at,
+                           action_id=None, action_end=None, now=None):
+    """Store a relation modifier (and the action in progress, if it has a duration)
+    between two nations. Does not commit."""
+    if now is None:
+        now = datetime.utcnow()
+    low, high = pair_key(initiator_id, target_id)
+
+    relation = db.session.get(NationRelation, (low, high))
+    if relation is None:
+        db.session.add(NationRelation(nation_low_id=low, nation_high_id=high, drift=0.0, updated_at=now))
+
+    db.session.add(RelationModifier(
+        nation_low_id=low,
+        nation_high_id=high,
+        source=source,
+        value=value,
+        expires_at=expires_at
+    ))
+    if action_id is not None and action_end is not None:
+        db.session.add(RelationAction(
+            nation_low_id=low,
+            nation_high_id=high,
+            action_id=action_id,
+            initiator_id=initiator_id,
+            start_date=now,
+            end_date=action_end
+        ))
+
+def update_relations(now=None):
+    """Daily relation update: drop expired modifiers and actions, apply the random
+    drift to every stored pair and forget pairs that are back to the default.
+    Pairs without a row have nothing stored and are not visited. Does not commit."""
+    if now is None:
+        now = datetime.utcnow()
+
+    expired_modifiers = db.session.execute(
+        delete(RelationModifier).where(RelationModifier.expires_at <= now)
+    ).rowcount
+    expired_actions = db.session.execute(
+        delete(RelationAction).where(RelationAction.end_date <= now)
+    ).rowcount
+
+    # One executemany for the drift of every stored pair
+    drifts = [
+        {
+            "b_low": low,
+            "b_high": high,
+            "b_drift": max(-100.0, min(100.0, (drift or 0.0) + random.randint(*DRIFT_RANGE)))
+        }
+        for low, high, drift in db.session.query(
+            NationRelation.nation_low_id, NationRelation.nation_high_id, NationRelation.drift
+        )
+    ]
+    if drifts:
+        relation_table = NationRelation.__table__
+        db.session.execute(
+            update(relation_table)
+            .where(
+                relation_table.c.nation_low_id == bindparam("b_low"),
+                relation_table.c.nation_high_id == bindparam("b_high")
+            )
+            .values(drift=bindparam("b_drift"), updated_at=now),
+            drifts
+        )
+
+    # Pairs with no drift and nothing active are back to the default relation
+    forgotten = db.session.execute(
+        delete(NationRelation).where(
+            NationRelation.drift == 0,
+            ~exists().where(
+                RelationModifier.nation_low_id == NationRelation.nation_low_id,
+                RelationModifier.nation_high_id == NationRelation.nation_high_id
+            ),
+            ~exists().where(
+                RelationAction.nation_low_id == NationRelation.nation_low_id,
+                RelationAction.nation_high_id == NationRelation.nation_high_id
+            )
+        )
+    ).rowcount
+
+    return {
+        "relations_updated": len(drifts),
+        "relations_removed": forgotten,
+        "modifiers_expired": expired_modifiers,
+        "actions_expired": expired_actions
+    }
@@ -0,0 +1,104 @@
+"""
+Research completion queue.
+
+Pending research completions are kept in a min-heap keyed by estimated_completion.
+A single one-shot scheduler job is armed for the earliest completion, so the
+scheduler only wakes up when a research actually finishes, and every research
+due at that point is completed with one bulk UPDATE.
+"""
+from datetime import datetime
+import heapq
+import logging
+import threading
+from apscheduler.triggers.date import DateTrigger
+from app import db
+from models import Technology
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_JOB_ID = 'complete_research_job'
+
+class ResearchCompletionQueue:
+    """Min-heap of (estimated_completion, technology_id) for research in progress.
+    The database stays the source of truth: stale entries (cancelled or restarted
+    research) simply match nothing when they are popped."""
+
+    def __init__(self):
+        self._heap = []
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._app = None
+
+    def start(self, scheduler, app):
+        """Attach to the background scheduler and load the pending research"""
+        self._scheduler = scheduler
+        self._app = app
+        self.sync()
+
+    def sync(self):
+        """Rebuild the heap from the database (picks up research started by other processes)"""
+        if self._app is None:
+            return
+        with self._app.app_context():
+            pending = db.session.query(Technology.estimated_completion, Technology.id).filter(
+                Technology.researching == True,
+                Technology.estimated_completion.isnot(None)
+            ).all()
+        with self._lock:
+            self._heap = [tuple(entry) for entry in pending]
+            heapq.heapify(self._heap)
+            self._arm()
+
+    def schedule(self, technology_id, estimated_completion):
+        """Add a research completion, re-arming the job if it is now the earliest"""
+        with self._lock:
+            heapq.heappush(self._heap, (estimated_completion, technology_id))
+            if self._heap[0] == (estimated_completion, technology_id):
+                self._arm()
+
+    def pop_due(self, now=None):
+        """Remove and return the ids of every entry due by `now`"""
+        if now is None:
+            now = datetime.utcnow()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    def _arm(self):
+        """Point the one-shot completion job at the earliest pending completion"""
+        if self._scheduler is None:
+            return
+        if not self._heap:
+            if self._scheduler.get_job(COMPLETION_JOB_ID):
+                self._scheduler.remove_job(COMPLETION_JOB_ID)
+            return
+        # Overdue entries (e.g. after a restart) run right away instead of being missed
+        run_date = max(self._heap[0][0], datetime.utcnow())
+        self._scheduler.add_job(
+            func=self._complete_due,
+            trigger=DateTrigger(run_date=run_date, timezone='UTC'),
+            id=COMPLETION_JOB_ID,
+            name='Complete due research',
+            replace_existing=True,
+            misfire_grace_time=None
+        )
+
+    def _complete_due(self):
+        from utils.technology_handler import complete_due_research
+
+        now = datetime.utcnow()
+        due_ids = self.pop_due(now)
+        try:
+            with self._app.app_context():
+                completed = complete_due_research(now, technology_ids=due_ids)
+                logger.info(f"Completed {completed} research projects.")
+        except Exception as e:
+            logger.error(f"Error completing research: {str(e)}")
+        with self._lock:
+            self._arm()
+
+
+# Shared instance used by the scheduler and the technology handlers
+research_queue = ResearchCompletionQueue()
@@ -0,0 +1,161 @@
+"""
+Bulk resource rate reconciliation.
+
+Resource amounts accrue lazily from the rate snapshot stored on each Resource
+row (see Resource.current_amounts), so the hourly job no longer rewrites every
+row. It recomputes the rates of every nation in a fixed number of queries and
+only settles and rewrites the rows whose rates are out of date, catching any
+rate input that changed without calling refresh_resource_rates().
+"""
+from datetime import datetime
+from sqlalchemy import update
+from app import db
+from models import Nation, Resource, TechnologyState, Military, RESOURCE_RATE_COLUMNS, accrue_amounts
+from utils.tech_state import ensure_technology_states
+from utils.game_logic import (
+    calculate_production_rate,
+    calculate_consumption_rate,
+    calculate_military_consumption_factor
+)
+
+PRODUCED_RESOURCES = ['raw_materials', 'food', 'energy', 'technology', 'currency']
+CONSUMED_RESOURCES = ['raw_materials', 'food', 'energy']
+
+def _load_resource_columns():
+    """Load one Resource row per nation joined with the nation's population data, as columns."""
+    rows = db.session.query(
+        Resource.id,
+        Resource.nation_id,
+        Resource.last_updated,
+        Resource.raw_materials,
+        Resource.food,
+        Resource.energy,
+        Resource.technology_points,
+        Resource.currency,
+        *[getattr(Resource, column) for column in RESOURCE_RATE_COLUMNS],
+        Nation.agriculture_population,
+        Nation.industry_population,
+        Nation.energy_population,
+        Nation.research_population,
+        Nation.total_population
+    ).join(Nation, Nation.id == Resource.nation_id).order_by(Resource.id).all()
+
+    # Nation code only ever touches the first resource row of a nation
+    seen = set()
+    first_rows = []
+    for row in rows:
+        if row.nation_id not in seen:
+            seen.add(row.nation_id)
+            first_rows.append(row)
+
+    names = [
+        'id', 'nation_id', 'last_updated', 'raw_materials', 'food', 'energy',
+        'technology_points', 'currency', *RESOURCE_RATE_COLUMNS, 'agriculture_population',
+        'industry_population', 'energy_population', 'research_population', 'total_population'
+    ]
+    if not first_rows:
+        return {name: [] for name in names}
+
+    return {name: list(values) for name, values in zip(names, zip(*first_rows))}
+
+def _load_military_factors():
+    """Map nation_id -> military consumption factor, using the first Military row of each nation."""
+    rows = db.session.query(
+        Military.nation_id,
+        Military.infantry,
+        Military.tanks,
+        Military.aircraft,
+        Military.navy,
+        Military.missiles
+    ).order_by(Military.id).all()
+
+    factors = {}
+    for nation_id, infantry, tanks, aircraft, navy, missiles in rows:
+        if nation_id not in factors:
+            factors[nation_id] = calculate_military_consumption_factor(infantry, tanks, aircraft, navy, missiles)
+    return factors
+
+def _load_technology_modifiers():
+    """Map nation_id -> (production multiplier, consumption efficiency) from the technology states."""
+    ensure_technology_states()
+    rows = db.session.query(
+        TechnologyState.nation_id,
+        TechnologyState.production_multiplier,
+        TechnologyState.consumption_efficiency
+    ).all()
+
+    multipliers = {}
+    efficiencies = {}
+    for nation_id, production_multiplier, consumption_efficiency in rows:
+        multipliers[nation_id] = production_multiplier
+        efficiencies[nation_id] = consumption_efficiency
+    return multipliers, efficiencies
+
+def run_resource_tick(now=None):
+    """Bring every nation's stored rates up to date in one transaction.
+    Rows whose rates did not change are left untouched."""
+    if now is None:
+        now = datetime.utcnow()
+
+    columns = _load_resource_columns()
+    military_factors = _load_military_factors()
+    tech_multipliers, tech_efficiencies = _load_technology_modifiers()
+
+    updates = []
+    for i, nation_id in enumerate(columns['nation_id']):
+        tech_multiplier = tech_multipliers.get(nation_id, 1.2)
+        tech_efficiency = tech_efficiencies.get(nation_id, 1.0)
+        military_factor = military_factors.get(nation_id, 1.0)
+
+        production = {
+            resource_type: calculate_production_rate(
+                resource_type,
+                columns['agriculture_population'][i],
+                columns['industry_population'][i],
+                columns['energy_population'][i],
+                columns['research_population'][i],
+                columns['total_population'][i],
+                tech_multiplier
+            )
+            for resource_type in PRODUCED_RESOURCES
+        }
+        consumption = {
+            resource_type: calculate_consumption_rate(
+                resource_type, columns['total_population'][i], military_factor, tech_efficiency
+            )
+            for resource_type in CONSUMED_RESOURCES
+        }
+
+        rates = {
+            'raw_materials_production': production['raw_materials'],
+            'food_production': production['food'],
+            'energy_production': production['energy'],
+            'technology_production': production['technology'],
+            'currency_production': production['currency'],
+            'raw_materials_consumption': consumption['raw_materials'],
+            'food_consumption': consumption['food'],
+            'energy_consumption': consumption['energy']
+        }
+        if all(columns[column][i] == rate for column, rate in rates.items()):
+            continue
+
+        # Settle the amounts at the old rates before switching to the new ones
+        elapsed_hours = 0
+        last_updated = columns['last_updated'][i]
+        if last_updated:
+            elapsed_hours = max(0, (now - last_updated).total_seconds() / 3600)
+        snapshot = {column: values[i] for column, values in columns.items()}
+
+        updates.append({
+            'id': columns['id'][i],
+            **rates,
+            **accrue_amounts(snapshot, elapsed_hours),
+            'last_updated': now
+        })
+
+    if updates:
+        # Bulk UPDATE by primary key, executed as a single executemany
+        db.session.execute(update(Resource), updates)
+    db.session.commit()
+
+    return {"updated_count": len(updates), "nation_count": len(columns['nation_id'])}
@@ -0,0 +1,134 @@
+"""
+Resource history time series.
+
+Every resource tick appends one 'hour' snapshot per nation (the five accruing
+resources) to the resource_snapshot table. Completed days and weeks are rolled up
+into 'day' and 'week' averages, and each tier is pruned after its retention period.
+Range queries read a single (nation_id, tier, ts) primary key range, picking the
+coarsest tier that still gives a useful number of points for the requested window.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, literal, select
+from app import db
+from models import Resource, ResourceSnapshot, ACCRUING_RESOURCES, RESOURCE_SNAPSHOT_COLUMNS, accrue_amounts
+
+HISTORY_RESOURCES = list(ACCRUING_RESOURCES)
+
+# tier -> (bucket length, source tier it is rolled up from, retention)
+TIERS = {
+    'hour': (timedelta(hours=1), None, timedelta(days=14)),
+    'day': (timedelta(days=1), 'hour', timedelta(days=400)),
+    'week': (timedelta(weeks=1), 'day', timedelta(weeks=260)),
+}
+
+# Longest window served by each tier, finest first
+TIER_WINDOWS = [
+    ('hour', timedelta(days=7)),
+    ('day', timedelta(days=180)),
+    ('week', None),
+]
+
+def bucket_start(ts, tier):
+    """Start of the tier bucket containing `ts` (weeks start on Monday)"""
+    start = ts.replace(minute=0, second=0, microsecond=0)
+    if tier in ('day', 'week'):
+        start = start.replace(hour=0)
+    if tier == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+def record_resource_snapshots(now=None):
+    """Append the current resource amounts of every nation to the hourly tier.
+    Recording twice in the same hour replaces that hour's snapshot. Does not commit."""
+    if now is None:
+        now = datetime.utcnow()
+    ts = bucket_start(now, 'hour')
+
+    rows = db.session.query(
+        Resource.nation_id,
+        Resource.last_updated,
+        *[getattr(Resource, column) for column in RESOURCE_SNAPSHOT_COLUMNS]
+    ).order_by(Resource.id).all()
+
+    snapshots = {}
+    for nation_id, last_updated, *values in rows:
+        # Nation code only ever touches the first resource row of a nation
+        if nation_id in snapshots:
+            continue
+        elapsed_hours = max(0.0, (now - last_updated).total_seconds() / 3600) if last_updated else 0.0
+        amounts = accrue_amounts(dict(zip(RESOURCE_SNAPSHOT_COLUMNS, values)), elapsed_hours)
+        snapshots[nation_id] = {"nation_id": nation_id, "tier": 'hour', "ts": ts, **amounts}
+
+    db.session.execute(delete(ResourceSnapshot).where(ResourceSnapshot.tier == 'hour', ResourceSnapshot.ts == ts))
+    if snapshots:
+        db.session.execute(ResourceSnapshot.__table__.insert(), list(snapshots.values()))
+    return len(snapshots)
+
+def _roll_up_bucket(tier, source, start, end):
+    """Average the source tier rows of [start, end) into one row per nation"""
+    averages = select(
+        ResourceSnapshot.nation_id,
+        literal(tier),
+        literal(start, db.DateTime),
+        *[func.avg(getattr(ResourceSnapshot, resource_type)) for resource_type in HISTORY_RESOURCES]
+    ).where(
+        ResourceSnapshot.tier == source,
+        ResourceSnapshot.ts >= start,
+        ResourceSnapshot.ts < end
+    ).group_by(ResourceSnapshot.nation_id)
+
+    db.session.execute(
+        ResourceSnapshot.__table__.insert().from_select(['nation_id', 'tier', 'ts', *HISTORY_RESOURCES], averages)
+    )
+
+def roll_up_resource_history(now=None):
+    """Roll completed buckets up into the coarser tiers and prune expired rows. Does not commit."""
+    if now is None:
+        now = datetime.utcnow()
+
+    for tier, (period, source, retention) in TIERS.items():
+        if source is not None:
+            # Resume after the last rolled-up bucket; the bucket in progress is left alone
+            last = db.session.query(func.max(ResourceSnapshot.ts)).filter(ResourceSnapshot.tier == tier).scalar()
+            if last is not None:
+                start = last + period
+            else:
+                first = db.session.query(func.min(ResourceSnapshot.ts)).filter(ResourceSnapshot.tier == source).scalar()
+                start = bucket_start(first, tier) if first is not None else None
+
+            if start is not None:
+                current = bucket_start(now, tier)
+                while start < current:
+                    _roll_up_bucket(tier, source, start, start + period)
+                    start += period
+
+        db.session.execute(delete(ResourceSnapshot).where(
+            ResourceSnapshot.tier == tier,
+            ResourceSnapshot.ts < now - retention
+        ))
+
+def choose_tier(window):
+    """Coarsest tier that still gives enough points for a window length"""
+    for tier, max_window in TIER_WINDOWS:
+        if max_window is None or window <= max_window:
+            return tier
+
+def get_resource_history(nation_id, resource_type, start, end=None):
+    """(tier, [(ts, value), ...]) of one resource of a nation between start and end.
+    Falls back to finer tiers while the chosen one has no data yet (e.g. a new nation)."""
+    if end is None:
+        end = datetime.utcnow()
+    column = getattr(ResourceSnapshot, resource_type)
+
+    tiers = [tier for tier, _ in TIER_WINDOWS]
+    chosen = choose_tier(end - start)
+    for tier in reversed(tiers[:tiers.index(chosen) + 1]):
+        rows = db.session.query(ResourceSnapshot.ts, column).filter(
+            ResourceSnapshot.nation_id == nation_id,
+            ResourceSnapshot.tier == tier,
+            ResourceSnapshot.ts >= start,
+            ResourceSnapshot.ts <= end
+        ).order_by(ResourceSnapshot.ts).all()
+        if rows:
+            return tier, rows
+    return chosen, []
@@ -1,38 +1,31 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from flask import current_app
+import atexit
 import logging
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from app import db
-from models import Nation, Resource, MarketItem, Trade, Technology, Military, User, SpyMission, DeployedSpy
-from utils.game_logic import update_resources, calculate_rankings
-from utils.technology_handler import update_research_progress
+from models import Technology, Military, SpyMission, DeployedSpy
+from utils.game_logic import calculate_rankings
+from utils.resource_engine import run_resource_tick
+from utils.resource_history import record_resource_snapshots, roll_up_resource_history
+from utils.research_queue import research_queue
+from utils.order_book import order_book
+from utils.matching_engine import market_engine
+from utils.market_agents import market_agents
+from utils.price_history import prune_price_candles
 from utils.advanced_espionage import check_active_missions, update_spy_cover_and_intel
 from utils.news_generator import generate_daily_news
+from utils.diplomacy_handler import update_diplomatic_relations
+from utils.spy_reports import prune_spy_reports
+from utils.trade_settlement import expire_market_orders
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
-def update_research_progress_wrapper():
-    """Wrapper function to call update_research_progress with app context"""
-    try:
-        from flask import current_app as app
-        with app.app_context():
-            logger.info("Updating research progress for all nations.")
-            try:
-                result = update_research_progress()
-                logger.info(f"Research progress updated: {result['updated_count']} updated, {result['completed_count']} completed.")
-            except Exception as e:
-                logger.error(f"Error updating research progress: {str(e)}")
-    except RuntimeError:
-        logger.error("Failed to get application context for research progress update.")
-
-def check_spy_missions_wrapper():
+def check_spy_missions_wrapper(app):
     """Wrapper function to check espionage missions with app context"""
     try:
-        from flask import current_app as app
         with app.app_context():
             logger.info("Checking for completed spy missions.")
             try:
@@ -43,10 +36,9 @@ def check_spy_missions_wrapper():
     except RuntimeError:
         logger.error("Failed to get application context for spy missions check.")
 
-def update_spy_status_wrapper():
+def update_spy_status_wrapper(app):
     """Wrapper function to update spy status with app context"""
     try:
-        from flask import current_app as app
         with app.app_context():
             logger.info("Updating spy cover and intel levels.")
             try:
@@ -80,6 +72,7 @@ def init_scheduler(app):
     # Update resources for all nations every hour
     scheduler.add_job(
         func=update_all_resources,
+        args=[app],
         trigger=IntervalTrigger(hours=1),
         id='update_resources_job',
         name='Update resources for all nations',
@@ -89,6 +82,7 @@ def init_scheduler(app):
     # Update rankings every 6 hours
     scheduler.add_job(
         func=update_rankings,
+        args=[app],
         trigger=IntervalTrigger(hours=6),
         id='update_rankings_job',
         name='Update nation rankings',
@@ -98,24 +92,26 @@ def init_scheduler(app):
     # Clean up expired market listings every hour
     scheduler.add_job(
         func=cleanup_market,
+        args=[app],
         trigger=IntervalTrigger(hours=1),
         id='cleanup_market_job',
         name='Clean up expired market listings',
         replace_existing=True
     )
     
-    # Update research progress every minute to make progress bars accurate
+    # Re-sync pending research completions (research started in other processes)
     scheduler.add_job(
-        func=update_research_progress_wrapper,
-        trigger=IntervalTrigger(minutes=1),
-        id='update_research_progress_job',
-        name='Update research progress for all nations',
+        func=research_queue.sync,
+        trigger=IntervalTrigger(minutes=10),
+        id='sync_research_queue_job',
+        name='Sync research completion queue',
         replace_existing=True
     )
     
     # Check for completed spy missions every 15 minutes
     scheduler.add_job(
         func=check_spy_missions_wrapper,
+        args=[app],
         trigger=IntervalTrigger(minutes=15),
         id='check_spy_missions_job',
         name='Check completed spy missions',
@@ -125,18 +121,42 @@ def init_scheduler(app):
     # Update spy cover strength and intel level every hour
     scheduler.add_job(
         func=update_spy_status_wrapper,
+        args=[app],
         trigger=IntervalTrigger(hours=1),
         id='update_spy_status_job',
         name='Update spy status',
         replace_existing=True
     )
     
-    # Bot market activity every 3 hours
+    # Bot market activity every 5 minutes; a run still going is not overlapped
     scheduler.add_job(
         func=bot_market_activity,
-        trigger=IntervalTrigger(hours=3),
+        args=[app],
+        trigger=IntervalTrigger(minutes=5),
         id='bot_market_activity_job',
         name='Bot market activity',
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    
+    # Daily drift and expiry of the stored diplomatic relations
+    scheduler.add_job(
+        func=update_relations_wrapper,
+        args=[app],
+        trigger=IntervalTrigger(hours=24),
+        id='update_diplomatic_relations_job',
+        name='Update diplomatic relations',
+        replace_existing=True
+    )
+    
+    # Keep only the latest intel reports per target and report type
+    scheduler.add_job(
+        func=prune_spy_reports_wrapper,
+        args=[app],
+        trigger=IntervalTrigger(hours=24),
+        id='prune_spy_reports_job',
+        name='Prune old spy reports',
         replace_existing=True
     )
     
@@ -153,32 +173,67 @@ def init_scheduler(app):
     scheduler.start()
     logger.info("Scheduler started.")
     
-    # Shut down the scheduler when the app shuts down
-    @app.teardown_appcontext
-    def shutdown_scheduler(exception=None):
-        try:
-            if scheduler.running:
-                scheduler.shutdown(wait=False)
-                logger.info("Scheduler shut down successfully.")
-        except Exception as e:
-            logger.error(f"Error shutting down scheduler: {str(e)}")
+    # Research completions wake the scheduler only when the next research finishes
+    research_queue.start(scheduler, app)
+    
+    # Shut down the scheduler once, when the process exits. A teardown_appcontext
+    # hook would stop it at the end of the first request or job.
+    atexit.register(shutdown_scheduler, scheduler)
 
-def update_all_resources():
+def shutdown_scheduler(scheduler):
+    """Stop the background scheduler at process exit"""
+    try:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+            logger.info("Scheduler shut down successfully.")
+    except Exception as e:
+        logger.error(f"Error shutting down scheduler: {str(e)}")
+
+def update_all_resources(app):
     """Update resources for all nations"""
-    with current_app.app_context():
+    with app.app_context():
         logger.info("Updating resources for all nations.")
-        nations = Nation.query.all()
-        for nation in nations:
-            try:
-                update_resources(nation)
-            except Exception as e:
-                logger.error(f"Error updating resources for nation {nation.id}: {str(e)}")
-        
-        logger.info(f"Resources updated for {len(nations)} nations.")
+        try:
+            now = datetime.utcnow()
+            result = run_resource_tick(now)
+            logger.info(f"Resource rates refreshed for {result['updated_count']} of {result['nation_count']} nations.")
+            
+            # Append this hour to the resource history and roll up completed days/weeks
+            snapshot_count = record_resource_snapshots(now)
+            roll_up_resource_history(now)
+            db.session.commit()
+            logger.info(f"Resource history recorded for {snapshot_count} nations.")
+        except Exception as e:
+            logger.error(f"Error updating resources: {str(e)}")
+            db.session.rollback()
+
+def update_relations_wrapper(app):
+    """Apply the daily diplomatic relation update"""
+    with app.app_context():
+        logger.info("Updating diplomatic relations.")
+        try:
+            result = update_diplomatic_relations()
+            logger.info(f"Diplomatic relations updated: {result['relations_updated']} stored relations, "
+                        f"{result['modifiers_expired']} modifiers and {result['actions_expired']} actions expired.")
+        except Exception as e:
+            logger.error(f"Error updating diplomatic relations: {str(e)}")
+            db.session.rollback()
+
+def prune_spy_reports_wrapper(app):
+    """Apply the spy report retention limit"""
+    with app.app_context():
+        logger.info("Pruning old spy reports.")
+        try:
+            deleted = prune_spy_reports()
+            db.session.commit()
+            logger.info(f"Deleted {deleted} spy reports past the retention limit.")
+        except Exception as e:
+            logger.error(f"Error pruning spy reports: {str(e)}")
+            db.session.rollback()
 
-def update_rankings():
+def update_rankings(app):
     """Update rankings for all nations"""
-    with current_app.app_context():
+    with app.app_context():
         logger.info("Updating nation rankings.")
         try:
             calculate_rankings()
@@ -186,163 +241,44 @@ def update_rankings():
         except Exception as e:
             logger.error(f"Error updating rankings: {str(e)}")
 
-def cleanup_market():
+def cleanup_market(app):
     """Clean up expired market listings"""
-    with current_app.app_context():
+    with app.app_context():
         logger.info("Cleaning up expired market listings.")
         now = datetime.utcnow()
         
         try:
-            # Find expired listings
-            expired_listings = MarketItem.query.filter(
-                MarketItem.expires_at < now,
-                MarketItem.is_active == True
-            ).all()
-            
-            logger.info(f"Found {len(expired_listings)} expired listings.")
+            # Deactivate expired listings and buy orders and refund their sellers and
+            # bidders, summed per nation in SQL
+            listing_count, bid_count = expire_market_orders(now)
+            logger.info(f"Expired {listing_count} listings and {bid_count} buy orders.")
             
-            for listing in expired_listings:
-                # Return resources to seller
-                seller_resources = Resource.query.filter_by(nation_id=listing.seller_id).first()
-                if seller_resources:
-                    # Add the resources back to the seller's inventory
-                    current_amount = getattr(seller_resources, listing.resource_type)
-                    setattr(seller_resources, listing.resource_type, current_amount + listing.quantity)
-                
-                # Mark listing as inactive
-                listing.is_active = False
+            # Drop candles past the retention of their interval
+            pruned = prune_price_candles(now)
+            logger.info(f"Pruned {pruned} old price candles.")
             
             db.session.commit()
+            order_book.refresh()
+            market_engine.reload()
             logger.info("Expired listings processed successfully.")
         except Exception as e:
             logger.error(f"Error cleaning up market listings: {str(e)}")
             db.session.rollback()
 
-def bot_market_activity():
-    """AI bots interact with the market - create listings and buy underpriced resources"""
-    with current_app.app_context():
+def bot_market_activity(app):
+    """AI nations trade on the market through the agent engine"""
+    with app.app_context():
         logger.info("Running bot market activity.")
-        now = datetime.utcnow()
         
         try:
-            # Get AI-controlled nations (those not linked to users)
-            ai_nations = Nation.query.filter(
-                ~Nation.user_id.in_(db.session.query(User.id))
-            ).all()
-            
-            if not ai_nations:
-                logger.info("No AI nations found.")
-                return
-                
-            logger.info(f"Found {len(ai_nations)} AI nations for market activity.")
-            
-            # Current market average prices
-            avg_prices = {}
-            for resource_type in ['raw_materials', 'food', 'energy']:
-                trades = Trade.query.filter_by(resource_type=resource_type).order_by(
-                    Trade.trade_date.desc()).limit(10).all()
-                
-                if trades:
-                    avg_price = sum(trade.price_per_unit for trade in trades) / len(trades)
-                    # Add 10% variance
-                    avg_prices[resource_type] = avg_price * (0.9 + (random.random() * 0.2))
-                else:
-                    # Fallback prices if no trades exist
-                    default_prices = {
-                        'raw_materials': 10.0,
-                        'food': 15.0,
-                        'energy': 20.0
-                    }
-                    avg_prices[resource_type] = default_prices[resource_type]
-            
-            # Some AI nations will create listings
-            for nation in random.sample(ai_nations, min(3, len(ai_nations))):
-                resources = Resource.query.filter_by(nation_id=nation.id).first()
-                if not resources:
-                    continue
-                    
-                # Choose a random resource to sell
-                resource_type = random.choice(['raw_materials', 'food', 'energy'])
-                current_amount = getattr(resources, resource_type, 0)
-                
-                # Only sell if they have enough (at least 20% of production rate)
-                min_amount = getattr(resources, f"{resource_type}_production") * 0.2
-                if current_amount > min_amount:
-                    # Sell between 10-30% of current amount
-                    quantity = current_amount * (0.1 + (random.random() * 0.2))
-                    # Random price around average (+/- 15%)
-                    price_per_unit = avg_prices[resource_type] * (0.85 + (random.random() * 0.3))
-                    
-                    # Create listing
-                    listing = MarketItem(
-                        seller_id=nation.id,
-                        resource_type=resource_type,
-                        quantity=quantity,
-                        price_per_unit=price_per_unit,
-                        total_price=quantity * price_per_unit,
-                        created_at=now,
-                        expires_at=now + timedelta(days=1),
-                        is_active=True
-                    )
-                    
-                    # Deduct resources
-                    setattr(resources, resource_type, current_amount - quantity)
-                    
-                    db.session.add(listing)
-                    logger.info(f"AI nation {nation.name} created listing for {quantity} {resource_type}")
-            
-            # Some AI nations will buy underpriced listings
-            active_listings = MarketItem.query.filter_by(is_active=True).all()
-            for nation in random.sample(ai_nations, min(2, len(ai_nations))):
-                resources = Resource.query.filter_by(nation_id=nation.id).first()
-                if not resources or resources.currency < 1000:
-                    continue
-                
-                # Look for good deals (15% or more below average price)
-                good_deals = [
-                    listing for listing in active_listings
-                    if (listing.seller_id != nation.id and  # Don't buy own listings
-                        listing.price_per_unit < avg_prices[listing.resource_type] * 0.85 and
-                        listing.total_price < resources.currency * 0.5)  # Don't spend more than 50% of currency
-                ]
-                
-                if good_deals:
-                    # Buy a random good deal
-                    listing = random.choice(good_deals)
-                    seller_resources = Resource.query.filter_by(nation_id=listing.seller_id).first()
-                    
-                    if seller_resources:
-                        # Complete the transaction
-                        # Deduct currency from buyer
-                        resources.currency -= listing.total_price
-                        
-                        # Add currency to seller
-                        seller_resources.currency += listing.total_price
-                        
-                        # Add resources to buyer
-                        current_amount = getattr(resources, listing.resource_type)
-                        setattr(resources, listing.resource_type, current_amount + listing.quantity)
-                        
-                        # Mark listing as inactive
-                        listing.is_active = False
-                        
-                        # Create trade record
-                        trade = Trade(
-                            seller_id=listing.seller_id,
-                            buyer_id=nation.id,
-                            market_item_id=listing.id,
-                            resource_type=listing.resource_type,
-                            quantity=listing.quantity,
-                            price_per_unit=listing.price_per_unit,
-                            total_price=listing.total_price,
-                            trade_date=now
-                        )
-                        
-                        db.session.add(trade)
-                        logger.info(f"AI nation {nation.name} purchased {listing.quantity} {listing.resource_type}")
-            
-            db.session.commit()
+            # Every AI nation decides its orders at once; they are submitted in bulk batches
+            summary = market_agents.run()
+            logger.info(
+                f"{summary['agents']} AI nations placed {summary['placed']} orders "
+                f"({summary['rejected']} rejected), {summary['filled']:,.0f} units filled."
+            )
             logger.info("Bot market activity completed successfully.")
         except Exception as e:
             logger.error(f"Error during bot market activity: {str(e)}")
             db.session.rollback()
+            market_engine.reload()
@@ -0,0 +1,61 @@
+"""
+Spy report retention and cursor pagination.
+
+Reports are listed newest first by (report_date, id). A page cursor is the
+position of the last report shown, so reading the next page is an index range
+scan on ix_spy_report_listing however many reports a nation has. The retention
+job keeps only the latest SPY_REPORT_RETENTION reports a nation holds on each
+(target nation, report type), which bounds the table at nations x targets x types.
+"""
+from datetime import datetime
+from sqlalchemy import delete, func, select
+from app import db
+from models import SpyReport
+
+# Latest reports kept per (owner nation, target nation, report type)
+SPY_REPORT_RETENTION = 20
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+def encode_report_cursor(report):
+    """Opaque cursor pointing just after `report` in a newest-first listing"""
+    return f"{report.report_date.strftime(CURSOR_DATE_FORMAT)}-{report.id}"
+
+def decode_report_cursor(cursor):
+    """(report_date, id) of a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        date_part, id_part = cursor.split('-', 1)
+        return datetime.strptime(date_part, CURSOR_DATE_FORMAT), int(id_part)
+    except ValueError:
+        return None
+
+def reports_before(query, cursor):
+    """Restrict a newest-first report query to the reports after `cursor`"""
+    position = decode_report_cursor(cursor)
+    if position is None:
+        return query
+    report_date, report_id = position
+    return query.filter(
+        (SpyReport.report_date < report_date) |
+        ((SpyReport.report_date == report_date) & (SpyReport.id < report_id))
+    )
+
+def prune_spy_reports(keep=SPY_REPORT_RETENTION):
+    """Delete all but the latest `keep` reports of every (owner, target, type).
+    Returns the number of reports deleted; the caller commits."""
+    ranked = select(
+        SpyReport.id,
+        func.row_number().over(
+            partition_by=(SpyReport.nation_id, SpyReport.target_nation_id, SpyReport.report_type),
+            order_by=(SpyReport.report_date.desc(), SpyReport.id.desc())
+        ).label('position')
+    ).subquery()
+
+    result = db.session.execute(
+        delete(SpyReport)
+        .where(SpyReport.id.in_(select(ranked.c.id).where(ranked.c.position > keep)))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
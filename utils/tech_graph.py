@@ -0,0 +1,85 @@
+"""
+Compiled technology prerequisite graph.
+
+The technology tree in data/technologies.py is compiled once at import into a DAG:
+id/name maps, a prerequisite bitmask per technology and a topological tier order.
+Checking whether a nation can research a technology is then a single bitmask test
+against the set of technologies the nation has researched.
+"""
+from data.technologies import TECHNOLOGIES
+
+# Catalog lookups
+TECH_BY_ID = {tech["id"]: tech for tech in TECHNOLOGIES}
+TECH_ID_BY_NAME = {tech["name"]: tech["id"] for tech in TECHNOLOGIES}
+
+# One bit per technology, in catalog order
+TECH_BITS = {tech["id"]: 1 << index for index, tech in enumerate(TECHNOLOGIES)}
+
+def prerequisite_mask(prerequisite_ids):
+    """Bitmask of a list of catalog technology ids (unknown ids are ignored)"""
+    mask = 0
+    for prerequisite_id in prerequisite_ids:
+        mask |= TECH_BITS.get(prerequisite_id, 0)
+    return mask
+
+PREREQUISITE_MASKS = {tech["id"]: prerequisite_mask(tech["prerequisites"]) for tech in TECHNOLOGIES}
+
+def _compile_tiers():
+    """Topological order of the catalog (Kahn's algorithm) and the tier of each technology.
+    Tier 0 has no prerequisites, otherwise the tier is one above the highest prerequisite tier."""
+    dependents = {tech_id: [] for tech_id in TECH_BY_ID}
+    remaining = {}
+    for tech in TECHNOLOGIES:
+        prerequisites = [p for p in tech["prerequisites"] if p in TECH_BY_ID]
+        remaining[tech["id"]] = len(prerequisites)
+        for prerequisite_id in prerequisites:
+            dependents[prerequisite_id].append(tech["id"])
+
+    tiers = {}
+    order = [tech_id for tech_id, count in remaining.items() if count == 0]
+    for tech_id in order:
+        tiers[tech_id] = 0
+    for tech_id in order:  # order grows while it is walked
+        for dependent_id in dependents[tech_id]:
+            tiers[dependent_id] = max(tiers.get(dependent_id, 0), tiers[tech_id] + 1)
+            remaining[dependent_id] -= 1
+            if remaining[dependent_id] == 0:
+                order.append(dependent_id)
+
+    if len(order) != len(TECH_BY_ID):
+        cyclic = sorted(tech_id for tech_id, count in remaining.items() if count > 0)
+        raise ValueError(f"Technology prerequisites contain a cycle: {cyclic}")
+    return order, tiers
+
+TOPOLOGICAL_ORDER, TECH_TIERS = _compile_tiers()
+
+def get_catalog_id(tech_name):
+    """Catalog id of a technology by name"""
+    return TECH_ID_BY_NAME.get(tech_name)
+
+def parse_prerequisites(prerequisites_str):
+    """Catalog ids from a comma-separated prerequisites string"""
+    prerequisite_ids = []
+    for prerequisite_id in (prerequisites_str or "").split(','):
+        try:
+            prerequisite_ids.append(int(prerequisite_id))
+        except ValueError:
+            continue
+    return prerequisite_ids
+
+def researched_mask(technologies):
+    """Bitmask of the researched (level > 0) technologies of a nation"""
+    mask = 0
+    for tech in technologies:
+        if tech.level > 0:
+            mask |= TECH_BITS.get(tech.tech_id, 0)
+    return mask
+
+def prerequisites_met(tech, mask):
+    """True if every prerequisite of `tech` is in the researched `mask`"""
+    required = PREREQUISITE_MASKS.get(tech.tech_id, 0)
+    return required & mask == required
+
+def get_tier(tech):
+    """Tier of a nation's Technology row"""
+    return TECH_TIERS.get(tech.tech_id, 0)
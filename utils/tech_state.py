@@ -0,0 +1,133 @@
+"""
+Per-nation technology state.
+
+Each nation has one TechnologyState row holding its technology levels packed into
+a fixed-width byte array (indexed by catalog position) plus aggregate bonuses.
+The rows are rebuilt from plain column queries whenever technology levels change,
+and read by the hot paths instead of hydrating every Technology row.
+"""
+from datetime import datetime
+from app import db
+from models import Technology, TechnologyState
+from data.technologies import TECHNOLOGIES
+from utils.tech_graph import TECH_BITS, TECH_BY_ID
+
+# Catalog id -> position in the packed levels array
+TECH_INDEX = {tech["id"]: index for index, tech in enumerate(TECHNOLOGIES)}
+TECH_ID_BY_INDEX = [tech["id"] for tech in TECHNOLOGIES]
+LEVEL_SLOTS = len(TECHNOLOGIES)
+
+def _empty_state():
+    return {
+        'levels': bytearray(LEVEL_SLOTS),
+        'level_sum': 0,
+        'production_multiplier': 1.2,  # Same base bonus as get_nation_modifiers
+        'consumption_efficiency': 1.0,
+        'espionage_bonus': 0.0
+    }
+
+def _compute_states(nation_ids):
+    """State values of the given nations, computed from their Technology rows with one query"""
+    rows = db.session.query(
+        Technology.nation_id,
+        Technology.tech_id,
+        Technology.level
+    ).filter(Technology.nation_id.in_(nation_ids)).order_by(Technology.id).all()
+
+    states = {nation_id: _empty_state() for nation_id in nation_ids}
+    for nation_id, tech_id, level in rows:
+        level = level or 0
+        state = states[nation_id]
+        state['level_sum'] += level
+
+        index = TECH_INDEX.get(tech_id)
+        if index is not None:
+            state['levels'][index] = min(level, 255)
+
+        tech = TECH_BY_ID.get(tech_id)
+        if level > 0 and tech:
+            # Effect overrides come from the catalog (see the Technology properties)
+            if tech["category"] == 'Production':
+                state['production_multiplier'] *= tech.get('production_multiplier', 1.0)
+            elif tech["category"] == 'Efficiency':
+                state['consumption_efficiency'] *= tech.get('consumption_efficiency', 1.0)
+            espionage_bonus = tech.get('espionage_bonus', 0.0)
+            if espionage_bonus > 0:
+                state['espionage_bonus'] += espionage_bonus * level * 0.1
+    return states
+
+def _state_row(nation_id, values):
+    """TechnologyState row holding the computed values (not added to the session)"""
+    return TechnologyState(
+        nation_id=nation_id,
+        levels=bytes(values['levels']),
+        level_sum=values['level_sum'],
+        production_multiplier=values['production_multiplier'],
+        consumption_efficiency=values['consumption_efficiency'],
+        espionage_bonus=values['espionage_bonus'],
+        updated_at=datetime.utcnow()
+    )
+
+def new_technology_state(nation_id):
+    """State row of a nation created without technologies; the caller adds it to the session"""
+    return _state_row(nation_id, _empty_state())
+
+def rebuild_technology_states(nation_ids):
+    """Recompute the technology state of the given nations from their Technology rows.
+    Runs two queries and does not commit."""
+    nation_ids = list(set(nation_ids))
+    if not nation_ids:
+        return
+
+    states = _compute_states(nation_ids)
+    existing = {
+        state.nation_id: state
+        for state in TechnologyState.query.filter(TechnologyState.nation_id.in_(nation_ids)).all()
+    }
+    now = datetime.utcnow()
+    for nation_id, values in states.items():
+        state = existing.get(nation_id)
+        if state is None:
+            state = TechnologyState(nation_id=nation_id)
+            db.session.add(state)
+        state.levels = bytes(values['levels'])
+        state.level_sum = values['level_sum']
+        state.production_multiplier = values['production_multiplier']
+        state.consumption_efficiency = values['consumption_efficiency']
+        state.espionage_bonus = values['espionage_bonus']
+        state.updated_at = now
+
+def ensure_technology_states():
+    """Build the state of every nation that has technologies but no state row yet"""
+    missing = db.session.query(Technology.nation_id).outerjoin(
+        TechnologyState, TechnologyState.nation_id == Technology.nation_id
+    ).filter(TechnologyState.nation_id.is_(None)).distinct().all()
+    if missing:
+        rebuild_technology_states([nation_id for nation_id, in missing])
+        db.session.commit()
+
+def get_technology_state(nation_id):
+    """Technology state of a nation. A nation without a state row (one created before
+    the state was built) gets a state computed from its Technology rows; nothing is written."""
+    state = db.session.get(TechnologyState, nation_id)
+    if state is None:
+        state = _state_row(nation_id, _compute_states([nation_id])[nation_id])
+    return state
+
+def get_tech_level(state, tech_id):
+    """Level of a catalog technology in a state"""
+    index = TECH_INDEX.get(tech_id)
+    if index is None or index >= len(state.levels):
+        return 0
+    return state.levels[index]
+
+def get_researched_tech_ids(state):
+    """Catalog ids of the technologies researched (level > 0) in a state"""
+    return [TECH_ID_BY_INDEX[index] for index, level in enumerate(state.levels) if level > 0]
+
+def get_researched_mask(state):
+    """Researched technologies of a state as a tech_graph bitmask"""
+    mask = 0
+    for tech_id in get_researched_tech_ids(state):
+        mask |= TECH_BITS[tech_id]
+    return mask
@@ -2,150 +2,97 @@
 Technology handler for managing technology research and implementation.
 """
 from datetime import datetime, timedelta
+from sqlalchemy import update
 from app import db
 from models import Technology, Nation, Resource
 from data.technologies import TECHNOLOGIES
+from utils.game_logic import invalidate_nation_modifiers, refresh_resource_rates
+from utils.ranking_service import ranking_service
+from utils.research_queue import research_queue
+from utils.tech_state import rebuild_technology_states
+from utils.tech_graph import (
+    TECH_BY_ID,
+    TECH_TIERS,
+    get_tier,
+    parse_prerequisites,
+    prerequisites_met,
+    researched_mask
+)
 import math
 
 def initialize_technologies(nation):
-    """Create initial technologies for a new nation."""
-    tech_count = 0
-    
+    """Create initial technologies for a new nation.
+    Only technologies that do not start at the catalog default (level 0) get a row:
+    basic techs with no prerequisites start at level 1."""
     # Check if nation already has technologies
     existing_techs = Technology.query.filter_by(nation_id=nation.id).count()
     if existing_techs > 0:
         return f"Nation {nation.name} already has {existing_techs} technologies."
     
-    # Add all technologies from the data file
+    tech_count = 0
     for tech_data in TECHNOLOGIES:
-        # Create technology with initial level 0 (undiscovered)
-        # Basic techs with no prerequisites start at level 1
-        initial_level = 0
-        if not tech_data["prerequisites"]:
-            initial_level = 1
-        
-        technology = Technology(
+        if tech_data["prerequisites"]:
+            continue
+        db.session.add(Technology(
             nation_id=nation.id,
-            name=tech_data["name"],
-            description=tech_data["description"],
-            category=tech_data["category"],
-            level=initial_level,
-            max_level=tech_data["max_level"],
-            prerequisites=",".join(str(x) for x in tech_data["prerequisites"]) if tech_data["prerequisites"] else "",
+            tech_id=tech_data["id"],
+            level=1,
             research_points_required=tech_data["research_points_required"],
             research_points_current=0,
             researching=False
-        )
-        db.session.add(technology)
+        ))
         tech_count += 1
     
+    db.session.flush()
+    rebuild_technology_states([nation.id])
     db.session.commit()
-    return f"Added {tech_count} technologies to nation {nation.name}"
+    return f"Added {tech_count} starting technologies to nation {nation.name}"
+
+def _default_technology(nation_id, tech_data):
+    """Unsaved Technology at the catalog default (level 0, not researching)"""
+    return Technology(
+        nation_id=nation_id,
+        tech_id=tech_data["id"],
+        level=0,
+        research_points_required=tech_data["research_points_required"],
+        research_points_current=0,
+        researching=False
+    )
 
-def get_available_technologies(nation):
+def get_nation_technologies(nation):
+    """Every catalog technology for a nation, in catalog order.
+    Technologies the nation has no row for are returned as unsaved defaults."""
+    stored = {tech.tech_id: tech for tech in Technology.query.filter_by(nation_id=nation.id).all()}
+    return [stored.get(tech_data["id"]) or _default_technology(nation.id, tech_data) for tech_data in TECHNOLOGIES]
+
+def get_nation_technology(nation, tech_id):
+    """A nation's technology by catalog id (an unsaved default if it has no row), or None"""
+    tech_data = TECH_BY_ID.get(tech_id)
+    if not tech_data:
+        return None
+    technology = Technology.query.filter_by(nation_id=nation.id, tech_id=tech_id).first()
+    return technology or _default_technology(nation.id, tech_data)
+
+def get_available_technologies(nation, technologies=None):
     """Get technologies that are available for research."""
-    # Get all technologies for this nation
-    all_techs = Technology.query.filter_by(nation_id=nation.id).all()
-    
-    # Create a name-based lookup dictionary for techs
-    tech_name_dict = {}
-    for tech in all_techs:
-        tech_name_dict.setdefault(tech.name, []).append(tech)
+    if technologies is None:
+        technologies = get_nation_technologies(nation)
     
-    # Regular ID-based lookup
-    tech_dict = {tech.id: tech for tech in all_techs}
-    
-    # Also get researched techs by name for prerequisite matching
-    researched_techs_by_name = {}
-    for tech in all_techs:
-        if tech.level > 0:
-            researched_techs_by_name[tech.name] = tech
+    # Researched technologies as a bitmask over the compiled graph
+    researched = researched_mask(technologies)
     
     available_techs = []
-    for tech in all_techs:
-        # Skip if already max level
-        if tech.level >= tech.max_level:
-            print(f"Tech {tech.id} ({tech.name}) already at max level: {tech.level}/{tech.max_level}")
-            continue
-            
-        # Skip if already researching
-        if tech.researching:
-            print(f"Tech {tech.id} ({tech.name}) currently being researched")
-            continue
-            
-        # If no prerequisites or already researched, it's available for further research
-        if not tech.prerequisites or tech.prerequisites.strip() == "":
-            print(f"Tech {tech.id} ({tech.name}) has no prerequisites - available")
-            available_techs.append(tech)
+    for tech in technologies:
+        # Skip if already max level or already researching
+        if tech.level >= tech.max_level or tech.researching:
             continue
-            
-        # Try to find prerequisite by ID or name
-        prereqs_met = True
-        missing_prereqs = []
         
-        # Find prerequisites for this tech from the data file to get names
-        tech_data = None
-        for t_data in TECHNOLOGIES:
-            if t_data["name"] == tech.name:
-                tech_data = t_data
-                break
-                
-        # If we found tech data, get prerequisite names
-        prereq_names = []
-        if tech_data:
-            for prereq_id in tech_data["prerequisites"]:
-                for t_data in TECHNOLOGIES:
-                    if t_data["id"] == prereq_id:
-                        prereq_names.append(t_data["name"])
-                        break
-                        
-        # Try both ID-based and name-based prerequisite checking
-        if prereq_names:
-            # Check if all prerequisite technologies by name are researched
-            for prereq_name in prereq_names:
-                if prereq_name not in researched_techs_by_name:
-                    prereqs_met = False
-                    missing_prereqs.append(f"Tech '{prereq_name}' not researched")
-        else:
-            # Fall back to ID-based checking from the database
-            for prereq_id_str in tech.prerequisites.split(','):
-                if not prereq_id_str.strip():
-                    continue
-                
-                try:
-                    prereq_id = int(prereq_id_str.strip())
-                    
-                    if prereq_id not in tech_dict:
-                        # Try to find any tech with this ID prefix
-                        found = False
-                        for tech_id in tech_dict:
-                            if str(tech_id).endswith(str(prereq_id)):
-                                if tech_dict[tech_id].level > 0:
-                                    found = True
-                                    break
-                                
-                        if not found:
-                            prereqs_met = False
-                            missing_prereqs.append(f"Tech {prereq_id} not found or not researched")
-                    elif tech_dict[prereq_id].level == 0:
-                        prereqs_met = False
-                        missing_prereqs.append(f"Tech {prereq_id} ({tech_dict[prereq_id].name}) level 0")
-                except (ValueError, TypeError) as e:
-                    print(f"Error parsing prerequisite ID '{prereq_id_str}' for tech {tech.id}: {e}")
-                    continue
-                
-        if prereqs_met:
-            print(f"Tech {tech.id} ({tech.name}) has all prerequisites met - available")
+        if prerequisites_met(tech, researched):
             available_techs.append(tech)
-        else:
-            print(f"Tech {tech.id} ({tech.name}) missing prerequisites: {', '.join(missing_prereqs)}")
-    
-    # Print summary
-    print(f"\nFound {len(available_techs)} available technologies out of {len(all_techs)} total")
     
     return available_techs
 
-def get_technologies_by_tier(nation):
+def get_technologies_by_tier(nation, technologies=None):
     """
     Organize technologies into tiers based on prerequisites.
     Tier 0: No prerequisites
@@ -153,124 +100,21 @@ def get_technologies_by_tier(nation):
     Tier 2: Requires at least one Tier 1 technology
     And so on...
     
-    This version uses technology data files to ensure consistent tier calculation,
-    even with database ID inconsistencies.
+    Tiers come from the compiled technology graph.
     """
-    # Get all technologies for this nation
-    all_techs = Technology.query.filter_by(nation_id=nation.id).all()
-    
-    # Create name based mappings for lookup since DB IDs may differ from data file IDs
-    tech_by_name = {}
-    for tech in all_techs:
-        tech_by_name[tech.name] = tech
-    
-    # Map for storing tech_name -> tier
-    tech_name_tiers = {}
-    
-    # First, assign Tier 0 to technologies with no prerequisites in the data file
-    for tech_data in TECHNOLOGIES:
-        if not tech_data.get("prerequisites") or len(tech_data["prerequisites"]) == 0:
-            tech_name_tiers[tech_data["name"]] = 0
-    
-    # Function to determine the tier of a technology by name
-    def get_tier_by_name(tech_name):
-        # If we've already calculated this tech's tier, return it
-        if tech_name in tech_name_tiers:
-            return tech_name_tiers[tech_name]
-        
-        # Find the tech data
-        tech_data = None
-        for t in TECHNOLOGIES:
-            if t["name"] == tech_name:
-                tech_data = t
-                break
-        
-        if not tech_data:
-            return -1  # Tech not found in data file
-        
-        # If no prerequisites, it's Tier 0
-        if not tech_data.get("prerequisites") or len(tech_data["prerequisites"]) == 0:
-            tech_name_tiers[tech_name] = 0
-            return 0
-        
-        # Get the max tier of prerequisites + 1
-        max_prereq_tier = -1
-        for prereq_id in tech_data["prerequisites"]:
-            # Find name of prerequisite
-            prereq_name = None
-            for t in TECHNOLOGIES:
-                if t["id"] == prereq_id:
-                    prereq_name = t["name"]
-                    break
-            
-            if prereq_name and prereq_name in tech_by_name:
-                prereq_tier = get_tier_by_name(prereq_name)
-                max_prereq_tier = max(max_prereq_tier, prereq_tier)
-        
-        # If all prerequisites were invalid or not found, default to Tier 1
-        if max_prereq_tier < 0:
-            tier = 1
-        else:
-            # This tech's tier is one higher than its highest prerequisite
-            tier = max_prereq_tier + 1
-            
-        tech_name_tiers[tech_name] = tier
-        return tier
-    
-    # Calculate tier for each technology using data file as source of truth
-    for tech in all_techs:
-        if tech.name not in tech_name_tiers:
-            get_tier_by_name(tech.name)
-    
-    # Debug information for tier assignment
-    print("\nTechnology Tier Assignment (Using data file mappings):")
-    for tech_name, tier in tech_name_tiers.items():
-        if tech_name in tech_by_name:
-            tech = tech_by_name[tech_name]
-            print(f"Tech '{tech_name}' (DB ID: {tech.id}): Tier {tier}")
-    
-    # Map DB techs to tiers
-    tech_tiers = {}
-    for tech in all_techs:
-        if tech.name in tech_name_tiers:
-            tech_tiers[tech.id] = tech_name_tiers[tech.name]
-        else:
-            # If tech not found in mappings, default to tier based on prerequisites in DB
-            if not tech.prerequisites or tech.prerequisites == "":
-                tech_tiers[tech.id] = 0
-            else:
-                # Assume tier 1 for any tech with prerequisites but no mapping
-                tech_tiers[tech.id] = 1
-    
-    # Organize technologies by tier
-    tech_by_tier = {}
-    for tech_id, tier in tech_tiers.items():
-        if tier not in tech_by_tier:
-            tech_by_tier[tier] = []
-        for tech in all_techs:
-            if tech.id == tech_id:
-                tech_by_tier[tier].append(tech)
-                break
-    
-    # Count technologies in each tier for debugging
-    print("\nTier Distribution:")
-    for tier in range(6):
-        tech_count = len(tech_by_tier.get(tier, []))
-        print(f"Tier {tier}: {tech_count} technologies")
+    if technologies is None:
+        technologies = get_nation_technologies(nation)
     
     # Ensure we have at least empty arrays for tiers 0-5 for visualization
-    for tier in range(6):
-        if tier not in tech_by_tier:
-            tech_by_tier[tier] = []
+    tech_by_tier = {tier: [] for tier in range(6)}
+    for tech in technologies:
+        tech_by_tier.setdefault(get_tier(tech), []).append(tech)
     
     return tech_by_tier
 
 def get_tech_details(tech_id):
     """Get technology details from the data file."""
-    for tech in TECHNOLOGIES:
-        if tech["id"] == tech_id:
-            return tech
-    return None
+    return TECH_BY_ID.get(tech_id)
 
 def get_tech_name_by_id(tech_id):
     """Get technology name from its ID using the data file."""
@@ -320,12 +164,11 @@ def get_tech_effects(nation, tech_id, level=1):
             
     return effects
 
-def start_research(nation, technology_id):
-    """Start researching a technology."""
-    # Validate technology exists and belongs to this nation
-    technology = Technology.query.filter_by(id=technology_id, nation_id=nation.id).first()
+def start_research(nation, tech_id):
+    """Start researching a technology (by catalog id), creating the nation's row on first research."""
+    technology = get_nation_technology(nation, tech_id)
     if not technology:
-        return {"success": False, "message": "Technology not found or does not belong to your nation."}
+        return {"success": False, "message": "Technology not found."}
     
     # Check if already researching
     if technology.researching:
@@ -365,7 +208,7 @@ def start_research(nation, technology_id):
     # Make first levels much quicker, with more moderate growth for higher levels
     # Reduced quadratic factor from 0.3 to 0.15 for more manageable scaling
     level_factor = 1 + (technology.level * 0.15)**2  
-    points_required = technology.research_points_required * level_factor
+    points_required = technology.catalog["research_points_required"] * level_factor
     
     # Increase production points based on nation's research capability
     # Increased base daily points from 50 to 200 for faster early research
@@ -385,6 +228,8 @@ def start_research(nation, technology_id):
     days_needed = minutes_needed / (24 * 60)
     
     # Set technology as researching
+    if technology.id is None:
+        db.session.add(technology)
     technology.researching = True
     technology.research_points_required = points_required
     technology.research_points_current = 0
@@ -392,6 +237,7 @@ def start_research(nation, technology_id):
     technology.estimated_completion = datetime.utcnow() + timedelta(days=days_needed)
     
     db.session.commit()
+    research_queue.schedule(technology.id, technology.estimated_completion)
     
     return {
         "success": True,
@@ -400,12 +246,11 @@ def start_research(nation, technology_id):
         "completion_date": technology.estimated_completion.strftime("%Y-%m-%d %H:%M:%S")
     }
 
-def cancel_research(nation, technology_id):
-    """Cancel researching a technology and refund some resources."""
-    # Validate technology exists and belongs to this nation
-    technology = Technology.query.filter_by(id=technology_id, nation_id=nation.id, researching=True).first()
+def cancel_research(nation, tech_id):
+    """Cancel researching a technology (by catalog id) and refund some resources."""
+    technology = Technology.query.filter_by(tech_id=tech_id, nation_id=nation.id, researching=True).first()
     if not technology:
-        return {"success": False, "message": "Technology not found, does not belong to your nation, or is not being researched."}
+        return {"success": False, "message": "Technology not found or is not being researched."}
     
     # Get the nation's resources
     resources = Resource.query.filter_by(nation_id=nation.id).first()
@@ -434,6 +279,10 @@ def cancel_research(nation, technology_id):
     technology.research_started = None
     technology.estimated_completion = None
     
+    # Back at the catalog default: the row is no longer needed
+    if technology.level == 0:
+        db.session.delete(technology)
+    
     db.session.commit()
     
     return {
@@ -446,89 +295,74 @@ def cancel_research(nation, technology_id):
         }
     }
 
-def update_research_progress():
-    """Update research progress for all technologies in progress.
-    This function is intended to be run periodically (e.g. hourly)."""
-    updated_count = 0
-    completed_count = 0
-    
-    now = datetime.utcnow()
-    research_in_progress = Technology.query.filter_by(researching=True).all()
-    
-    for tech in research_in_progress:
-        nation = Nation.query.get(tech.nation_id)
-        if not nation:
-            continue
-        
-        # Check if research is complete
-        if tech.estimated_completion and now >= tech.estimated_completion:
-            # Research complete - increase level
-            tech.level += 1
-            tech.researching = False
-            # Set research points to the maximum to show 100% in UI
-            tech.research_points_current = tech.research_points_required
-            
-            # Apply technology effects (in a real implementation)
-            
-            completed_count += 1
-            print(f"Research completed: {tech.name} - level {tech.level}")
-        else:
-            # Calculate progress
-            if tech.research_started:
-                elapsed = now - tech.research_started
-                total_time = tech.estimated_completion - tech.research_started
-                if total_time.total_seconds() > 0:  # Prevent division by zero
-                    progress_percent = elapsed.total_seconds() / total_time.total_seconds()
-                    # Round up to 100% if we're very close to completion (99.9%+)
-                    if progress_percent > 0.999:
-                        tech.research_points_current = tech.research_points_required
-                        # Mark as completed and update level immediately to fix timer issues
-                        tech.level += 1
-                        tech.researching = False
-                        completed_count += 1
-                        print(f"Research complete (fixed): {tech.name} - 100.00% - new level {tech.level}")
-                    else:
-                        # Ensure progress reflects correctly by setting points based on time elapsed
-                        tech.research_points_current = min(
-                            tech.research_points_required * progress_percent,
-                            tech.research_points_required
-                        )
-                        updated_count += 1
-                        print(f"Research progress: {tech.name} - {progress_percent*100:.2f}%")
+def complete_due_research(now=None, technology_ids=None):
+    """Complete every research whose estimated completion has passed with one bulk UPDATE.
+    Progress itself is never stored while researching, it is derived from the timestamps
+    (see Technology.research_progress). Returns the number of completed research projects."""
+    if now is None:
+        now = datetime.utcnow()
+    
+    due = db.session.query(Technology.id, Technology.nation_id).filter(
+        Technology.researching == True,
+        Technology.estimated_completion <= now
+    )
+    if technology_ids is not None:
+        if not technology_ids:
+            return 0
+        due = due.filter(Technology.id.in_(technology_ids))
+    due = due.all()
+    if not due:
+        return 0
+    
+    # Research complete - increase level and set points to the maximum to show 100% in UI.
+    # Only the rows this UPDATE flips count: a concurrent caller may have completed some of them.
+    completed = db.session.execute(
+        update(Technology)
+        .where(Technology.id.in_([tech_id for tech_id, _ in due]), Technology.researching == True)
+        .values(
+            level=Technology.level + 1,
+            researching=False,
+            research_points_current=Technology.research_points_required
+        )
+        .returning(Technology.id, Technology.nation_id)
+    ).all()
+    if not completed:
+        db.session.commit()
+        return 0
+    
+    completed_nation_ids = {nation_id for _, nation_id in completed}
+    rebuild_technology_states(completed_nation_ids)
+    for nation_id in completed_nation_ids:
+        invalidate_nation_modifiers(nation_id)
+        nation = Nation.query.get(nation_id)
+        if nation:
+            refresh_resource_rates(nation)
+    for _, nation_id in completed:
+        ranking_service.adjust_score('technology', nation_id, 1)
     
     db.session.commit()
-    
-    return {
-        "updated_count": updated_count,
-        "completed_count": completed_count
-    }
+    return len(completed)
 
 def get_technology_tree(nation):
     """Get the complete technology tree for visualization."""
-    technologies = Technology.query.filter_by(nation_id=nation.id).all()
-    
-    # Get additional details from the data file
     tech_tree = []
-    for tech in technologies:
-        tech_data = get_tech_details(tech.id)
+    for tech in get_nation_technologies(nation):
+        tech_data = tech.catalog
         
-        # Skip if not found in data file
-        if not tech_data:
-            continue
-            
-        # Create node for the tech tree
+        # Create node for the tech tree (ids are catalog ids, like the prerequisites)
         node = {
-            "id": tech.id,
+            "id": tech.tech_id,
             "name": tech.name,
             "category": tech.category,
             "level": tech.level,
             "max_level": tech.max_level,
             "description": tech.description,
             "researching": tech.researching,
-            "progress": tech.research_points_current / tech.research_points_required if tech.researching and tech.research_points_required > 0 else 0,
-            "prerequisites": [int(x) for x in tech.prerequisites.split(',') if x],
+            "progress": tech.research_progress() if tech.researching else 0,
+            "prerequisites": parse_prerequisites(tech.prerequisites),
+            "tier": TECH_TIERS[tech.tech_id],
             "flavor_text": tech_data.get("flavor_text", ""),
-            "effects": get_tech_effects(nation, tech.id, tech.level)
+            "effects": get_tech_effects(nation, tech.tech_id, tech.level)
         }
         
         if tech.researching:
@@ -558,11 +392,7 @@ def apply_technology_effects(nation):
     }
     
     for tech in technologies:
-        tech_data = get_tech_details(tech.id)
-        if not tech_data:
-            continue
-            
-        tech_effects = get_tech_effects(nation, tech.id, tech.level)
+        tech_effects = get_tech_effects(nation, tech.tech_id, tech.level)
         
         for effect_key, effect_value in tech_effects.items():
             if effect_key in effects and isinstance(effect_value, (int, float)):
@@ -0,0 +1,244 @@
+"""
+Market trade settlement with guarded single-statement updates.
+
+Buying a listing never reads and re-writes balances in Python. The listing is
+flipped inactive only `WHERE is_active`, the buyer is debited only `WHERE` their
+accrued currency covers the price, and the seller is credited with an increment,
+so concurrent buyers in any number of worker processes can settle trades in
+parallel: the first flip wins, every other buyer sees zero updated rows and no
+listing is filled twice. Resource rows are written in nation id order so two
+opposite trades cannot deadlock. Callers commit (or roll back) the transaction.
+
+Expired orders are swept the same way: the refunds of all expired listings and
+bids are summed per nation in SQL and credited with one update per nation.
+"""
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import bindparam, func, select, update
+from app import db
+from models import MarketItem, MarketBid, Resource, Trade, accrued_amount_sql, credited_amount_sql
+from utils.price_history import record_trades
+
+def _claim_listing(listing_id, **conditions):
+    """Flip an active listing to inactive; False if it was no longer active (or
+    no longer matches `conditions`, e.g. the quantity that was read)"""
+    result = db.session.execute(
+        update(MarketItem)
+        .where(MarketItem.id == listing_id, MarketItem.is_active == True, *[
+            getattr(MarketItem, column) == value for column, value in conditions.items()
+        ])
+        .values(is_active=False)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def _release_listing(listing_id):
+    """Undo _claim_listing within the same transaction"""
+    db.session.execute(
+        update(MarketItem).where(MarketItem.id == listing_id).values(is_active=True)
+        .execution_options(synchronize_session=False)
+    )
+
+def _debit_buyer(listing, buyer_nation_id, now):
+    """Take the price from the buyer and hand over the goods, only if the buyer's
+    current currency covers the price. Returns whether the buyer was debited."""
+    result = db.session.execute(
+        update(Resource)
+        .where(
+            Resource.nation_id == buyer_nation_id,
+            accrued_amount_sql('currency', now) >= listing.total_price
+        )
+        .values({
+            Resource.currency: Resource.currency - listing.total_price,
+            getattr(Resource, listing.resource_type): credited_amount_sql(listing.resource_type, listing.quantity, now)
+        })
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def _credit_seller(seller_nation_id, amount):
+    """Add currency to a nation (the seller of a trade, or a refunded bidder)"""
+    db.session.execute(
+        update(Resource)
+        .where(Resource.nation_id == seller_nation_id)
+        .values(currency=Resource.currency + amount)
+        .execution_options(synchronize_session=False)
+    )
+
+def _expire_resources(*nation_ids):
+    """Resource rows of these nations already loaded in the session are stale
+    after the updates; expire them so they reload (and re-settle) on next access"""
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Resource) and obj.nation_id in nation_ids:
+            db.session.expire(obj)
+
+def settle_purchase(listing_id, buyer_nation_id, now=None):
+    """Buy a whole listing for a nation.
+    Returns {'success', 'message', 'listing', 'trade'}; on failure nothing is changed."""
+    if now is None:
+        now = datetime.utcnow()
+
+    listing = db.session.get(MarketItem, listing_id)
+    if not listing:
+        return {'success': False, 'message': 'This listing does not exist.', 'listing': None, 'trade': None}
+    if listing.seller_id == buyer_nation_id:
+        return {'success': False, 'message': 'You cannot buy your own listing.', 'listing': listing, 'trade': None}
+
+    # The whole remaining quantity, unless part of it was matched meanwhile
+    if not _claim_listing(listing_id, quantity=listing.quantity):
+        return {'success': False, 'message': 'This listing is no longer active.', 'listing': listing, 'trade': None}
+
+    # Lower nation id first, so opposite trades lock the two rows in the same order
+    seller_first = listing.seller_id < buyer_nation_id
+    if seller_first:
+        _credit_seller(listing.seller_id, listing.total_price)
+    if not _debit_buyer(listing, buyer_nation_id, now):
+        if seller_first:
+            _credit_seller(listing.seller_id, -listing.total_price)
+        _release_listing(listing_id)
+        return {'success': False, 'message': 'Not enough currency to complete this purchase.', 'listing': listing, 'trade': None}
+    if not seller_first:
+        _credit_seller(listing.seller_id, listing.total_price)
+    _expire_resources(listing.seller_id, buyer_nation_id)
+
+    trade_values = {
+        "seller_id": listing.seller_id,
+        "buyer_id": buyer_nation_id,
+        "market_item_id": listing.id,
+        "resource_type": listing.resource_type,
+        "quantity": listing.quantity,
+        "price_per_unit": listing.price_per_unit,
+        "total_price": listing.total_price,
+        "trade_date": now
+    }
+    trade = Trade(**trade_values)
+    db.session.add(trade)
+    record_trades([trade_values])
+    return {
+        'success': True,
+        'message': f'Successfully purchased {listing.quantity} {listing.resource_type}.',
+        'listing': listing,
+        'trade': trade
+    }
+
+def withdraw_listing(listing_id, seller_nation_id, now=None):
+    """Withdraw a seller's active listing and return the goods.
+    Returns {'success', 'message', 'listing'}; on failure nothing is changed."""
+    if now is None:
+        now = datetime.utcnow()
+
+    listing = db.session.get(MarketItem, listing_id)
+    if not listing:
+        return {'success': False, 'message': 'This listing does not exist.', 'listing': None}
+    if listing.seller_id != seller_nation_id:
+        return {'success': False, 'message': 'You do not own this listing.', 'listing': listing}
+
+    # A listing being bought at the same moment is either sold or cancelled, never both
+    if not _claim_listing(listing_id, seller_id=seller_nation_id, quantity=listing.quantity):
+        return {'success': False, 'message': 'This listing is no longer active.', 'listing': listing}
+
+    db.session.execute(
+        update(Resource)
+        .where(Resource.nation_id == seller_nation_id)
+        .values({getattr(Resource, listing.resource_type): credited_amount_sql(listing.resource_type, listing.quantity, now)})
+        .execution_options(synchronize_session=False)
+    )
+    _expire_resources(seller_nation_id)
+    return {
+        'success': True,
+        'message': f'Listing cancelled. {listing.quantity} {listing.resource_type} returned to your inventory.',
+        'listing': listing
+    }
+
+def withdraw_bid(bid_id, bidder_nation_id):
+    """Cancel a nation's standing buy order and refund the currency held for it.
+    Returns {'success', 'message', 'bid'}; on failure nothing is changed."""
+    bid = db.session.get(MarketBid, bid_id)
+    if not bid:
+        return {'success': False, 'message': 'This buy order does not exist.', 'bid': None}
+    if bid.bidder_id != bidder_nation_id:
+        return {'success': False, 'message': 'You do not own this buy order.', 'bid': bid}
+
+    # Refund exactly the quantity that was read, unless it was matched meanwhile
+    result = db.session.execute(
+        update(MarketBid)
+        .where(
+            MarketBid.id == bid_id,
+            MarketBid.bidder_id == bidder_nation_id,
+            MarketBid.is_active == True,
+            MarketBid.quantity == bid.quantity
+        )
+        .values(is_active=False)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return {'success': False, 'message': 'This buy order is no longer active.', 'bid': bid}
+
+    _credit_seller(bidder_nation_id, bid.quantity * bid.price_per_unit)
+    _expire_resources(bidder_nation_id)
+    return {
+        'success': True,
+        'message': f'Buy order cancelled. {bid.quantity * bid.price_per_unit:,.2f} currency returned.',
+        'bid': bid
+    }
+
+def _expired_refunds(model, owner_column, refund, now):
+    """Lock the expired active orders of a table and sum their refunds per
+    (owner, resource type) in SQL. Returns ({(owner, resource_type): amount}, count)."""
+    expired = (model.is_active == True, model.expires_at < now)
+    locked_ids = select(model.id).where(*expired).with_for_update()
+    rows = db.session.execute(
+        select(owner_column, model.resource_type, func.sum(refund), func.count())
+        .where(model.id.in_(locked_ids))
+        .group_by(owner_column, model.resource_type)
+    ).all()
+
+    # Flip exactly the rows that were summed; anything else means a concurrent change
+    flipped = db.session.execute(
+        update(model).where(*expired).values(is_active=False)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    count = sum(row[3] for row in rows)
+    if flipped != count:
+        raise RuntimeError(f"{model.__tablename__}: summed {count} expired orders but deactivated {flipped}")
+    return {(owner_id, resource_type): amount for owner_id, resource_type, amount, _ in rows}, count
+
+def expire_market_orders(now=None):
+    """Deactivate every expired listing and bid and refund their goods and currency,
+    with one update per refunded nation. Returns (listings expired, bids expired);
+    the caller commits."""
+    if now is None:
+        now = datetime.utcnow()
+
+    listing_refunds, listing_count = _expired_refunds(MarketItem, MarketItem.seller_id, MarketItem.quantity, now)
+    bid_refunds, bid_count = _expired_refunds(
+        MarketBid, MarketBid.bidder_id, MarketBid.quantity * MarketBid.price_per_unit, now
+    )
+
+    # nation_id -> {resource column: amount}; bids refund the currency they held
+    refunds = defaultdict(lambda: defaultdict(float))
+    for (nation_id, resource_type), amount in listing_refunds.items():
+        refunds[nation_id][resource_type] += amount
+    for (nation_id, _), amount in bid_refunds.items():
+        refunds[nation_id]['currency'] += amount
+
+    # One update per nation in nation id order, so refunds and trades lock rows in the same order;
+    # nations refunding the same columns reuse one statement
+    resource_table = Resource.__table__
+    statements = {}
+    for nation_id in sorted(refunds):
+        amounts = refunds[nation_id]
+        columns = tuple(sorted(amounts))
+        if columns not in statements:
+            statements[columns] = update(resource_table).where(
+                resource_table.c.nation_id == bindparam('b_nation')
+            ).values({
+                resource_table.c[column]: credited_amount_sql(column, bindparam(f"b_{column}"), now)
+                for column in columns
+            })
+        db.session.execute(
+            statements[columns],
+            {"b_nation": nation_id, **{f"b_{column}": amount for column, amount in amounts.items()}}
+        )
+    _expire_resources(*refunds)
+    return listing_count, bid_count